@@ -1,6 +1,5 @@
 import streamlit as st
-import pandas as pd
-from pathlib import Path
+from engine.dataset import load_games_head, shared_dataset
 
 st.set_page_config(page_title="Chess Opening Trainer", layout="wide")
 st.title("Chess Opening Trainer")
@@ -17,44 +16,32 @@ Use the tabs in the sidebar to:
 """)
 
 # # LOAD THE DATASET
-@st.cache_data
-def load_data(file_path, sep=";", n_rows=None, index_col=None):
-    print(f"Cache miss: Loading data from {file_path}...")
-    df = pd.read_csv(file_path, sep=sep, nrows=n_rows, index_col=index_col)
-    return df
-
-# Define the file path
-base_path = Path(__file__).resolve().parent
-
-# Load into session_state if not already loaded
-if "df" not in st.session_state:
-    file_path = "pages/data/games_clean.csv"
-    st.session_state.df = load_data(file_path, index_col="ID")
+# The pages load the parts of the dataset they need in the background the first time they are opened,
+# the home page only reads a small precomputed summary (built with python -m pipeline.aggregates)
+dataset = shared_dataset("pages/data")
 
-if "white_to_move_fens" not in st.session_state:
-    file_path = "pages/data/white_to_move_fens.csv"
-    st.session_state.white_to_move_fens = load_data(file_path, index_col="ID")
-
-if "black_to_move_fens" not in st.session_state:
-    file_path = "pages/data/black_to_move_fens.csv"
-    st.session_state.black_to_move_fens = load_data(file_path, index_col="ID")
-
-df = st.session_state.df
+@st.cache_data
+def load_sample(data_dir, n_rows=10):
+    """Reads the first games of the dataset for the preview, without loading the whole dataset."""
+    return load_games_head(data_dir, n_rows)
 
 # select statistics
 st.subheader("Dataset Overview")
+with st.spinner("Summarizing the dataset..."): #only waits if summary.json was not built
+    summary = dataset.get("summary")
 
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    st.metric("Total Games", f"{len(df):,}")
+    st.metric("Total Games", f"{summary['n_games']:,}")
 
 with col2:
-    st.metric("Unique Openings", df['Opening'].nunique())
+    st.metric("Unique Openings", summary["n_openings"])
 
 with col3:
-    st.metric("Average Game Length", f"{df['Moves'].apply(lambda x: len(str(x).split())).mean():.1f} moves")
+    #the length counts the tokens of the move string ("1.", "e4", "e5", ...): the half-moves plus the move numbers
+    st.metric("Average Game Length", f"{summary['average_length']:.1f} moves")
 
 # dataset preview
 with st.expander("Show sample data", expanded=False):
-    st.dataframe(df.head(10))
+    st.dataframe(load_sample("pages/data"))
@@ -0,0 +1,3 @@
+"""
+Benchmarks of the pipeline stages and the query hot paths on synthetic data sets of configurable size.
+"""
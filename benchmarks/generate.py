@@ -0,0 +1,164 @@
+"""
+Generates a synthetic lichess-style PGN dump (.pgn.zst) of any size for the benchmarks.
+
+Every game starts with a line drawn from a weighted opening book, so the opening tree has a realistic shape
+(a few very popular lines and a long tail). With --seed-dir the lines are the first 8-24 half-moves of real games
+instead. The game is continued with random legal moves up to a random length. About 10% of the games have
+a player rated below 2600 or an "Abandoned" termination, so the cleaning rules of the ingest stage have work to do.
+
+Usage:
+    python -m benchmarks.generate --games 100000 --output /tmp/bench/games_100k.pgn.zst
+    python -m benchmarks.generate --games 1000000 --seed-dir pages/data --output /tmp/bench/games_1m.pgn.zst
+"""
+import argparse
+import os
+import random
+import time
+from pathlib import Path
+
+import chess
+import zstandard as zstd
+
+from pipeline.games import iter_game_batches, open_games
+from pipeline.parallel import ordered_map
+
+#(ECO, opening name, moves, weight)
+OPENING_BOOK = [
+    ("B90", "Sicilian Defense: Najdorf Variation", "e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6", 8),
+    ("B30", "Sicilian Defense: Old Sicilian", "e4 c5 Nf3 Nc6", 6),
+    ("B22", "Sicilian Defense: Alapin Variation", "e4 c5 c3", 4),
+    ("C65", "Ruy Lopez: Berlin Defense", "e4 e5 Nf3 Nc6 Bb5 Nf6", 6),
+    ("C50", "Italian Game", "e4 e5 Nf3 Nc6 Bc4", 6),
+    ("C42", "Petrov's Defense", "e4 e5 Nf3 Nf6", 3),
+    ("C00", "French Defense", "e4 e6 d4 d5", 5),
+    ("B12", "Caro-Kann Defense: Advance Variation", "e4 c6 d4 d5 e5", 4),
+    ("B10", "Caro-Kann Defense", "e4 c6", 3),
+    ("B01", "Scandinavian Defense", "e4 d5 exd5", 3),
+    ("B07", "Pirc Defense", "e4 d6 d4 Nf6 Nc3 g6", 2),
+    ("D37", "Queen's Gambit Declined", "d4 d5 c4 e6 Nc3 Nf6", 6),
+    ("D10", "Slav Defense", "d4 d5 c4 c6", 4),
+    ("D02", "Queen's Pawn Game: London System", "d4 d5 Nf3 Nf6 Bf4", 5),
+    ("E60", "King's Indian Defense", "d4 Nf6 c4 g6 Nc3 Bg7", 4),
+    ("E20", "Nimzo-Indian Defense", "d4 Nf6 c4 e6 Nc3 Bb4", 4),
+    ("D85", "Grunfeld Defense: Exchange Variation", "d4 Nf6 c4 g6 Nc3 d5 cxd5 Nxd5", 2),
+    ("A45", "Indian Defense", "d4 Nf6", 3),
+    ("A04", "Zukertort Opening", "Nf3", 4),
+    ("A10", "English Opening", "c4", 5),
+    ("A00", "Hungarian Opening", "g3", 2),
+    ("A40", "Modern Defense", "d4 g6", 2),
+    ("A80", "Dutch Defense", "d4 f5", 1),
+    ("A00", "Van't Kruijs Opening", "e3", 1),
+]
+TIME_CONTROLS = [("60+0", 25), ("180+0", 30), ("180+2", 10), ("300+0", 15), ("600+0", 10), ("900+10", 6), ("1800+0", 4)]
+TERMINATIONS = [("Normal", 70), ("Time forfeit", 27), ("Abandoned", 3)]
+ID_CHARS = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+ID_MULTIPLIER = 2_654_435_761 #odd and not divisible by 31, so game numbers map to distinct IDs
+ID_SEED_STRIDE = 1 << 32 #the games of different seeds (e.g. the dumps of two months) get distinct IDs
+
+# -----------------------------------------------------------------------------
+# 1. GAMES
+# -----------------------------------------------------------------------------
+def game_id(number, seed = 0):
+    """Returns a unique 8 character lichess-style ID of the game number in the dump of a seed."""
+    value = (seed * ID_SEED_STRIDE + number) * ID_MULTIPLIER % len(ID_CHARS) ** 8
+    chars = []
+    for _ in range(8):
+        value, i = divmod(value, len(ID_CHARS))
+        chars.append(ID_CHARS[i])
+    return "".join(chars)
+
+def to_move_str(sans):
+    """Returns the moves in the "1. e4 e5 2. Nf3" format."""
+    return " ".join(f"{i // 2 + 1}. {san}" if i % 2 == 0 else san for i, san in enumerate(sans))
+
+def play_game(rng, site_id, eco, opening, line):
+    """
+    Plays the opening line and continues with random legal moves, returns the PGN text of the game.
+    """
+    board = chess.Board()
+    sans = []
+    for san in line:
+        sans.append(san)
+        board.push_san(san)
+
+    length = max(len(sans), min(int(rng.gauss(80, 30)), 250))
+    moves = list(board.legal_moves)
+    while len(sans) < length and moves:
+        sans.append(board.san_and_push(rng.choice(moves)))
+        moves = list(board.legal_moves) #also tells if the game is over, cheaper than board.is_game_over()
+
+    if not moves and board.is_check():
+        result = "0-1" if board.turn == chess.WHITE else "1-0"
+    elif not moves: #stalemate
+        result = "1/2-1/2"
+    else:
+        result = rng.choices(["1-0", "1/2-1/2", "0-1"], [45, 12, 43])[0]
+
+    low = rng.random() < 0.07 #one player below the rating limit, dropped by the ingest stage
+    white_elo = rng.randint(2000, 2599) if low else rng.randint(2600, 3200)
+    black_elo = rng.randint(2600, 3200)
+    time_control = rng.choices([tc for tc, _ in TIME_CONTROLS], [w for _, w in TIME_CONTROLS])[0]
+    termination = rng.choices([t for t, _ in TERMINATIONS], [w for _, w in TERMINATIONS])[0]
+    return (f'[Event "Rated game"]\n[Site "https://lichess.org/{site_id}"]\n[White "player{rng.randrange(5000)}"]\n'
+            f'[Black "player{rng.randrange(5000)}"]\n[Result "{result}"]\n[WhiteElo "{white_elo}"]\n[BlackElo "{black_elo}"]\n'
+            f'[ECO "{eco}"]\n[Opening "{opening}"]\n[TimeControl "{time_control}"]\n[Termination "{termination}"]\n\n'
+            f'{to_move_str(sans)} {result}\n\n')
+
+def generate_batch(first, n_games, lines, weights, seed):
+    """Returns the PGN text of the games first ... first + n_games - 1 (deterministic for a seed)."""
+    rng = random.Random(seed * 1_000_003 + first)
+    chosen = rng.choices(lines, weights, k = n_games)
+    games = [play_game(rng, game_id(first + i, seed), eco, opening, line) for i, (eco, opening, line) in enumerate(chosen)]
+    return "".join(games).encode("utf-8")
+
+def generate_batch_args(batch, lines, weights, seed):
+    """generate_batch for a (first game, number of games) item of ordered_map."""
+    first, n_games = batch
+    return generate_batch(first, n_games, lines, weights, seed)
+
+# -----------------------------------------------------------------------------
+# 2. OPENING LINES
+# -----------------------------------------------------------------------------
+def book_lines():
+    """Returns the opening book as (ECO, opening, list of SAN moves) lines and their weights."""
+    return [(eco, name, moves.split()) for eco, name, moves, _ in OPENING_BOOK], [weight for *_, weight in OPENING_BOOK]
+
+def seed_lines(seed_dir, n_lines = 20000, seed = 0):
+    """Returns the first 8-24 half-moves of (up to) n_lines real games in seed_dir, all with weight 1."""
+    rng = random.Random(seed)
+    lines = []
+    for _, batch in iter_game_batches(open_games(seed_dir), ["ECO", "Opening", "Moves"], 10000):
+        for eco, opening, moves in zip(batch["ECO"], batch["Opening"], batch["Moves"]):
+            sans = [token for token in str(moves).split() if not token.endswith(".")]
+            lines.append((eco, opening, sans[:rng.randint(8, 24)]))
+        if len(lines) >= n_lines:
+            break
+    return lines[:n_lines], [1] * min(len(lines), n_lines)
+
+def generate_dump(n_games, output, seed_dir = None, seed = 0, workers = None, batch_size = 2000):
+    """Writes n_games synthetic games to the zstd-compressed PGN file output."""
+    start = time.time()
+    workers = workers or os.cpu_count()
+    lines, weights = seed_lines(seed_dir, seed = seed) if seed_dir else book_lines()
+    Path(output).parent.mkdir(parents = True, exist_ok = True)
+
+    batches = ((first, min(batch_size, n_games - first)) for first in range(0, n_games, batch_size))
+    done = 0
+    with open(output, "wb") as out_f, zstd.ZstdCompressor(level = 3).stream_writer(out_f) as writer:
+        for text in ordered_map(generate_batch_args, batches, workers, lines, weights, seed):
+            writer.write(text)
+            done += text.count(b"[Event ")
+    print(f"Finished. Generated {done} games in {time.time() - start:.2f} seconds -> {output}")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate a synthetic lichess-style PGN dump for the benchmarks.")
+    parser.add_argument("--games", type = int, default = 10000, help = "number of games")
+    parser.add_argument("--output", default = "benchmarks/data/games.pgn.zst", help = "path of the .pgn.zst file")
+    parser.add_argument("--seed-dir", default = None, help = "take the opening lines from the games in this folder")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed, the same seed gives the same games (use one seed per month, the IDs depend on it)")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    args = parser.parse_args()
+    generate_dump(args.games, args.output, args.seed_dir, args.seed, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Runs the pipeline stages and the query hot paths on synthetic data sets and writes the timings and memory peaks
+to a JSON file, so runs on different data or code versions can be compared.
+
+For every size a dump is generated (benchmarks.generate) and cleaned with the ingest stage, then the move codes,
+position keys, statistics and opening tree are built and the queries of the trainer pages are timed on positions
+sampled from the games (uncached, so every query does the full work).
+
+Usage:
+    python -m benchmarks.run --games 10000 100000 --work-dir /tmp/bench --output benchmarks/results.json
+    python -m benchmarks.run --games 100000 --work-dir /tmp/bench --compare benchmarks/results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import chess
+import numpy as np
+
+from benchmarks.generate import generate_dump
+from engine.query import load_engine
+from pipeline.aggregates import build_statistics
+from pipeline.ingest import extract_games
+from pipeline.moves import generate_move_codes
+from pipeline.opening_tree import build_opening_tree, position_key
+from pipeline.position_index import build_position_index
+from pipeline.positions import generate_position_keys
+
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+REGRESSION_RATIO = 1.25 #a stage that is this much slower than in the compared run is reported as a regression
+NOISE = {"stages": 0.05, "queries": 0.5} #smaller differences (seconds, milliseconds) are never regressions
+
+# -----------------------------------------------------------------------------
+# 1. MEASUREMENTS
+# -----------------------------------------------------------------------------
+def peak_rss_mb():
+    """Returns the peak resident memory of this process and of its finished worker processes in MB."""
+    if resource is None:
+        return None, None
+    scale = 1 / 2**20 if sys.platform == "darwin" else 1 / 2**10 #bytes on macOS, kB on Linux
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1))
+
+def measure(results, name, func, items = None):
+    """Runs func() once, appends its time and the memory peaks to results and returns its return value."""
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    rss, children_rss = peak_rss_mb()
+    stage = {"name": name, "seconds": round(seconds, 4), "peak_rss_mb": rss, "workers_peak_rss_mb": children_rss}
+    if items:
+        stage["items"] = items
+        stage["items_per_second"] = round(items / seconds, 1)
+    results.append(stage)
+    print(f"{name}: {seconds:.3f} s, peak RSS {rss} MB")
+    return value
+
+def measure_queries(results, name, func, inputs):
+    """Runs func on every input and appends the latency percentiles to results."""
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        func(value)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    results.append({"name": name, "queries": len(latencies), "mean_ms": round(float(latencies.mean()), 3),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 3), "p99_ms": round(float(np.percentile(latencies, 99)), 3)})
+    print(f"{name}: mean {latencies.mean():.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+
+def sample_lines(engine, n, max_plies = 20, seed = 0):
+    """Returns (move string, board) pairs of n positions reached in random games after 0 to max_plies half-moves."""
+    rng = random.Random(seed)
+    moves = engine.df["Moves"]
+    samples = []
+    for _ in range(n):
+        tokens = str(moves.iloc[rng.randrange(len(moves))]).split()
+        plies = rng.randint(0, max_plies)
+        moves_str = " ".join(tokens[:plies + plies // 2 + plies % 2]) #with the move numbers, e.g. "1. e4 e5 2. Nf3"
+        board = chess.Board()
+        for token in moves_str.split():
+            if not token.endswith("."):
+                board.push_san(token)
+        samples.append((moves_str, board))
+    return samples
+
+# -----------------------------------------------------------------------------
+# 2. BENCHMARK OF ONE SIZE
+# -----------------------------------------------------------------------------
+def run_size(n_games, work_dir, workers, n_queries, seed_dir = None):
+    """Benchmarks the pipeline and the queries on n_games synthetic games, returns the results of this size."""
+    data_dir = Path(work_dir) / f"games_{n_games}"
+    dump_path = Path(work_dir) / f"games_{n_games}.pgn.zst"
+    stages, queries = [], []
+
+    if not dump_path.exists(): #the dump is kept between runs, generating it is not part of the benchmark
+        generate_dump(n_games, dump_path, seed_dir, workers = workers)
+
+    #pipeline stages
+    checked, loaded = measure(stages, "ingest.extract_games", lambda: extract_games(dump_path, data_dir, workers = workers), n_games)
+    measure(stages, "moves.generate_move_codes", lambda: generate_move_codes(data_dir, workers), loaded)
+    for name in ["position_keys.npy", "position_key_ids.npy"]: #start from scratch, not from the previous run
+        (data_dir / name).unlink(missing_ok = True)
+    measure(stages, "positions.generate_position_keys", lambda: generate_position_keys(data_dir, workers = workers), loaded)
+    measure(stages, "position_index.build_position_index", lambda: build_position_index(data_dir, workers = workers), loaded)
+    measure(stages, "aggregates.build_statistics", lambda: build_statistics(data_dir), loaded)
+    measure(stages, "opening_tree.build_opening_tree", lambda: build_opening_tree(data_dir, workers = workers), loaded)
+
+    #loading and indexes
+    engine = measure(stages, "engine.load_engine", lambda: load_engine(data_dir), loaded)
+    measure(stages, "engine.prefix_index", lambda: engine.prefix_index, loaded)
+    measure(stages, "engine.position_index", lambda: engine.position_index, loaded)
+    measure(stages, "engine.filter_bitmaps", lambda: engine.filter_bitmaps, loaded)
+
+    #queries, answered from the games (no opening tree, no result cache)
+    samples = sample_lines(engine, n_queries)
+    boards = [board for _, board in samples]
+    blitz = {"TimeControl": ["Blitz"]}
+    measure_queries(queries, "find_line + statistics", lambda sample: engine.insights(engine.find_line(sample[0])), samples)
+    measure_queries(queries, "find_position + statistics", lambda board: engine.insights(engine.find_position(board)), boards)
+    measure_queries(queries, "find_position + statistics (blitz)", lambda board: engine.insights(engine.find_position(board, blitz)), boards)
+    measure_queries(queries, "opening tree node", lambda board: engine.tree_insights("position", position_key(board), board), boards)
+    measure_queries(queries, f"query_many ({len(boards)} positions)", engine.query_many, [boards])
+
+    return {"games": n_games, "loaded_games": loaded, "stages": stages, "queries": queries}
+
+# -----------------------------------------------------------------------------
+# 3. REPORT
+# -----------------------------------------------------------------------------
+def git_commit():
+    """Returns the current git commit of the repository (None outside a git checkout)."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, previous):
+    """
+    Prints the ratio of every stage and query to the previous report (same game counts only).
+    Returns the names of the regressions (slower than REGRESSION_RATIO times the previous time).
+    """
+    regressions = []
+    previous_runs = {run["games"]: run for run in previous["runs"]}
+    for run in report["runs"]:
+        old = previous_runs.get(run["games"])
+        if old is None:
+            continue
+        for group, key in [("stages", "seconds"), ("queries", "p50_ms")]:
+            old_values = {item["name"]: item[key] for item in old[group]}
+            for item in run[group]:
+                new_value, old_value = item[key], old_values.get(item["name"])
+                if not old_value:
+                    continue
+                ratio = new_value / old_value
+                flag = "  REGRESSION" if ratio > REGRESSION_RATIO and new_value - old_value > NOISE[group] else ""
+                print(f"{run['games']:>10} {item['name']:<40} {old_value:>10.3f} -> {new_value:>10.3f} ({ratio:.2f}x){flag}")
+                if flag:
+                    regressions.append(f"{run['games']} games: {item['name']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the pipeline stages and the trainer queries on synthetic data.")
+    parser.add_argument("--games", type = int, nargs = "+", default = [10000], help = "data set sizes, e.g. 10000 100000 1000000")
+    parser.add_argument("--work-dir", default = "benchmarks/data", help = "where the dumps and data files are written")
+    parser.add_argument("--queries", type = int, default = 200, help = "positions per query benchmark")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--seed-dir", default = None, help = "take the opening lines of the synthetic games from this folder")
+    parser.add_argument("--output", default = None, help = "write the results to this JSON file")
+    parser.add_argument("--compare", default = None, help = "compare with the results of a previous run, exit code 1 on regressions")
+    args = parser.parse_args()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": [run_size(n_games, args.work_dir, args.workers, args.queries, args.seed_dir) for n_games in args.games],
+    }
+    if args.output:
+        Path(args.output).parent.mkdir(parents = True, exist_ok = True)
+        with open(args.output, "w", encoding = "utf-8") as out_f:
+            json.dump(report, out_f, indent = 2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding = "utf-8") as in_f:
+            regressions = compare(report, json.load(in_f))
+        if regressions:
+            print("Regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+"""
+Headless query engine of the opening trainer: owns the loaded data set and its indexes and answers
+line and position queries without Streamlit, so it can be used by the pages, scripts and offline jobs.
+
+Example:
+    from engine import load_engine
+    engine = load_engine("pages/data")
+    moves, openings, top_games, results = engine.query_position("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+"""
+from engine.dataset import LazyDataset, load_dataset, shared_dataset
+from engine.disk_cache import DiskCache
+from engine.query import Insights, Matches, QueryEngine, load_engine, shared_engine
+from engine.shards import ShardedEngine
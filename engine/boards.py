@@ -0,0 +1,78 @@
+"""
+Rendering the boards of the trainer as SVG images, cached for the whole process.
+
+The image of a board only depends on the position, the orientation, the highlighted last move and the size, so the
+renders are shared by all sessions in a memory-bounded LRU cache and a rerun of the page (a filter, a flip of the
+other board, ...) does not render the board again. start_warming renders the most popular positions of the
+opening tree in the background when the app starts.
+
+Example:
+    svg = board_svg(board, last_move = board.move_stack[-1], size = 500, orientation = chess.BLACK)
+"""
+import threading
+
+import chess
+import chess.svg
+
+from engine.cache import ResultCache
+from engine.metrics import metrics
+
+SVG_CACHE_MB = 32 #a board of 500 px is about 20 KB of SVG
+
+_svg_cache = ResultCache(SVG_CACHE_MB << 20, getsizeof = len)
+_warmed = set()
+_warmed_lock = threading.Lock()
+
+# -----------------------------------------------------------------------------
+# 1. RENDERING
+# -----------------------------------------------------------------------------
+def board_svg(board, last_move = None, size = 500, orientation = chess.WHITE):
+    """
+    Returns the SVG image of the board, rendered once per (EPD, orientation, last move, size) for all sessions.
+    """
+    key = (board.epd(), bool(orientation), last_move.uci() if last_move else None, size)
+    def render():
+        with metrics.timer("svg_render"):
+            if last_move:
+                #visualizes the last move
+                return chess.svg.board(board = board, lastmove = last_move, size = size, orientation = orientation)
+            return chess.svg.board(board = board, size = size, orientation = orientation)
+    return _svg_cache.get_or_compute(key, render)
+
+def svg_cache_stats():
+    """Returns the hit/miss counters and the size of the render cache."""
+    return _svg_cache.stats()
+
+# -----------------------------------------------------------------------------
+# 2. WARMING
+# -----------------------------------------------------------------------------
+def warm_boards(engine, depth = 4, width = 3, size = 500):
+    """
+    Renders the positions of the width most popular next moves of every line up to depth half-moves deep,
+    from both sides. The lines are walked with engine.query_line, which reads the opening tree if it was built
+    (and also fills the result cache of the engine, saved to its disk cache at the end).
+    """
+    lines = [("", chess.Board())]
+    for ply in range(depth + 1):
+        next_lines = []
+        for moves_str, board in lines:
+            last_move = board.peek() if board.move_stack else None
+            for orientation in (chess.WHITE, chess.BLACK):
+                board_svg(board, last_move, size, orientation)
+            if ply == depth:
+                continue
+            for san in engine.query_line(moves_str).next_moves["Move"][:width]:
+                child = board.copy()
+                child.push_san(san)
+                number = f"{ply // 2 + 1}. " if ply % 2 == 0 else ""
+                next_lines.append((f"{moves_str} {number}{san}".strip(), child))
+        lines = next_lines
+    engine.save_results() #the results of the popular lines survive a restart of the app
+
+def start_warming(engine, size = 500):
+    """Starts warm_boards in a background thread, once per engine and process."""
+    with _warmed_lock:
+        if id(engine) in _warmed:
+            return
+        _warmed.add(id(engine))
+    threading.Thread(target = warm_boards, args = (engine,), kwargs = {"size": size}, name = "warm-boards", daemon = True).start()
@@ -0,0 +1,68 @@
+"""
+Memory-bounded LRU cache of query results (or other values, e.g. rendered boards), shared by all users (threads) of one engine.
+"""
+import sys
+import threading
+
+import cachetools
+import numpy as np
+import pandas as pd
+
+
+def result_size(value):
+    """
+    Estimates the memory of a cached result (a tuple of data frames, indexes and small values) in bytes.
+    """
+    size = 0
+    for part in value:
+        if isinstance(part, (pd.DataFrame, pd.Index)):
+            size += int(np.sum(part.memory_usage(deep = True)))
+        else:
+            size += sys.getsizeof(part)
+    return size
+
+class ResultCache:
+    """
+    Process-wide LRU cache of the statistics of a line or position, shared by all sessions.
+    The cache is bounded by the estimated memory of the results, the least recently used results are evicted first.
+    """
+    def __init__(self, max_bytes, getsizeof = result_size):
+        self.cache = cachetools.LRUCache(maxsize = max_bytes, getsizeof = getsizeof)
+        self.lock = threading.Lock() #every session runs in its own thread
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached result of key, or computes it with compute() and caches it."""
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                return self.cache[key] #also marks the result as recently used
+            self.misses += 1
+        value = compute() #computed outside the lock, so other sessions are not blocked
+        with self.lock:
+            try:
+                self.cache[key] = value
+            except ValueError: #the result alone is larger than the cache
+                pass
+        return value
+
+    def items(self):
+        """Returns the (key, result) pairs of the cache, e.g. to save them to disk."""
+        with self.lock:
+            return [(key, self.cache[key]) for key in list(self.cache)]
+
+    def update(self, items):
+        """Adds (key, result) pairs to the cache, e.g. the results saved by an earlier run."""
+        with self.lock:
+            for key, value in items:
+                try:
+                    self.cache[key] = value
+                except ValueError:
+                    pass
+
+    def stats(self):
+        """Returns the hit/miss counters and the current size of the cache."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.cache),
+                    "bytes": self.cache.currsize, "max_bytes": self.cache.maxsize}
@@ -0,0 +1,327 @@
+"""
+Loading the data files of the app outside of Streamlit.
+
+Every component of the data set (the games, the position index, keys or FEN tables, the move codes, the opening tree,
+the statistics and the summary) has its own loader, so a page only pays for what it uses. LazyDataset loads
+the components in background threads the first time they are requested and keeps them for the whole process.
+What is computed from the files (the games parsed from the CSV file, the encoded move codes, the statistics) is kept
+in the disk cache of the data set (see engine.disk_cache), so it is only computed again for a new version of the files.
+
+Example:
+    dataset = shared_dataset("pages/data")
+    dataset.start("df", "move_codes") #returns at once, the files are loaded in the background
+    summary = dataset.get("summary") #waits for this component only
+"""
+import csv
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from engine.disk_cache import DiskCache
+from engine.indexes import read_only
+from engine.metrics import metrics
+from pipeline.aggregates import (compute_statistics, compute_summary, load_statistics, load_summary, merge_statistics,
+                                 save_statistics)
+from pipeline.games import games_frame, open_games, read_games, read_games_csv, write_games
+from pipeline.moves import encode_games, to_offsets
+from pipeline.opening_tree import load_opening_tree
+from pipeline.position_index import load_position_index
+from pipeline.shards import list_shards
+
+# -----------------------------------------------------------------------------
+# 1. COMPONENT LOADERS
+# -----------------------------------------------------------------------------
+def load_games(data_dir, store = None):
+    """
+    Returns the games data frame indexed by ID with the compact schema of pipeline.games (categoricals, int16 ratings),
+    memory-mapped from games_clean.arrow or parsed from games_clean.csv. The parsed CSV file is kept as an Arrow file
+    in the disk cache (store) if one is given.
+    """
+    if store is None or (Path(data_dir) / "games_clean.arrow").exists():
+        return games_frame(open_games(data_dir))
+    return games_frame(store.get_or_build("games_clean.arrow", lambda: open_games(data_dir), write_games, read_games))
+
+def load_games_head(data_dir, n_rows = 10):
+    """Returns the first n_rows games (of the newest month if data_dir holds shards) without loading the whole data set."""
+    shards = list_shards(data_dir)
+    if shards:
+        data_dir = list(shards.values())[-1]
+    arrow_path = Path(data_dir) / "games_clean.arrow"
+    if arrow_path.exists():
+        reader = pa.ipc.open_file(pa.memory_map(str(arrow_path), "r"))
+        batches = [reader.get_batch(0).slice(0, n_rows)] if reader.num_record_batches else []
+        head = games_frame(pa.Table.from_batches(batches, schema = reader.schema))
+    else:
+        df = read_games_csv(Path(data_dir) / "games_clean.csv", n_rows)
+        head = games_frame(pa.Table.from_pandas(df, preserve_index = False))
+    head.index = pd.Index([game_id.decode() for game_id in head.index], name = "ID") #readable IDs for the preview
+    return head
+
+def count_games(data_dir):
+    """
+    Returns the number of games of the games file: from the metadata of games_clean.arrow, or the rows of games_clean.csv
+    (None if there is no games file). The derived files (move codes, indexes, tree, statistics) are checked against it.
+    """
+    data_dir = Path(data_dir)
+    for file_path in (data_dir / "games_clean.arrow", data_dir / "games_clean.csv"):
+        if file_path.exists():
+            stat = file_path.stat()
+            return count_rows(str(file_path), stat.st_size, stat.st_mtime_ns)
+    return None
+
+@lru_cache(maxsize = 64)
+def count_rows(file_path, size, mtime_ns):
+    """Returns the number of games of a games file, counted once per version (size, modification time) of the file."""
+    if file_path.endswith(".arrow"):
+        reader = pa.ipc.open_file(pa.memory_map(file_path, "r"))
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    with open(file_path, encoding = "utf-8", newline = "") as in_f:
+        return sum(1 for _ in csv.reader(in_f, delimiter = ";")) - 1 #quoted fields may span lines, minus the header
+
+def load_position_keys(data_dir):
+    """
+    Memory-maps the uint64 Zobrist keys of the first 20 moves (None if position_keys.npy was not generated or belongs to other games).
+    """
+    keys_path = Path(data_dir) / "position_keys.npy"
+    if not keys_path.exists():
+        return None
+    keys = np.load(keys_path, mmap_mode = "r")
+    n_games = count_games(data_dir)
+    if n_games is not None and len(keys) != n_games:
+        print(f"The position keys of {len(keys)} games do not match the {n_games} games, they are ignored.")
+        return None
+    return keys
+
+def load_flat_position_index(data_dir):
+    """
+    Memory-maps the variable-depth position index (None if it was not built or belongs to other games).
+    """
+    index = load_position_index(data_dir)
+    if index is None:
+        return None
+    n_games = count_games(data_dir)
+    if n_games is not None and index["games"] != n_games:
+        print(f"The position index of {index['games']} games does not match the {n_games} games, it is ignored.")
+        return None
+    return index
+
+def load_fen_table(data_dir, side):
+    """Parses white_to_move_fens.csv or black_to_move_fens.csv (side is "white" or "black")."""
+    return pd.read_csv(Path(data_dir) / f"{side}_to_move_fens.csv", sep = ";", index_col = "ID")
+
+def load_stored_move_codes(data_dir):
+    """
+    Memory-maps the move codes and offsets of move_codes.npy and move_offsets.npy (None if they were not generated
+    or belong to other games).
+    """
+    data_dir = Path(data_dir)
+    if not ((data_dir / "move_codes.npy").exists() and (data_dir / "move_offsets.npy").exists()):
+        return None
+    codes, offsets = np.load(data_dir / "move_codes.npy", mmap_mode = "r"), np.load(data_dir / "move_offsets.npy")
+    n_games = count_games(data_dir)
+    if (n_games is not None and len(offsets) - 1 != n_games) or (len(offsets) and offsets[-1] != len(codes)):
+        print(f"The move codes of {len(offsets) - 1} games do not match the {n_games} games, they are encoded again.")
+        return None
+    return codes, offsets
+
+def load_move_codes(data_dir, moves = None, store = None):
+    """
+    Returns the move codes of all games and the per-game offsets, memory-mapped from move_codes.npy and
+    move_offsets.npy, or encoded from the move strings (moves) if the files were not generated or are stale
+    (and kept in the disk cache, store, if one is given).
+    """
+    stored = load_stored_move_codes(data_dir)
+    if stored is not None:
+        return stored
+    def encode():
+        codes, lengths = encode_games(moves)
+        return codes, to_offsets(lengths)
+    return encode() if store is None else store.get_or_build("move_codes", encode)
+
+def load_tree(data_dir):
+    """Loads the precomputed opening tree (None if opening_tree.npz was not built or belongs to other games)."""
+    tree_path = Path(data_dir) / "opening_tree.npz"
+    if not tree_path.exists():
+        return None
+    tree = load_opening_tree(tree_path)
+    n_games = count_games(data_dir)
+    if n_games is not None and int(tree["n_games"]) != n_games:
+        print(f"The opening tree of {int(tree['n_games'])} games does not match the {n_games} games, it is ignored.")
+        return None
+    return tree
+
+def load_dataset(data_dir = "pages/data"):
+    """
+    Loads everything the query engine needs into a dict: the games, the move codes, the variable-depth position index
+    (or the position keys, or the FEN tables if neither was generated), the opening tree (None if it was not built)
+    and the disk cache of the data set.
+    """
+    store = DiskCache(data_dir)
+    dataset = {"df": load_games(data_dir, store), "flat_position_index": load_flat_position_index(data_dir), "position_keys": None,
+               "white_to_move_fens": None, "black_to_move_fens": None, "opening_tree": load_tree(data_dir)}
+    if dataset["flat_position_index"] is None:
+        dataset["position_keys"] = load_position_keys(data_dir)
+    if dataset["flat_position_index"] is None and dataset["position_keys"] is None:
+        dataset["white_to_move_fens"] = load_fen_table(data_dir, "white")
+        dataset["black_to_move_fens"] = load_fen_table(data_dir, "black")
+    dataset["move_codes"], dataset["move_offsets"] = load_move_codes(data_dir, dataset["df"]["Moves"], store)
+    dataset["store"] = store
+    return dataset
+
+# -----------------------------------------------------------------------------
+# 2. LAZY DATA SET
+# -----------------------------------------------------------------------------
+class LazyDataset:
+    """
+    The components of the data set in data_dir, each loaded in its own background thread the first time it is
+    requested and then kept. All the sessions (threads) of the process share one instance, see shared_dataset,
+    so the components are never modified: their arrays are read-only. The derived components are kept in the
+    disk cache of the data set (store).
+    """
+    def __init__(self, data_dir = "pages/data"):
+        self.data_dir = Path(data_dir)
+        self.store = DiskCache(data_dir)
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.loaders = {
+            "df": self.load_df,
+            "flat_position_index": self.load_flat_position_index,
+            "position_keys": self.load_position_keys,
+            "white_to_move_fens": self.load_white_to_move_fens,
+            "black_to_move_fens": self.load_black_to_move_fens,
+            "move_codes": self.load_move_codes,
+            "opening_tree": self.load_opening_tree,
+            "statistics": self.load_statistics,
+            "summary": self.load_summary,
+        }
+
+    # ------ 2.1 COMPONENTS ------
+    def load_df(self):
+        with metrics.timer("dataset_load"):
+            return load_games(self.data_dir, self.store)
+
+    def load_flat_position_index(self):
+        with metrics.timer("dataset_load"):
+            return load_flat_position_index(self.data_dir)
+
+    def load_position_keys(self):
+        """The keys of the first 20 moves are only needed (and loaded) if the variable-depth index was not built."""
+        if self.get("flat_position_index") is not None:
+            return None
+        with metrics.timer("dataset_load"):
+            return load_position_keys(self.data_dir)
+
+    def load_white_to_move_fens(self):
+        """The FEN tables are only needed (and loaded) if neither position index was generated."""
+        if self.get("position_keys") is not None or self.get("flat_position_index") is not None:
+            return None
+        with metrics.timer("dataset_load"):
+            return load_fen_table(self.data_dir, "white")
+
+    def load_black_to_move_fens(self):
+        if self.get("position_keys") is not None or self.get("flat_position_index") is not None:
+            return None
+        with metrics.timer("dataset_load"):
+            return load_fen_table(self.data_dir, "black")
+
+    def load_move_codes(self):
+        """The move codes and offsets, encoded from the games (or read from the disk cache) if the files were not generated."""
+        with metrics.timer("dataset_load"):
+            stored = load_stored_move_codes(self.data_dir)
+        if stored is not None:
+            return stored
+        moves = self.get("df")["Moves"]
+        with metrics.timer("encode_moves"):
+            return load_move_codes(self.data_dir, moves, self.store)
+
+    def load_opening_tree(self):
+        with metrics.timer("dataset_load"):
+            return load_tree(self.data_dir)
+
+    def load_statistics(self):
+        """
+        The tables of the Statistics page from statistics.json (built with python -m pipeline.aggregates) if it belongs
+        to this data set, otherwise they are computed from the games once and kept in the disk cache.
+        The tables of monthly shards are merged.
+        """
+        shards = list_shards(self.data_dir)
+        if shards:
+            return merge_statistics([shared_dataset(folder).get("statistics") for folder in shards.values()])
+        file_path = self.data_dir / "statistics.json"
+        if file_path.exists():
+            with metrics.timer("statistics_load"):
+                statistics = load_statistics(file_path)
+            n_games = count_games(self.data_dir)
+            if n_games is None or statistics["n_games"] == n_games:
+                return statistics
+        def compute():
+            print("Cache miss: Computing the statistics of the dataset...")
+            df, (_, offsets) = self.get("df"), self.get("move_codes")
+            with metrics.timer("statistics_compute"):
+                return compute_statistics(df, np.diff(offsets))
+        return self.store.get_or_build("statistics.json", compute, save_statistics, load_statistics)
+
+    def load_summary(self):
+        """The numbers of the Home page from summary.json, otherwise (or for monthly shards) from the statistics tables."""
+        file_path = self.data_dir / "summary.json"
+        if file_path.exists() and not list_shards(self.data_dir):
+            summary = load_summary(file_path)
+            n_games = count_games(self.data_dir)
+            if n_games is None or summary["n_games"] == n_games:
+                return summary
+        return compute_summary(self.get("statistics"))
+
+    # ------ 2.2 ACCESS ------
+    def start(self, *names):
+        """Starts loading the components in the background (if they are not loaded yet), returns their futures."""
+        futures = []
+        with self.lock:
+            for name in names:
+                if name not in self.futures:
+                    future = Future()
+                    self.futures[name] = future
+                    threading.Thread(target = self.run, args = (name, future), name = f"load-{name}", daemon = True).start()
+                futures.append(self.futures[name])
+        return futures
+
+    def run(self, name, future):
+        """Loads one component into its future."""
+        print(f"Cache miss: Loading {name} from {self.data_dir}...")
+        try:
+            future.set_result(read_only(self.loaders[name]()))
+        except BaseException as error:
+            future.set_exception(error)
+
+    def get(self, name):
+        """Returns a component, waits until it is loaded (loading errors are raised here)."""
+        return self.start(name)[0].result()
+
+    def ready(self, *names):
+        """Tells if the components are loaded, without starting or waiting for them."""
+        with self.lock:
+            return all(name in self.futures and self.futures[name].done() for name in names)
+
+    def engine_inputs(self):
+        """Returns the keyword arguments of QueryEngine, loading the components in parallel."""
+        names = ["df", "move_codes", "flat_position_index", "position_keys", "white_to_move_fens", "black_to_move_fens", "opening_tree"]
+        self.start(*names)
+        inputs = {name: self.get(name) for name in names}
+        inputs["move_codes"], inputs["move_offsets"] = inputs["move_codes"]
+        inputs["store"] = self.store
+        return inputs
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+def shared_dataset(data_dir = "pages/data"):
+    """Returns the LazyDataset of data_dir shared by the whole process."""
+    key = str(Path(data_dir).resolve())
+    with _datasets_lock:
+        if key not in _datasets:
+            _datasets[key] = LazyDataset(data_dir)
+        return _datasets[key]
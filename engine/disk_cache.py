@@ -0,0 +1,254 @@
+"""
+Persistent on-disk cache of what the app derives from a data set, so a restart of the app does not parse and compute it again.
+
+The cache of a data folder is a folder named after the fingerprint of the data set, a content hash of its data files
+(and of its monthly shards) and of the code that computes the cached values. It is reused as long as both are unchanged:
+when a new version of the data set is dropped into the data folder or the code is updated, the fingerprint changes,
+a new cache is started and the old caches are deleted.
+It holds the games parsed from games_clean.csv, the move codes encoded from them, the indexes built by the query engine,
+the tables of the Statistics page and the results of the queries of the result cache.
+
+The caches are kept in a .cache folder of each data folder, set the TRAINER_CACHE_DIR environment variable to keep
+them elsewhere (e.g. if the data folder is read-only). The cached values are read with pickle, which can run code,
+so the cache folder must be trusted: it is only used if it belongs to the user of the app and other users cannot write to it.
+
+Example:
+    store = DiskCache("pages/data")
+    index = store.get_or_build("prefix_index", lambda: build_prefix_index(move_codes, move_offsets))
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from engine.metrics import metrics
+from pipeline.shards import list_shards
+
+CACHE_DIR = os.environ.get("TRAINER_CACHE_DIR", "") #root of the caches of all data folders ("" = a .cache folder in each one)
+#the modules whose code computes the cached values, their source is part of every fingerprint
+CODE_MODULES = ["engine.cache", "engine.dataset", "engine.disk_cache", "engine.indexes", "engine.query", "engine.shards",
+                "pipeline.aggregates", "pipeline.games", "pipeline.moves", "pipeline.opening_tree"]
+DATA_SUFFIXES = {".arrow", ".csv", ".npy", ".npz", ".json"}
+HASH_CHUNK = 8 << 20
+MMAP_BYTES = 1 << 20 #arrays from this size are saved in their own .npy file and memory-mapped when loaded
+
+#a numpy array of a cached value, saved in the .npy file of its number
+ArrayFile = namedtuple("ArrayFile", ["number"])
+
+# -----------------------------------------------------------------------------
+# 1. FINGERPRINT
+# -----------------------------------------------------------------------------
+def data_files(data_dir):
+    """Returns the data files of data_dir and of its monthly shards, sorted by path."""
+    folders = [Path(data_dir), *list_shards(data_dir).values()]
+    return sorted(path for folder in folders for path in folder.iterdir() if path.is_file() and path.suffix in DATA_SUFFIXES)
+
+def file_digest(file_path):
+    """Returns the BLAKE2 hash of the content of a file."""
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(file_path, "rb") as in_f:
+        for chunk in iter(lambda: in_f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@lru_cache(maxsize = 1)
+def code_fingerprint():
+    """
+    Returns the hash of the source of CODE_MODULES and of the versions of the libraries whose objects are pickled,
+    so the values cached by other code (e.g. results of another shape) are not read.
+    """
+    digest = hashlib.blake2b(digest_size = 16)
+    for name in CODE_MODULES:
+        digest.update(Path(importlib.util.find_spec(name).origin).read_bytes())
+    for library in (np, pd, pa):
+        digest.update(f"{library.__name__} {library.__version__};".encode())
+    return digest.hexdigest()
+
+def dataset_fingerprint(data_dir, known = None):
+    """
+    Returns the content hash of the data files of data_dir and of the code (see code_fingerprint).
+    known ({file: [size, modification time, hash]}) holds the hashes of the files from earlier runs and is updated
+    in place: a file is only read again if its size or time changed.
+    """
+    data_dir = Path(data_dir)
+    known = {} if known is None else known
+    fingerprint = hashlib.blake2b(f"code {code_fingerprint()};".encode(), digest_size = 16)
+    names = []
+    for file_path in data_files(data_dir):
+        name = file_path.relative_to(data_dir).as_posix()
+        stat = file_path.stat()
+        if known.get(name, [None, None])[:2] != [stat.st_size, stat.st_mtime_ns]:
+            known[name] = [stat.st_size, stat.st_mtime_ns, file_digest(file_path)]
+        fingerprint.update(f"{name}:{known[name][2]};".encode())
+        names.append(name)
+    for name in set(known) - set(names): #deleted files
+        del known[name]
+    return fingerprint.hexdigest()
+
+def check_trusted(folder):
+    """
+    Raises a PermissionError if the folder does not belong to the user of the app or other users can write to it
+    (the cached values are read with pickle, which can run code).
+    """
+    if not hasattr(os, "getuid"): #no owners to check (Windows)
+        return
+    stat = folder.stat()
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise PermissionError(f"{folder} must belong to the user of the app and not be writable by other users")
+
+def cache_root(data_dir):
+    """Returns the folder of the caches of data_dir."""
+    if not CACHE_DIR:
+        return Path(data_dir) / ".cache"
+    data_dir = Path(data_dir).resolve()
+    return Path(CACHE_DIR) / f"{data_dir.name}-{hashlib.blake2b(str(data_dir).encode(), digest_size = 8).hexdigest()}"
+
+# -----------------------------------------------------------------------------
+# 2. SAVING AND LOADING VALUES
+# -----------------------------------------------------------------------------
+def is_container(part):
+    """Tells if part is a dict, list or plain tuple (not a namedtuple) whose items are saved one by one."""
+    return isinstance(part, (dict, list)) or (isinstance(part, tuple) and not hasattr(part, "_fields"))
+
+def save_value(value, folder):
+    """
+    Writes a value (numpy arrays in dicts, lists and tuples, with other picklable values such as pd.Index) into a new
+    folder: every large numeric array in its own .npy file, so it is memory-mapped when loaded, the rest into layout.pkl.
+    """
+    arrays = []
+    def split(part):
+        if isinstance(part, np.ndarray) and not part.dtype.hasobject and part.nbytes >= MMAP_BYTES:
+            arrays.append(part)
+            return ArrayFile(len(arrays) - 1)
+        if isinstance(part, dict):
+            return {key: split(item) for key, item in part.items()}
+        if is_container(part):
+            return type(part)(split(item) for item in part)
+        return part
+
+    folder = Path(folder)
+    folder.mkdir(parents = True)
+    layout = split(value)
+    for number, array in enumerate(arrays):
+        np.save(folder / f"{number}.npy", array)
+    save_pickle(layout, folder / "layout.pkl")
+
+def load_value(folder):
+    """Reads a value written by save_value, its large arrays are memory-mapped (read-only)."""
+    folder = Path(folder)
+    def join(part):
+        if isinstance(part, ArrayFile):
+            return np.load(folder / f"{part.number}.npy", mmap_mode = "r")
+        if isinstance(part, dict):
+            return {key: join(item) for key, item in part.items()}
+        if is_container(part):
+            return type(part)(join(item) for item in part)
+        return part
+    return join(load_pickle(folder / "layout.pkl"))
+
+def save_pickle(value, file_path):
+    with open(file_path, "wb") as out_f:
+        pickle.dump(value, out_f, protocol = pickle.HIGHEST_PROTOCOL)
+
+def load_pickle(file_path):
+    with open(file_path, "rb") as in_f:
+        return pickle.load(in_f)
+
+def remove(path):
+    """Deletes a file or folder if it exists."""
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors = True)
+    elif path.exists():
+        path.unlink()
+
+# -----------------------------------------------------------------------------
+# 3. DISK CACHE
+# -----------------------------------------------------------------------------
+class DiskCache:
+    """
+    The persistent cache of the data set in data_dir: named values in the folder of the current fingerprint, under the
+    cache root. The fingerprint is computed on first use (only new or changed files are hashed), the folders of other
+    fingerprints are deleted then. A value is written to a temporary name and renamed when complete, so several threads
+    or processes can share the cache. If the cache root cannot be written or is not trusted (see check_trusted),
+    nothing is cached and every value is built.
+    """
+    def __init__(self, data_dir = "pages/data", root = None):
+        self.data_dir = Path(data_dir)
+        self.root = Path(root) if root else cache_root(data_dir)
+        self.lock = threading.Lock()
+        self.opened = None #the folder of the fingerprint once open, False if the cache cannot be used
+
+    def folder(self):
+        """Returns the folder of the current fingerprint (None if the cache cannot be used), opened on first use."""
+        with self.lock:
+            if self.opened is None:
+                self.opened = self.open()
+            return self.opened or None
+
+    def open(self):
+        """Fingerprints the data set, deletes the caches of other fingerprints and creates the folder of this one."""
+        hashes_path = self.root / "hashes.json"
+        try:
+            self.root.mkdir(parents = True, exist_ok = True, mode = 0o700)
+            check_trusted(self.root)
+            known = json.loads(hashes_path.read_text(encoding = "utf-8")) if hashes_path.exists() else {}
+            with metrics.timer("dataset_fingerprint"):
+                fingerprint = dataset_fingerprint(self.data_dir, known)
+            hashes_path.write_text(json.dumps(known), encoding = "utf-8")
+            for stale in self.root.iterdir():
+                if stale.is_dir() and stale.name != fingerprint:
+                    print(f"Deleting the cache {stale} of another version of the dataset or code...")
+                    remove(stale)
+            folder = self.root / fingerprint
+            folder.mkdir(exist_ok = True)
+            return folder
+        except (OSError, ValueError) as error:
+            print(f"The disk cache {self.root} cannot be used ({error}), nothing is cached.")
+            return False
+
+    def load(self, name, load = load_value):
+        """Returns the cached value of name read with load(path), or None if it is not cached."""
+        folder = self.folder()
+        if folder is None or not (folder / name).exists():
+            return None
+        try:
+            with metrics.timer("disk_cache_load"):
+                return load(folder / name)
+        except Exception as error: #a damaged file is built again
+            print(f"Could not read {name} from the disk cache ({error}).")
+            return None
+
+    def save(self, name, value, save = save_value):
+        """Caches the value of name, written with save(value, path)."""
+        folder = self.folder()
+        if folder is None:
+            return
+        temporary = folder / f".{name}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with metrics.timer("disk_cache_save"):
+                save(value, temporary)
+                os.replace(temporary, folder / name)
+        except OSError as error:
+            if not (folder / name).exists(): #not saved by another thread or process first
+                print(f"Could not write {name} to the disk cache ({error}).")
+        finally:
+            remove(temporary)
+
+    def get_or_build(self, name, build, save = save_value, load = load_value):
+        """Returns the cached value of name, or builds it with build() and caches it."""
+        value = self.load(name, load)
+        if value is None:
+            print(f"Disk cache miss: Building {name} of {self.data_dir}...")
+            value = build()
+            self.save(name, value, save)
+        return value
@@ -0,0 +1,274 @@
+"""
+The indexes of the query engine: the move prefix index (Simple Trainer), the position postings index
+(Advanced Trainer), the player postings and the filter bitmaps. All of them are plain numpy arrays built once from the data set
+and then shared read-only by all the sessions of the process.
+"""
+import chess
+import numpy as np
+import pandas as pd
+
+from pipeline.moves import decode_move
+
+ELO_STEP = 100 #the Elo bands are "both players rated at least x" for every multiple of ELO_STEP
+FILTER_COLUMNS = ("TimeControl", "MinElo", "Result", "Termination")
+SIDES = ("White", "Black")
+
+# -----------------------------------------------------------------------------
+# 1. MOVE PREFIX INDEX
+# -----------------------------------------------------------------------------
+def build_prefix_index(move_codes, move_offsets, depth = 40):
+    """
+    Builds a prefix index over the first "depth" half-moves of every game.
+    Every game is a row of move codes (0 = the game has ended) and the games are sorted by their move sequence,
+    so all games that start with the same moves form one contiguous range of the sorted array.
+    """
+    lengths = np.minimum(np.diff(move_offsets), depth)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    plies = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    seq = np.zeros((len(lengths), depth), dtype = np.uint16)
+    seq[rows, plies] = move_codes[move_offsets[rows] + plies]
+    order = np.lexsort(seq.T[::-1]) #sort by the first move, then by the second move...
+
+    return {
+        "seq": np.asfortranarray(seq[order]), #column-major, so every ply is a contiguous sorted run inside a range
+        "rows": order.astype(np.int32),
+        "depth": depth,
+    }
+
+def narrow_prefix(index, lo, hi, ply, code):
+    """
+    Returns the range of the games in lo:hi (which share their first "ply" moves) that play the move code next.
+    The column of the ply is sorted inside the range, so this is a binary search: O(log(hi - lo)).
+    """
+    column = index["seq"][lo:hi, ply]
+    return lo + int(np.searchsorted(column, code, "left")), lo + int(np.searchsorted(column, code, "right"))
+
+# -----------------------------------------------------------------------------
+# 2. POSITION INDEX
+# -----------------------------------------------------------------------------
+def group_postings(keys, rows, plies, ids, hashed):
+    """
+    Groups the (game row, ply) postings by position key, each position owns the slice offsets[i]:offsets[i+1]
+    sorted by game row. A game that reaches a position twice is posted once (at the first time).
+    """
+    codes, uniques = pd.factorize(keys)
+    order = np.lexsort((plies, rows, codes))
+    first = np.r_[True, (codes[order][1:] != codes[order][:-1]) | (rows[order][1:] != rows[order][:-1])]
+    order = order[first]
+    offsets = np.zeros(len(uniques) + 1, dtype = np.int64)
+    np.cumsum(np.bincount(codes[order], minlength = len(uniques)), out = offsets[1:])
+
+    return {
+        "keys": pd.Index(uniques), #hashed lookup from position to its number
+        "offsets": offsets,
+        "rows": rows[order],
+        "plies": plies[order],
+        "ids": ids,
+        "hashed": hashed, #True if the keys are Zobrist hashes that need verification
+    }
+
+def build_position_index(white_to_move_fens, black_to_move_fens):
+    """
+    Builds an inverted index from every position in the fen tables to the games that reached it.
+    For each position we keep compact arrays of (game row, ply) postings, so a lookup only touches
+    the matching games instead of comparing strings across the whole tables.
+    Both tables are split from the same frame in the cleaning notebook, so they share the row order.
+    """
+    keys, rows, plies = [], [], []
+    #column n of white_to_move_fens is the position before white's n-th move -> ply 2(n-1)
+    #column n of black_to_move_fens is the position before black's n-th move -> ply 2n-1
+    for fens_df, first_ply in [(white_to_move_fens, -2), (black_to_move_fens, -1)]:
+        values = fens_df.to_numpy()
+        row, col = np.nonzero(pd.notna(values))
+        move_numbers = fens_df.columns.astype(int).to_numpy()
+        keys.append(values[row, col])
+        rows.append(row.astype(np.int32))
+        plies.append((2 * move_numbers[col] + first_ply).astype(np.int16))
+
+    return group_postings(np.concatenate(keys), np.concatenate(rows), np.concatenate(plies), white_to_move_fens.index, hashed = False)
+
+def build_key_index(position_keys, ids):
+    """
+    Same as build_position_index, but for the uint64 Zobrist keys (column j is the position after j + 1 plies, 0 = no position).
+    """
+    row, col = np.nonzero(position_keys)
+    return group_postings(position_keys[row, col], row.astype(np.int32), (col + 1).astype(np.int16), ids, hashed = True)
+
+def flat_key_index(index):
+    """
+    Turns the variable-depth index built by pipeline.position_index (sorted keys, offsets, rows, plies)
+    into the format of build_key_index. The arrays stay memory-mapped, the keys are found by binary search.
+    """
+    return {"keys": index["keys"], "offsets": index["offsets"], "rows": index["rows"], "plies": index["plies"],
+            "ids": None, "hashed": True, "max_plies": index["max_plies"]}
+
+def key_numbers(index, keys):
+    """
+    Returns the number of every key in the index (-1 if the position never occurred).
+    """
+    if isinstance(index["keys"], pd.Index):
+        return index["keys"].get_indexer(keys)
+    #sorted uint64 keys of a flat index
+    keys = np.asarray(keys, dtype = np.uint64)
+    if len(index["keys"]) == 0:
+        return np.full(len(keys), -1)
+    i = np.minimum(np.searchsorted(index["keys"], keys), len(index["keys"]) - 1)
+    return np.where(index["keys"][i] == keys, i, -1)
+
+def lookup_position(index, key):
+    """
+    Returns the (game row, ply) postings of a position, the arrays are empty if the position never occurred.
+    """
+    i = key_numbers(index, np.array([key], dtype = object if isinstance(key, str) else np.uint64))[0]
+    if i < 0:
+        return index["rows"][:0], index["plies"][:0]
+    start, end = index["offsets"][i], index["offsets"][i + 1]
+    return index["rows"][start:end], index["plies"][start:end]
+
+def lookup_positions(index, keys):
+    """
+    Returns the postings of many positions at once as flat arrays (query number, game row, ply).
+    """
+    i = key_numbers(index, keys)
+    found = np.flatnonzero(i >= 0)
+    starts, ends = index["offsets"][i[found]], index["offsets"][i[found] + 1]
+    counts = ends - starts
+    queries = np.repeat(found, counts)
+    postings = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return queries, index["rows"][postings], index["plies"][postings]
+
+def verify_hits(move_codes, move_offsets, target_epds, queries, rows, plies):
+    """
+    Returns a boolean mask of the postings whose moves really lead to the position of their query (target_epds[query]).
+    Zobrist keys can (very rarely) collide, so we replay the hits. Games with the same move order
+    reach the same position, therefore every distinct move order is replayed only once.
+    """
+    mask = np.zeros(len(rows), dtype = bool)
+    target_epds = np.asarray(target_epds, dtype = object)
+    for ply in np.unique(plies):
+        hits = np.flatnonzero(plies == ply)
+        prefixes = np.ascontiguousarray(move_codes[move_offsets[rows[hits], None] + np.arange(ply)])
+        unique, inverse = np.unique(prefixes.view(np.dtype((np.void, 2 * int(ply)))).ravel(), return_inverse = True)
+        epds = np.empty(len(unique), dtype = object)
+        for j, first in enumerate(np.unique(inverse, return_index = True)[1]):
+            replay = chess.Board()
+            for code in prefixes[first]:
+                replay.push(decode_move(code))
+            epds[j] = replay.epd()
+        mask[hits] = epds[inverse.ravel()] == target_epds[queries[hits]]
+    return mask
+
+def restrict_postings(rows, plies, within):
+    """
+    Returns the postings of a position (sorted by game row) of the games in within (sorted rows). The games are
+    found by binary search, so the cost depends on len(within) and not on the number of postings.
+    """
+    i = np.searchsorted(rows, within)
+    found = i < len(rows)
+    i = i[found][rows[i[found]] == within[found]]
+    return rows[i], plies[i]
+
+# -----------------------------------------------------------------------------
+# 3. PLAYER INDEX
+# -----------------------------------------------------------------------------
+def build_player_index(df):
+    """
+    Builds the postings of every player from the dictionary-encoded White and Black columns: the names (sorted
+    case-insensitively) and the rows of the games of player i with White, then with Black, in the slices
+    offsets[2i]:offsets[2i+1] and offsets[2i+1]:offsets[2i+2] (in row order). Games without a player name (null)
+    are not posted, so there is no player to search for them.
+    """
+    names = pd.concat([df[side].cat.categories.to_series() for side in SIDES]).unique()
+    names = pd.Index(sorted(names, key = str.lower))
+    ids, rows = [], []
+    for side, column in enumerate(SIDES):
+        players = df[column].cat
+        codes = players.codes.to_numpy()
+        game_rows = np.flatnonzero(codes >= 0)
+        ids.append(2 * names.get_indexer(players.categories)[codes[game_rows]] + side)
+        rows.append(game_rows.astype(np.int32))
+    ids, rows = np.concatenate(ids), np.concatenate(rows)
+    order = np.argsort(ids, kind = "stable") #the rows of every (player, side) stay in row order
+    offsets = np.zeros(2 * len(names) + 1, dtype = np.int64)
+    np.cumsum(np.bincount(ids, minlength = 2 * len(names)), out = offsets[1:])
+    return {"names": names, "lower": np.asarray(names.str.lower(), dtype = object), "offsets": offsets, "rows": rows[order]}
+
+def player_rows(index, name, side = None):
+    """
+    Returns the sorted rows of the games of a player with one side ("White" or "Black", None = both), empty if the player is unknown.
+    """
+    i = index["names"].get_indexer([name])[0]
+    if i < 0:
+        return index["rows"][:0]
+    offsets = index["offsets"]
+    if side is None:
+        return np.sort(index["rows"][offsets[2 * i]:offsets[2 * i + 2]])
+    j = 2 * i + SIDES.index(side)
+    return index["rows"][offsets[j]:offsets[j + 1]]
+
+def find_players(index, prefix, n = 20):
+    """Returns the first n player names that start with prefix (ignoring case)."""
+    lower = index["lower"]
+    start = np.searchsorted(lower, prefix.lower())
+    end = np.searchsorted(lower, prefix.lower() + "\uffff")
+    return list(index["names"][start:min(end, start + n)])
+
+# -----------------------------------------------------------------------------
+# 4. FILTER BITMAPS
+# -----------------------------------------------------------------------------
+def build_filter_bitmaps(df):
+    """
+    Precomputes a bitmap of the games for every value of the filter attributes (time control, result, termination)
+    and for every Elo band. The bitmaps are packed bool arrays (one bit per game in df row order), so combining
+    filters is a few vectorized AND/OR operations over n/8 bytes.
+    """
+    bitmaps = {}
+    for column in ["TimeControl", "Result", "Termination"]:
+        values = df[column].cat #the categorical codes of the compact schema, no strings are compared
+        codes = values.codes.to_numpy()
+        bitmaps[column] = {value: np.packbits(codes == i) for i, value in sorted(enumerate(values.categories), key = lambda item: item[1])
+                           if (codes == i).any()}
+
+    min_elo = np.minimum(df["WhiteElo"].to_numpy(dtype = np.int64), df["BlackElo"].to_numpy(dtype = np.int64))
+    lowest, highest = min_elo.min() // ELO_STEP + 1, min_elo.max() // ELO_STEP
+    bitmaps["MinElo"] = {elo: np.packbits(min_elo >= elo) for elo in range(lowest * ELO_STEP, (highest + 1) * ELO_STEP, ELO_STEP)}
+    return bitmaps
+
+def normalize_filters(filters):
+    """
+    Turns filters given as a dict or pairs ({"TimeControl": ["Blitz"], "MinElo": 2700}) into a hashable tuple
+    of (attribute, values) in a fixed order, attributes without values are left out.
+    """
+    filters = dict(filters or ())
+    unknown = set(filters) - set(FILTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown filter attributes: {', '.join(sorted(unknown))}")
+    normalized = []
+    for column in FILTER_COLUMNS:
+        values = filters.get(column, ())
+        if isinstance(values, (str, int, np.integer)):
+            values = (values,)
+        if len(values):
+            normalized.append((column, tuple(sorted(values))))
+    return tuple(normalized)
+
+def in_bitmap(bitmap, rows):
+    """
+    Returns a boolean mask of the rows whose bit is set in the packed bitmap (O(len(rows))).
+    """
+    return (bitmap[rows >> 3] >> (7 - (rows & 7)).astype(np.uint8)) & 1 == 1
+
+def read_only(value):
+    """
+    Marks the numpy arrays in value (an array or a dict, tuple or list of them) as read-only and returns value,
+    so a shared index or data set cannot be modified by accident.
+    """
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for part in value.values():
+            read_only(part)
+    elif isinstance(value, (tuple, list)):
+        for part in value:
+            read_only(part)
+    return value
@@ -0,0 +1,121 @@
+"""
+Load test of the explorer server (python -m engine.server): many concurrent clients, each on one kept-alive
+connection, query positions sampled from the games. Reports the latency percentiles and the requests per second.
+
+Usage:
+    python -m engine.loadtest --url http://127.0.0.1:8800 --data-dir pages/data --clients 32 --requests 5000
+    python -m engine.loadtest --batch 100   #POST /explorer/batch with 100 positions per request
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote, urlsplit
+
+import chess
+import numpy as np
+
+from pipeline.games import open_games
+
+SPEEDS = ["", "", "bullet", "blitz", "rapid", "classical"] #most requests without a filter
+
+
+def sample_positions(data_dir, n, max_plies = 20, seed = 0):
+    """Returns the FENs of n positions reached in random games of the data set after 0 to max_plies half-moves."""
+    rng = random.Random(seed)
+    moves = open_games(data_dir).column("Moves")
+    fens = []
+    for _ in range(n):
+        board = chess.Board()
+        sans = [token for token in str(moves[rng.randrange(len(moves))]).split() if not token.endswith(".")]
+        for san in sans[:rng.randint(0, max_plies)]:
+            board.push_san(san)
+        fens.append(board.fen())
+    return fens
+
+async def request(reader, writer, method, target, host, body = b""):
+    """Sends one request on an open connection and returns (status, body)."""
+    head = f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n"
+    if body:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    writer.write((head + "\r\n").encode() + body)
+    await writer.drain()
+
+    status_line, *header_lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    length = 0
+    for line in header_lines:
+        if line.lower().startswith("content-length:"):
+            length = int(line.split(":", 1)[1])
+    return int(status_line.split(" ")[1]), await reader.readexactly(length)
+
+async def client(url, jobs, latencies, errors):
+    """One client: opens a connection and sends requests from the job queue until it is empty."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    while True:
+        try:
+            method, target, body = jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        start = time.perf_counter()
+        try:
+            status, _ = await request(reader, writer, method, target, parts.netloc, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors.append("connection")
+            reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    writer.close()
+
+async def run(url, fens, clients, n_requests, batch):
+    rng = random.Random(1)
+    jobs = asyncio.Queue()
+    for _ in range(n_requests):
+        speed = rng.choice(SPEEDS)
+        if batch:
+            body = json.dumps({"fens": rng.sample(fens, min(batch, len(fens))), "speeds": speed}).encode()
+            jobs.put_nowait(("POST", "/explorer/batch", body))
+        else:
+            target = f"/explorer?fen={quote(rng.choice(fens))}" + (f"&speeds={speed}" if speed else "")
+            jobs.put_nowait(("GET", target, b""))
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(url, jobs, latencies, errors) for _ in range(clients)])
+    return latencies, errors, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load test of the explorer server.")
+    parser.add_argument("--url", default = "http://127.0.0.1:8800")
+    parser.add_argument("--data-dir", default = "pages/data", help = "the positions are sampled from these games")
+    parser.add_argument("--positions", type = int, default = 1000, help = "number of distinct positions to query")
+    parser.add_argument("--clients", type = int, default = 32, help = "concurrent connections")
+    parser.add_argument("--requests", type = int, default = 5000)
+    parser.add_argument("--batch", type = int, default = 0, help = "positions per batch request (0 = single /explorer requests)")
+    parser.add_argument("--output", default = None, help = "write the report to this JSON file")
+    args = parser.parse_args()
+
+    fens = sample_positions(args.data_dir, args.positions)
+    latencies, errors, elapsed = asyncio.run(run(args.url, fens, args.clients, args.requests, args.batch))
+    latencies = np.array(latencies) * 1000
+    report = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "clients": args.clients,
+        "batch": args.batch,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+        "max_ms": round(float(latencies.max()), 2) if len(latencies) else None,
+    }
+    print(json.dumps(report, indent = 2))
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as out_f:
+            json.dump(report, out_f, indent = 2)
+
+if __name__ == "__main__":
+    main()
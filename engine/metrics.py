@@ -0,0 +1,152 @@
+"""
+Timing and memory instrumentation of the hot paths (data loading, lookups, next-move aggregation, top games,
+board rendering, ...), shared by everything running in the process.
+
+Every stage keeps the durations of its last WINDOW calls (for percentiles and the rolling histogram of the
+diagnostics page) and cumulative Prometheus-style histogram buckets since the start of the process.
+Memory is tracked as the growth of the resident memory of the process during a call.
+
+Example:
+    with metrics.timer("position_lookup"):
+        rows, plies = lookup_position(index, key)
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+WINDOW = 1000 #calls per stage kept for the rolling statistics
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) #upper bounds in seconds
+
+# -----------------------------------------------------------------------------
+# 1. MEMORY
+# -----------------------------------------------------------------------------
+def resident_memory():
+    """Returns the current resident memory of the process in bytes (the peak if the current value is not available)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def peak_memory():
+    """Returns the peak resident memory of the process in bytes (0 if it is not available)."""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+# -----------------------------------------------------------------------------
+# 2. METRICS
+# -----------------------------------------------------------------------------
+class Stage:
+    """The measurements of one stage."""
+    def __init__(self):
+        self.durations = deque(maxlen = WINDOW)
+        self.bucket_counts = np.zeros(len(BUCKETS) + 1, dtype = np.int64) #the last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max_memory_growth = 0
+        self.last_memory_growth = 0
+
+    def record(self, seconds, memory_growth):
+        self.durations.append(seconds)
+        self.bucket_counts[np.searchsorted(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.last_memory_growth = memory_growth
+        self.max_memory_growth = max(self.max_memory_growth, memory_growth)
+
+class Metrics:
+    """
+    Thread-safe registry of the stages. Streamlit runs every session in its own thread of one process,
+    so the measurements of all users end up here.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = time.time()
+
+    def record(self, name, seconds, memory_growth = 0):
+        """Adds one call of the stage name."""
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = Stage()
+            self.stages[name].record(seconds, memory_growth)
+
+    @contextmanager
+    def timer(self, name):
+        """Measures the time and memory growth of the code inside the with block as one call of the stage."""
+        memory = resident_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, max(resident_memory() - memory, 0))
+
+    def reset(self):
+        """Forgets all measurements."""
+        with self.lock:
+            self.stages = {}
+            self.started = time.time()
+
+    def durations(self, name):
+        """Returns the durations (in seconds) of the last WINDOW calls of a stage."""
+        with self.lock:
+            return np.array(self.stages[name].durations) if name in self.stages else np.array([])
+
+    def snapshot(self):
+        """Returns the statistics of every stage as a dict (times in milliseconds, memory in bytes)."""
+        with self.lock:
+            stages = {}
+            for name, stage in sorted(self.stages.items()):
+                window = np.array(stage.durations) * 1000
+                stages[name] = {
+                    "count": stage.count,
+                    "total_seconds": round(stage.total, 4),
+                    "mean_ms": round(float(window.mean()), 3),
+                    "p50_ms": round(float(np.percentile(window, 50)), 3),
+                    "p90_ms": round(float(np.percentile(window, 90)), 3),
+                    "p99_ms": round(float(np.percentile(window, 99)), 3),
+                    "max_ms": round(float(window.max()), 3),
+                    "last_memory_growth_bytes": stage.last_memory_growth,
+                    "max_memory_growth_bytes": stage.max_memory_growth,
+                    "buckets": {str(bound): int(count) for bound, count in zip(BUCKETS + ("+Inf",), np.cumsum(stage.bucket_counts))},
+                }
+            return {"uptime_seconds": round(time.time() - self.started, 1), "resident_memory_bytes": resident_memory(),
+                    "peak_memory_bytes": peak_memory(), "window": WINDOW, "stages": stages}
+
+    def to_prometheus(self, prefix = "trainer"):
+        """Returns the measurements in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in a stage of the trainer.",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for name, stage in snapshot["stages"].items():
+            for bound, count in stage["buckets"].items():
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines += [f"# HELP {prefix}_stage_memory_growth_bytes Largest growth of the resident memory during one call of a stage.",
+                  f"# TYPE {prefix}_stage_memory_growth_bytes gauge"]
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_memory_growth_bytes{{stage="{name}"}} {stage["max_memory_growth_bytes"]}')
+        lines += [f"# HELP {prefix}_resident_memory_bytes Resident memory of the process.",
+                  f"# TYPE {prefix}_resident_memory_bytes gauge",
+                  f"{prefix}_resident_memory_bytes {snapshot['resident_memory_bytes']}",
+                  f"# HELP {prefix}_peak_memory_bytes Peak resident memory of the process.",
+                  f"# TYPE {prefix}_peak_memory_bytes gauge",
+                  f"{prefix}_peak_memory_bytes {snapshot['peak_memory_bytes']}"]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics() #the registry of the process
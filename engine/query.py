@@ -0,0 +1,585 @@
+"""
+The query engine: the statistics of a move line (Simple Trainer) or a position (Advanced Trainer),
+optionally restricted by game filters, and the statistics of many positions at once for offline jobs.
+
+The engine never modifies the data set: a query finds the rows of the matching games and computes its
+statistics on integer columns, only the few top games are read from the data frame. The indexes are built
+the first time they are needed, the results of single queries are kept in a memory-bounded LRU cache
+shared by all threads using the engine. The built indexes and the cached results are also kept in the disk cache
+of the data set (see engine.disk_cache), so a restarted app starts with them.
+"""
+import atexit
+import os
+import threading
+from collections import namedtuple
+from functools import cached_property
+
+import chess
+import numpy as np
+import pandas as pd
+
+from engine.cache import ResultCache
+from engine.dataset import load_dataset, shared_dataset
+from engine.disk_cache import DiskCache, load_pickle, save_pickle
+from engine.indexes import (build_filter_bitmaps, build_key_index, build_player_index, build_position_index,
+                            build_prefix_index, find_players, flat_key_index, in_bitmap, lookup_position, lookup_positions,
+                            narrow_prefix, normalize_filters, player_rows, read_only, restrict_postings, verify_hits)
+from engine.metrics import metrics
+from pipeline.moves import decode_move, encode_move
+from pipeline.opening_tree import RESULT_CODES, find_node, line_key, node_insights, position_key
+from pipeline.shards import list_shards
+
+RESULT_CACHE_MB = int(os.environ.get("TRAINER_RESULT_CACHE_MB", "64")) #memory bound of the result cache
+
+#the games matched by a query: the board, the rows of the games in df and the code of the move played next (0 if the game ended)
+Matches = namedtuple("Matches", ["board", "rows", "next_codes"])
+#the statistics shown by the trainer: popular next moves (Move, Count), common openings, top games and (white wins, draws, black wins)
+Insights = namedtuple("Insights", ["next_moves", "openings", "top_games", "results"])
+#a node of the prefix index: the games in lo:hi of the sorted index started with the "ply" moves played so far,
+#deeper than the index the rows of the matching games are kept instead
+LineState = namedtuple("LineState", ["lo", "hi", "ply", "rows"])
+NEXT_MOVE_COLUMNS = ["Move", "Count", "WhiteWins", "Draws", "BlackWins", "OpponentElo", "Score", "Performance"]
+#the same statistics in a form that can be added up over shards: counts of every next move code and opening
+Partial = namedtuple("Partial", ["next_moves", "openings", "top_games", "results"])
+
+# -----------------------------------------------------------------------------
+# 1. STATISTICS OF A SET OF GAMES
+# -----------------------------------------------------------------------------
+def replay_move_str(move_str):
+    """
+    Replays a move string on a new board, returns the board and the codes of the played moves.
+    """
+    board = chess.Board()
+    codes = []
+    for token in move_str.split():
+        if not token.endswith("."): # skip move numbers ("1.", "2.")
+            codes.append(encode_move(board.push_san(token)))
+    return board, codes
+
+def to_board(board_or_fen):
+    """Returns a chess.Board of a board, FEN or EPD string."""
+    if isinstance(board_or_fen, chess.Board):
+        return board_or_fen
+    return chess.Board(board_or_fen)
+
+def most_common(values, n):
+    """
+    Returns the n most frequent values and their counts, the most frequent first (ties in the order of first appearance).
+    """
+    unique, first, counts = np.unique(values, return_index = True, return_counts = True)
+    order = np.lexsort((first, -counts))[:n]
+    return unique[order], counts[order]
+
+def top_games(df, board):
+    """
+    Returns information about top 5 games by white's/black's elo in the data frame
+    """
+    #get the color of the next move
+    if board.turn == chess.WHITE:
+        column = "WhiteElo"
+    else:
+        column = "BlackElo"
+
+    top_games = df.sort_values(column, ascending = False, kind = "stable").head(5)
+    top_games_info = top_games[["WhiteElo", "BlackElo", "Result"]].assign(URL = [f"https://lichess.org/{i.decode()}" for i in top_games.index])
+    return top_games_info.reset_index(drop=True)
+
+def group_next_moves(next_codes, results, opponent_elo):
+    """
+    Groups the matched games by their next move in one pass over integer arrays: returns the distinct move codes,
+    the first game of each, the number of games, the (white wins, draws, black wins) counts and the sum of the
+    opponent ratings per move. The games that ended in the position (code 0) are left out.
+    """
+    played = next_codes > 0
+    codes, first, inverse, counts = np.unique(next_codes[played], return_index = True, return_inverse = True, return_counts = True)
+    inverse = inverse.ravel()
+    wdl = np.bincount(inverse * 4 + results[played], minlength = 4 * len(codes)).reshape(-1, 4)[:, :3]
+    elo_sum = np.bincount(inverse, weights = opponent_elo[played], minlength = len(codes))
+    return codes, first, counts, wdl, elo_sum
+
+def next_moves_frame(board, moves, counts, wdl, opponent_elo):
+    """
+    Returns the next moves df: Move, Count, the results of their games (WhiteWins, Draws, BlackWins), the mean rating
+    of the opponent (OpponentElo) and the Score (0-1) and Performance rating of the side to move with the move.
+    The performance is the linear approximation: mean opponent rating + 400 * (wins - losses) / games.
+    """
+    counts, wdl, opponent_elo = np.asarray(counts), np.asarray(wdl).reshape(-1, 3), np.asarray(opponent_elo, dtype = float)
+    wins, losses = (wdl[:, 0], wdl[:, 2]) if board.turn == chess.WHITE else (wdl[:, 2], wdl[:, 0])
+    decided = wdl.sum(axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"): #moves without a known result
+        score = (wins + wdl[:, 1] / 2) / decided
+        performance = opponent_elo + 400 * (wins - losses) / decided
+    return pd.DataFrame({"Move": list(moves), "Count": counts, "WhiteWins": wdl[:, 0], "Draws": wdl[:, 1], "BlackWins": wdl[:, 2],
+                         "OpponentElo": opponent_elo.round(), "Score": score.round(3), "Performance": performance.round()})
+
+def merge_partials(board, partials, n = 5):
+    """
+    Adds up the Partial statistics of several shards and returns the Insights of all their games.
+    """
+    def top(series):
+        series = pd.concat(series).groupby(level = 0, sort = False).sum()
+        return series.sort_values(ascending = False, kind = "stable").head(n)
+
+    next_moves = pd.concat([partial.next_moves for partial in partials]).groupby(level = 0, sort = False).sum()
+    next_moves = next_moves.sort_values("Count", ascending = False, kind = "stable").head(n)
+    next_moves_df = next_moves_frame(board, [board.san(decode_move(code)) for code in next_moves.index], next_moves["Count"],
+                                     next_moves[["WhiteWins", "Draws", "BlackWins"]].to_numpy(),
+                                     next_moves["OpponentEloSum"] / next_moves["Count"])
+    column = "WhiteElo" if board.turn == chess.WHITE else "BlackElo"
+    top_games_df = pd.concat([partial.top_games for partial in partials])
+    top_games_df = top_games_df.sort_values(column, ascending = False, kind = "stable").head(n).reset_index(drop = True)
+    results = tuple(int(sum(counts)) for counts in zip(*[partial.results for partial in partials]))
+    return Insights(next_moves_df, top([partial.openings for partial in partials]).index, top_games_df, results)
+
+# -----------------------------------------------------------------------------
+# 2. QUERY ENGINE
+# -----------------------------------------------------------------------------
+class QueryEngine:
+    """
+    Owns the data set and its indexes and answers the queries of the trainer pages and offline jobs.
+    Game i is row i of df, its moves are move_codes[move_offsets[i]:move_offsets[i + 1]].
+    Position queries need the variable-depth position index (flat_position_index, see pipeline.position_index),
+    the position_keys of the first 20 moves or both FEN tables, in this order of preference.
+    With a DiskCache (store), the indexes built by an earlier run of the data set are loaded instead of built.
+    """
+    def __init__(self, df, move_codes, move_offsets, position_keys = None, white_to_move_fens = None,
+                 black_to_move_fens = None, opening_tree = None, flat_position_index = None, cache_bytes = RESULT_CACHE_MB << 20,
+                 store = None):
+        self.df = df
+        self.move_codes = move_codes
+        self.move_offsets = move_offsets
+        self.flat_position_index = flat_position_index
+        self.position_keys = position_keys
+        self.white_to_move_fens = white_to_move_fens
+        self.black_to_move_fens = black_to_move_fens
+        self.opening_tree = opening_tree
+        self.cache = ResultCache(cache_bytes)
+        self.store = store
+
+    # ------ 2.1 INDEXES (built on first use) ------
+    def stored_index(self, name, build):
+        """Returns the index built with build(), loaded from the disk cache if an earlier run built it."""
+        return read_only(build() if self.store is None else self.store.get_or_build(name, build))
+
+    @cached_property
+    def prefix_index(self):
+        with metrics.timer("build_prefix_index"):
+            return self.stored_index("prefix_index", lambda: build_prefix_index(self.move_codes, self.move_offsets))
+
+    @cached_property
+    def position_index(self):
+        with metrics.timer("build_position_index"):
+            if self.flat_position_index is not None: #already built on disk
+                return flat_key_index(self.flat_position_index)
+            if self.position_keys is not None:
+                return self.stored_index("key_index", lambda: build_key_index(self.position_keys, self.df.index))
+            return self.stored_index("fen_index", lambda: build_position_index(self.white_to_move_fens, self.black_to_move_fens))
+
+    @property
+    def n_games(self):
+        return len(self.df)
+
+    @property
+    def position_plies(self):
+        """The number of half-moves covered by the position index (None if it covers the full games)."""
+        if self.flat_position_index is not None:
+            return self.flat_position_index["max_plies"]
+        if self.position_keys is not None:
+            return self.position_keys.shape[1]
+        return 2 * len(self.white_to_move_fens.columns)
+
+    @cached_property
+    def player_index(self):
+        with metrics.timer("build_player_index"):
+            return self.stored_index("player_index", lambda: build_player_index(self.df))
+
+    def player_names(self, prefix, n = 20):
+        """Returns the first n player names that start with prefix (ignoring case)."""
+        return find_players(self.player_index, prefix, n)
+
+    @cached_property
+    def filter_bitmaps(self):
+        with metrics.timer("build_filter_bitmaps"):
+            return self.stored_index("filter_bitmaps", lambda: build_filter_bitmaps(self.df))
+
+    @cached_property
+    def min_elo(self):
+        return read_only(np.minimum(*self.elo))
+
+    @cached_property
+    def result_codes(self):
+        """The result of every game as 0 (1-0), 1 (1/2-1/2), 2 (0-1) or 3 (other), mapped on the categories of the column."""
+        result = self.df["Result"].cat
+        category_codes = np.append(result.categories.map(RESULT_CODES).fillna(3).to_numpy(dtype = np.int64), 3) #code -1 (missing) -> 3
+        return read_only(category_codes[result.codes.to_numpy()])
+
+    @cached_property
+    def elo(self):
+        """The (white, black) ratings of every game as int64 arrays."""
+        return (read_only(self.df["WhiteElo"].to_numpy(dtype = np.int64)), read_only(self.df["BlackElo"].to_numpy(dtype = np.int64)))
+
+    @cached_property
+    def openings(self):
+        """The opening of every game as an integer code (-1 if missing) and the table of the opening names."""
+        opening = self.df["Opening"].cat
+        return read_only(opening.codes.to_numpy(dtype = np.int64)), np.asarray(opening.categories, dtype = object)
+
+    # ------ 2.2 FILTERS ------
+    def filter_values(self, column):
+        """Returns the values of a filter attribute that have a precomputed bitmap."""
+        return list(self.filter_bitmaps[column])
+
+    def game_filter(self, filters):
+        """
+        Returns the packed bitmap of the games that pass all the filters, or None if no filter is active.
+        Values of one attribute are ORed, attributes are ANDed. Elo values between the bands are computed
+        on the fly and unknown values of the other attributes match no games.
+        """
+        game_filter = None
+        for column, values in normalize_filters(filters):
+            bitmaps = []
+            for value in values:
+                if value in self.filter_bitmaps[column]:
+                    bitmaps.append(self.filter_bitmaps[column][value])
+                elif column == "MinElo":
+                    bitmaps.append(np.packbits(self.min_elo >= int(value)))
+                else:
+                    bitmaps.append(np.zeros((len(self.df) + 7) // 8, dtype = np.uint8))
+            selected = np.bitwise_or.reduce(bitmaps)
+            game_filter = selected if game_filter is None else game_filter & selected
+        return game_filter
+
+    # ------ 2.3 FINDING THE GAMES ------
+    def next_move_codes(self, rows, plies):
+        """
+        Returns the code of the move played after "ply" half-moves in each game (0 if the game has ended).
+        """
+        starts = self.move_offsets[rows] + plies
+        ended = starts >= self.move_offsets[rows + 1]
+        return np.where(ended, 0, self.move_codes[np.where(ended, 0, starts)]).astype(np.int64)
+
+    def line_root(self):
+        """Returns the LineState of the start position: all the games."""
+        return LineState(0, len(self.prefix_index["rows"]), 0, None)
+
+    def line_step(self, state, code):
+        """
+        Returns the LineState after one more move (its code) by narrowing the previous state,
+        so the cost depends on the size of the current subtree and not on the data set.
+        """
+        index = self.prefix_index
+        if state.rows is None:
+            lo, hi = narrow_prefix(index, state.lo, state.hi, state.ply, code)
+            if state.ply + 1 < index["depth"]:
+                return LineState(lo, hi, state.ply + 1, None)
+            return LineState(lo, hi, state.ply + 1, index["rows"][lo:hi]) #the index ends here, continue on the rows
+        rows = state.rows[self.next_move_codes(state.rows, state.ply) == code]
+        return LineState(0, len(rows), state.ply + 1, rows)
+
+    def line_state(self, move_str):
+        """Returns the LineState after the moves of a move string."""
+        state = self.line_root()
+        for code in replay_move_str(move_str)[1]:
+            state = self.line_step(state, code)
+        return state
+
+    def line_matches(self, state, board, filters = ()):
+        """Returns the Matches of the games of a LineState (board is its position) that pass the filters."""
+        index = self.prefix_index
+        if state.rows is None:
+            rows, next_codes = index["rows"][state.lo:state.hi], index["seq"][state.lo:state.hi, state.ply].astype(np.int64)
+        else:
+            rows, next_codes = state.rows, self.next_move_codes(state.rows, state.ply)
+        game_filter = self.game_filter(filters)
+        if game_filter is not None:
+            keep = in_bitmap(game_filter, rows)
+            rows, next_codes = rows[keep], next_codes[keep]
+        return Matches(board, rows, next_codes)
+
+    def find_line(self, move_str, filters = (), state = None):
+        """
+        Returns the Matches of the games that started with the exact same moves as in move_str (and pass the filters).
+        If the LineState of move_str is given (e.g. kept by the trainer between moves), the index is not searched again.
+        """
+        board = replay_move_str(move_str)[0]
+        with metrics.timer("line_lookup"):
+            if state is None:
+                state = self.line_state(move_str)
+            return self.line_matches(state, board, filters)
+
+    def find_position(self, board, filters = (), player = None):
+        """
+        Returns the Matches of all games whose move-history reached the same board position as on the board
+        (and pass the filters), with the move played next in each of them. With a player, a (name, side) pair,
+        only the games of the player with this side (None = both) are searched, at a cost proportional to their number.
+        """
+        game_filter = self.game_filter(filters)
+        within = player_rows(self.player_index, *player) if player else None
+
+        #we check if the board is in the start position, every game reached it
+        if board == chess.Board():
+            rows = np.arange(len(self.df)) if within is None else within
+            if game_filter is not None:
+                rows = rows[in_bitmap(game_filter, rows)]
+            return Matches(board, rows, self.next_move_codes(rows, 0))
+
+        with metrics.timer("position_lookup"):
+            #search for the target position in the position index
+            index = self.position_index
+            if index["hashed"]:
+                rows, plies = lookup_position(index, position_key(board))
+            else:
+                rows, plies = lookup_position(index, board.epd())
+            if within is not None:
+                rows, plies = restrict_postings(rows, plies, within)
+
+            #intersect the postings with the filter before touching the games
+            if game_filter is not None:
+                keep = in_bitmap(game_filter, rows)
+                rows, plies = rows[keep], plies[keep]
+
+            #drop the hash collisions (if any)
+            if index["hashed"]:
+                keep = verify_hits(self.move_codes, self.move_offsets, [board.epd()], np.zeros(len(rows), dtype = np.int64), rows, plies)
+                rows, plies = rows[keep], plies[keep]
+        return Matches(board, rows, self.next_move_codes(rows, plies))
+
+    # ------ 2.4 STATISTICS OF THE MATCHED GAMES ------
+    def opponent_elo(self, board):
+        """The rating of the opponent of the side to move on the board in every game."""
+        return self.elo[1 if board.turn == chess.WHITE else 0]
+
+    def popular_next_moves(self, matches, n = 5):
+        """
+        Returns a df of the n most popular next moves with the results and ratings of their games (see next_moves_frame),
+        computed in one grouped reduction. Only the shown moves are converted to SAN.
+        """
+        with metrics.timer("popular_next_moves"):
+            rows = matches.rows
+            codes, first, counts, wdl, elo_sum = group_next_moves(matches.next_codes, self.result_codes[rows],
+                                                                  self.opponent_elo(matches.board)[rows])
+            top = np.lexsort((first, -counts))[:n] #the most played first, ties in the order of first appearance
+            with metrics.timer("decode_next_moves"):
+                moves = [matches.board.san(decode_move(code)) for code in codes[top]]
+            return next_moves_frame(matches.board, moves, counts[top], wdl[top], elo_sum[top] / counts[top])
+
+    def common_openings(self, rows, n = 5):
+        """
+        Returns the n most common openings of the games.
+        """
+        codes, names = self.openings
+        codes = codes[rows]
+        top, _ = most_common(codes[codes >= 0], n)
+        return pd.Index(names[top])
+
+    def results(self, rows):
+        """
+        Returns the number of (white wins, draws, black wins) of the games.
+        """
+        counts = np.bincount(self.result_codes[rows], minlength = 4)
+        return int(counts[0]), int(counts[1]), int(counts[2])
+
+    def top_games(self, rows, board, n = 5):
+        """
+        Returns information about the top n games by the rating of the player to move; only these rows are read from df.
+        """
+        with metrics.timer("top_games"):
+            elo = self.elo[0 if board.turn == chess.WHITE else 1][rows]
+            top_rows = rows[np.argsort(-elo, kind = "stable")[:n]]
+            return top_games(self.df.iloc[top_rows], board)
+
+    def insights(self, matches):
+        """Returns the Insights (popular next moves, common openings, top games, results) of the matched games."""
+        return Insights(self.popular_next_moves(matches), self.common_openings(matches.rows),
+                        self.top_games(matches.rows, matches.board), self.results(matches.rows))
+
+    def partial_insights(self, matches, n = 5):
+        """
+        Returns the Partial statistics of the matched games: the counts, results and opponent rating sums of all next
+        move codes (as a df indexed by code), the counts of the openings (as a Series), the top n games and the results,
+        so the statistics of several shards can be merged.
+        """
+        rows = matches.rows
+        move_codes, _, move_counts, wdl, elo_sum = group_next_moves(matches.next_codes, self.result_codes[rows],
+                                                                    self.opponent_elo(matches.board)[rows])
+        next_moves = pd.DataFrame({"Count": move_counts, "WhiteWins": wdl[:, 0], "Draws": wdl[:, 1], "BlackWins": wdl[:, 2],
+                                   "OpponentEloSum": elo_sum}, index = move_codes)
+        opening_codes, names = self.openings
+        opening_codes = opening_codes[rows]
+        opening_codes, opening_counts = np.unique(opening_codes[opening_codes >= 0], return_counts = True)
+        return Partial(next_moves, pd.Series(opening_counts, index = names[opening_codes]),
+                       self.top_games(matches.rows, matches.board, n), self.results(matches.rows))
+
+    # ------ 2.5 SINGLE QUERIES (cached) ------
+    @property
+    def tree_covers_positions(self):
+        """
+        Tells if the position nodes of the opening tree are as deep as the position index, so they hold the same statistics.
+        A game can reach a position after the last ply of the tree, then only the index finds it.
+        """
+        plies = self.position_plies
+        return self.opening_tree is not None and plies is not None and plies <= 2 * int(self.opening_tree["max_moves"])
+
+    def tree_insights(self, kind, key, board):
+        """
+        Returns the Insights of a node of the precomputed opening tree ("line" or "position" kind),
+        or None if there is no tree or the node is too rare to be in it.
+        """
+        if self.opening_tree is None or f"{kind}_move_wdl" not in self.opening_tree: #trees built before the move statistics
+            return None
+        with metrics.timer("tree_lookup"):
+            node = find_node(self.opening_tree, kind, key)
+            if node is None:
+                return None
+            moves, common_openings, top_rows, results = node_insights(self.opening_tree, kind, node)
+            move_counts_df = next_moves_frame(board, moves["Move"], moves["Count"], moves[["WhiteWins", "Draws", "BlackWins"]].to_numpy(),
+                                              moves["OpponentElo"])
+        with metrics.timer("top_games"):
+            top_games_df = top_games(self.df.iloc[top_rows], board)
+        return Insights(move_counts_df, common_openings, top_games_df, results)
+
+    def query_line(self, moves_str, filters = (), state = None):
+        """
+        Returns the Insights (popular next moves, common openings, top games, results) of the games that started with moves_str
+        and pass the filters. The opening tree only holds unfiltered statistics, filtered ones use the indexes
+        (starting from the LineState of moves_str if it is given).
+        """
+        filters = normalize_filters(filters)
+        def compute():
+            board = replay_move_str(moves_str)[0]
+            result = None if filters else self.tree_insights("line", line_key(moves_str), board)
+            return result if result is not None else self.insights(self.find_line(moves_str, filters, state))
+        return self.cache.get_or_compute(("line", moves_str, filters), compute)
+
+    def query_position(self, board_or_fen, filters = (), player = None):
+        """
+        Returns the Insights (popular next moves, common openings, top games, results) of the games that reached the position
+        (a chess.Board or a FEN) and pass the filters, only the games of the player if a (name, side) pair is given.
+        The opening tree is only used for unfiltered queries when it is as deep as the position index.
+        """
+        board = to_board(board_or_fen)
+        filters, player = normalize_filters(filters), tuple(player) if player else None
+        def compute():
+            use_tree = not (filters or player) and self.tree_covers_positions
+            result = self.tree_insights("position", position_key(board), board) if use_tree else None
+            return result if result is not None else self.insights(self.find_position(board, filters, player))
+        return self.cache.get_or_compute(("position", board.epd(), filters, player), compute)
+
+    # ------ 2.6 BATCH QUERIES ------
+    def position_postings(self, boards, filters = ()):
+        """
+        Returns the (query number, game row, ply) postings of all the positions, filtered and verified.
+        """
+        index = self.position_index
+        if index["hashed"]:
+            keys = np.array([position_key(board) for board in boards], dtype = np.uint64)
+        else:
+            keys = np.array([board.epd() for board in boards], dtype = object)
+        queries, rows, plies = lookup_positions(index, keys)
+
+        #every game reaches the start position at ply 0, the index only holds the games that return to it later
+        start = chess.Board()
+        starts = [i for i, board in enumerate(boards) if board == start]
+        keep = ~np.isin(queries, starts)
+        queries, rows, plies = queries[keep], rows[keep], plies[keep]
+        for i in starts:
+            queries = np.concatenate([queries, np.full(len(self.df), i)])
+            rows = np.concatenate([rows, np.arange(len(self.df), dtype = rows.dtype)])
+            plies = np.concatenate([plies, np.zeros(len(self.df), dtype = plies.dtype)])
+
+        game_filter = self.game_filter(filters)
+        if game_filter is not None:
+            keep = in_bitmap(game_filter, rows)
+            queries, rows, plies = queries[keep], rows[keep], plies[keep]
+
+        if index["hashed"]:
+            keep = plies == 0
+            check = ~keep
+            epds = [board.epd() for board in boards]
+            keep[check] = verify_hits(self.move_codes, self.move_offsets, epds, queries[check], rows[check], plies[check])
+            queries, rows, plies = queries[keep], rows[keep], plies[keep]
+        return queries, rows, plies
+
+    def query_many(self, positions, filters = (), n_moves = 5):
+        """
+        Answers many positions (chess.Board, FEN or EPD strings) in one vectorized pass over the postings.
+        Returns two data frames:
+        - totals, indexed by the number of the position: Games, WhiteWins, Draws, BlackWins
+        - moves, the n_moves most played next moves of every position (all of them if n_moves is None):
+          Position, Move, Count, WhiteWins, Draws, BlackWins
+        """
+        boards = [to_board(position) for position in positions]
+        with metrics.timer("batch_lookup"):
+            queries, rows, plies = self.position_postings(boards, filters)
+        next_codes = self.next_move_codes(rows, plies)
+        results = self.result_codes[rows]
+
+        n = len(boards)
+        wdl = np.bincount(queries * 4 + results, minlength = 4 * n).reshape(n, 4)
+        totals = pd.DataFrame({"Games": np.bincount(queries, minlength = n), "WhiteWins": wdl[:, 0],
+                               "Draws": wdl[:, 1], "BlackWins": wdl[:, 2]}).rename_axis("Position")
+
+        #group the games by (position, next move), the games that ended in the position have no next move
+        played = next_codes > 0
+        pairs, inverse = np.unique(queries[played].astype(np.int64) << 16 | next_codes[played], return_inverse = True)
+        inverse = inverse.ravel()
+        pair_wdl = np.bincount(inverse * 4 + results[played], minlength = 4 * len(pairs)).reshape(-1, 4)
+        moves = pd.DataFrame({"Position": pairs >> 16, "Code": pairs & 0xFFFF, "Count": np.bincount(inverse, minlength = len(pairs)),
+                              "WhiteWins": pair_wdl[:, 0], "Draws": pair_wdl[:, 1], "BlackWins": pair_wdl[:, 2]})
+        moves = moves.sort_values(["Position", "Count"], ascending = [True, False], kind = "stable")
+        if n_moves is not None:
+            moves = moves[moves.groupby("Position").cumcount() < n_moves]
+        moves.insert(1, "Move", [boards[p].san(decode_move(code)) for p, code in zip(moves["Position"], moves["Code"])])
+        return totals, moves.drop(columns = "Code").reset_index(drop = True)
+
+    # ------ 2.7 PERSISTENT RESULTS ------
+    def load_results(self):
+        """Fills the result cache with the results saved by an earlier run of the data set (if any)."""
+        if self.store is not None:
+            self.cache.update(self.store.load("results.pkl", load_pickle) or [])
+
+    def save_results(self):
+        """Saves the results of the result cache to the disk cache, e.g. the popular lines when the app stops."""
+        if self.store is not None:
+            self.store.save("results.pkl", self.cache.items(), save_pickle)
+
+def load_engine(data_dir = "pages/data", cache_bytes = RESULT_CACHE_MB << 20):
+    """
+    Loads the data set from data_dir and returns a QueryEngine over it, or a ShardedEngine if data_dir holds monthly shards.
+    """
+    from engine.shards import ShardedEngine #engine.shards builds on this module
+    if list_shards(data_dir):
+        return ShardedEngine.from_root(data_dir, cache_bytes)
+    with metrics.timer("dataset_load"):
+        dataset = load_dataset(data_dir)
+    return QueryEngine(**dataset, cache_bytes = cache_bytes)
+
+_engines = {}
+_engines_lock = threading.RLock() #a sharded engine creates the engines of its shards
+
+def shared_engine(data_dir = "pages/data", cache_bytes = RESULT_CACHE_MB << 20):
+    """
+    Returns the query engine over the shared data set of data_dir (see engine.dataset.shared_dataset), created once
+    per process with its indexes. All sessions read the same immutable data, indexes and result cache.
+    If data_dir holds monthly shards, returns a ShardedEngine over the engines of the shards.
+    The results cached by the previous run of the app are loaded, and the cached results are saved when the process exits.
+    """
+    from engine.shards import ShardedEngine
+    with _engines_lock:
+        if data_dir not in _engines:
+            shards = list_shards(data_dir)
+            if shards:
+                for folder in shards.values(): #load the shards in parallel
+                    shared_dataset(str(folder)).start("df", "move_codes", "flat_position_index", "position_keys")
+                engine = ShardedEngine(shards, cache_bytes, DiskCache(data_dir))
+                engine.engines() #build the indexes of every shard before the first query
+            else:
+                engine = QueryEngine(**shared_dataset(data_dir).engine_inputs(), cache_bytes = cache_bytes)
+                #build the indexes before the first query
+                engine.prefix_index
+                engine.position_index
+                engine.filter_bitmaps
+            engine.load_results()
+            atexit.register(engine.save_results)
+            _engines[data_dir] = engine
+        return _engines[data_dir]
@@ -0,0 +1,250 @@
+"""
+Local HTTP/JSON opening explorer over the query engine, answering in the format of the lichess opening explorer.
+
+Endpoints:
+    GET  /explorer?fen=...&play=e2e4,e7e5&speeds=blitz,rapid&minElo=2700&results=1-0&moves=12
+                  (&since=2025-01&until=2025-06 over monthly shards)
+    POST /explorer/batch  {"fens": [...], "speeds": "blitz", "minElo": 2700, "moves": 12}
+    GET  /health
+    GET  /metrics        (Prometheus text format, /metrics.json for JSON)
+
+The server is a single asyncio process: connections are kept alive (HTTP/1.1), many clients are served
+concurrently and the queries run in a thread pool over one shared in-memory copy of the data set.
+
+Usage:
+    python -m engine.server --data-dir pages/data --port 8800
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import chess
+
+from engine.cache import ResultCache
+from engine.metrics import metrics
+from engine.query import shared_engine, to_board
+
+MAX_HEADER_BYTES = 16 << 10
+MAX_BODY_BYTES = 4 << 20
+IDLE_TIMEOUT = 30 #seconds a kept-alive connection may wait for its next request
+#the lichess speed names and the TimeControl categories of the data set (see pipeline.ingest.time_control)
+SPEEDS = {"ultraBullet": "UltraBullet", "bullet": "Bullet", "blitz": "Blitz", "rapid": "Rapid", "classical": "Classical",
+          "correspondence": "NoTime"}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+# -----------------------------------------------------------------------------
+# 1. QUERIES
+# -----------------------------------------------------------------------------
+def split_values(value):
+    """Returns the values of a comma separated parameter (or a JSON list)."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part for part in value.split(",") if part]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def parse_filters(params):
+    """
+    Turns the explorer parameters into engine filters: speeds (the lichess names of SPEEDS),
+    minElo (both players rated at least), results (1-0, 1/2-1/2, 0-1) and terminations.
+    Unknown speeds raise a ValueError (answered with 400) instead of matching no games.
+    """
+    speeds = split_values(params.get("speeds"))
+    unknown = [speed for speed in speeds if speed not in SPEEDS]
+    if unknown:
+        raise ValueError(f"Unknown speeds {', '.join(map(str, unknown))}, use {', '.join(SPEEDS)}.")
+    return {
+        "TimeControl": [SPEEDS[speed] for speed in speeds],
+        "MinElo": [int(elo) for elo in split_values(params.get("minElo"))],
+        "Result": split_values(params.get("results")),
+        "Termination": split_values(params.get("terminations")),
+    }
+
+def parse_months(params, engine):
+    """
+    Turns the since/until parameters (YYYY-MM) into the months keyword of a sharded engine (empty for a single data set).
+    """
+    if not hasattr(engine, "months") or not (params.get("since") or params.get("until")):
+        return {}
+    return {"months": (params.get("since") or engine.months[0], params.get("until") or engine.months[-1])}
+
+def position_board(fen = None, play = None):
+    """Returns the board of the FEN (start position if missing) after the comma separated UCI moves of play."""
+    board = to_board(fen) if fen else chess.Board()
+    for uci in split_values(play):
+        board.push_uci(uci)
+    return board
+
+def move_json(board, row):
+    """Returns a next move of the explorer answer."""
+    move = board.parse_san(row.Move)
+    return {"uci": move.uci(), "san": row.Move, "white": int(row.WhiteWins), "draws": int(row.Draws), "black": int(row.BlackWins)}
+
+def explorer_json(engine, board, filters, n_moves, period):
+    """
+    Returns the explorer answer of one position: the results, the next moves with their own results,
+    the common openings and the top games.
+    """
+    totals, moves = engine.query_many([board], filters, n_moves, **period)
+    _, openings, top_games, _ = engine.query_position(board, filters, **period)
+    return {
+        "white": int(totals["WhiteWins"].iloc[0]),
+        "draws": int(totals["Draws"].iloc[0]),
+        "black": int(totals["BlackWins"].iloc[0]),
+        "moves": [move_json(board, row) for row in moves.itertuples()],
+        "openings": [str(opening) for opening in openings],
+        "topGames": [{"id": game.URL.rsplit("/", 1)[-1], "url": game.URL, "result": game.Result,
+                      "whiteElo": int(game.WhiteElo), "blackElo": int(game.BlackElo)} for game in top_games.itertuples()],
+    }
+
+def batch_json(engine, fens, filters, n_moves, period):
+    """Returns the results and next moves of many positions, answered with one batch query."""
+    boards = [to_board(fen) for fen in fens]
+    totals, moves = engine.query_many(boards, filters, n_moves, **period)
+    answers = [{"fen": fen, "white": int(total.WhiteWins), "draws": int(total.Draws), "black": int(total.BlackWins), "moves": []}
+               for fen, total in zip(fens, totals.itertuples())]
+    for row in moves.itertuples():
+        answers[row.Position]["moves"].append(move_json(boards[row.Position], row))
+    return {"positions": answers}
+
+class Explorer:
+    """
+    Routes the requests to the query engine. The encoded answers of single positions are cached,
+    so popular positions are served without touching the engine.
+    """
+    def __init__(self, engine, workers = 8, cache_bytes = 32 << 20):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.cache = ResultCache(cache_bytes)
+        self.started = time.time()
+        self.requests = 0
+
+    def explorer(self, params):
+        board = position_board(params.get("fen"), params.get("play"))
+        filters = parse_filters(params)
+        n_moves = int(params.get("moves", 12))
+        period = parse_months(params, self.engine)
+        key = (board.epd(), tuple((column, tuple(values)) for column, values in filters.items()), n_moves, tuple(period.values()))
+        return self.cache.get_or_compute(key, lambda: (json.dumps(explorer_json(self.engine, board, filters, n_moves, period)).encode(),))[0]
+
+    def batch(self, body):
+        request = json.loads(body or b"{}")
+        fens = request.get("fens")
+        if not isinstance(fens, list):
+            raise ValueError("The body needs a list of FENs in \"fens\".")
+        period = parse_months(request, self.engine)
+        return json.dumps(batch_json(self.engine, fens, parse_filters(request), int(request.get("moves", 12)), period)).encode()
+
+    def health(self):
+        return json.dumps({"games": self.engine.n_games, "uptime": round(time.time() - self.started, 1),
+                           "requests": self.requests, "cache": self.cache.stats()}).encode()
+
+    def route(self, method, target, body):
+        """Returns (status, body, content type) of a request, called in a worker thread."""
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            return 200, metrics.to_prometheus().encode(), "text/plain; version=0.0.4"
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        routes = {"/explorer": ("GET", lambda: self.explorer(params)), "/explorer/batch": ("POST", lambda: self.batch(body)),
+                  "/health": ("GET", self.health), "/metrics.json": ("GET", lambda: json.dumps(metrics.snapshot()).encode())}
+        if url.path not in routes:
+            return 404, json.dumps({"error": f"Unknown path {url.path}"}).encode(), "application/json"
+        allowed, handler = routes[url.path]
+        if method != allowed:
+            return 405, json.dumps({"error": f"Use {allowed} for {url.path}"}).encode(), "application/json"
+        try:
+            with metrics.timer(f"http {url.path}"):
+                return 200, handler(), "application/json"
+        except ValueError as error: #invalid FEN, move, filter or JSON
+            return 400, json.dumps({"error": str(error)}).encode(), "application/json"
+
+# -----------------------------------------------------------------------------
+# 2. HTTP
+# -----------------------------------------------------------------------------
+def response_bytes(status, body, keep_alive, content_type = "application/json"):
+    """Returns an HTTP/1.1 response."""
+    headers = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}",
+               f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+async def read_request(reader):
+    """
+    Reads one request and returns (method, target, version, headers, body), or None if the client closed the connection.
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("Request headers are too large")
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    method, target, version = request_line.split(" ", 2)
+    headers = {}
+    for line in header_lines:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("Request body is too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+async def handle_connection(explorer, reader, writer):
+    """Serves the requests of one connection until the client closes it or asks for Connection: close."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(response_bytes(413, json.dumps({"error": "Request too large or malformed"}).encode(), False))
+                await writer.drain()
+                break
+            if request is None:
+                break
+            method, target, version, headers, body = request
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+            explorer.requests += 1
+            try:
+                status, response, content_type = await loop.run_in_executor(explorer.executor, explorer.route, method, target, body)
+            except Exception as error:
+                status, response, content_type = 500, json.dumps({"error": repr(error)}).encode(), "application/json"
+            writer.write(response_bytes(status, response, keep_alive, content_type))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(explorer, host, port):
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(explorer, reader, writer),
+                                        host, port, limit = MAX_HEADER_BYTES)
+    print(f"Serving {explorer.engine.n_games:,} games on http://{host}:{port}/explorer")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve the opening explorer over HTTP/JSON.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with the data files of the app (or their monthly shards)")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8800)
+    parser.add_argument("--workers", type = int, default = 8, help = "threads answering the queries")
+    args = parser.parse_args()
+
+    start = time.time()
+    engine = shared_engine(args.data_dir) #also builds the indexes (of every monthly shard)
+    print(f"Loaded the data set and built the indexes in {time.time() - start:.1f} s")
+    asyncio.run(serve(Explorer(engine, args.workers), args.host, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Queries over the monthly shards of the data set (see pipeline.shards): every shard has its own query engine
+and indexes, a query runs on the shards of the selected months and their counts are merged.
+
+Example:
+    engine = ShardedEngine.from_root("pages/data")
+    moves, openings, top_games, results = engine.query_position(fen, months = ("2025-01", "2025-06"))
+"""
+import pandas as pd
+
+from engine.cache import ResultCache
+from engine.disk_cache import DiskCache, load_pickle, save_pickle
+from engine.indexes import normalize_filters
+from engine.metrics import metrics
+from engine.query import NEXT_MOVE_COLUMNS, RESULT_CACHE_MB, Insights, merge_partials, replay_move_str, shared_engine, to_board
+from pipeline.shards import list_shards
+
+
+class ShardedEngine:
+    """
+    The query engines of the shards {month: folder}, answering the same queries as QueryEngine over all
+    shards or a (first, last) range of months. The merged results are cached in a shared LRU cache
+    (and saved to the disk cache of the data root, store, if one is given).
+    """
+    def __init__(self, shards, cache_bytes = RESULT_CACHE_MB << 20, store = None):
+        self.shards = dict(sorted(shards.items()))
+        self.cache = ResultCache(cache_bytes)
+        self.store = store
+
+    @classmethod
+    def from_root(cls, data_root, cache_bytes = RESULT_CACHE_MB << 20):
+        return cls(list_shards(data_root), cache_bytes, DiskCache(data_root))
+
+    # ------ SHARDS ------
+    @property
+    def months(self):
+        return list(self.shards)
+
+    def engines(self, months = None):
+        """Returns the engines of the shards in the (first, last) range of months (all shards if months is None)."""
+        first, last = months or (self.months[0], self.months[-1])
+        return [shared_engine(str(folder)) for month, folder in self.shards.items() if first <= month <= last]
+
+    @property
+    def n_games(self):
+        return sum(engine.n_games for engine in self.engines())
+
+    @property
+    def position_plies(self):
+        """The depth covered by the position indexes of all shards (None if they all cover the full games)."""
+        plies = [engine.position_plies for engine in self.engines() if engine.position_plies is not None]
+        return min(plies) if plies else None
+
+    def filter_values(self, column):
+        """Returns the filter values of all shards."""
+        return sorted(set().union(*[engine.filter_values(column) for engine in self.engines()]))
+
+    def player_names(self, prefix, n = 20):
+        """Returns the first n player names of all shards that start with prefix (ignoring case)."""
+        return sorted(set().union(*[engine.player_names(prefix, n) for engine in self.engines()]), key = str.lower)[:n]
+
+    # ------ LINE STATES ------
+    def line_root(self):
+        """Returns the line states of the start position in every shard, {month: LineState}."""
+        return {month: shared_engine(str(folder)).line_root() for month, folder in self.shards.items()}
+
+    def line_step(self, state, code):
+        """Returns the line states after one more move (its code), every shard is narrowed on its own."""
+        return {month: shared_engine(str(self.shards[month])).line_step(month_state, code) for month, month_state in state.items()}
+
+    # ------ QUERIES ------
+    def merged_insights(self, board, months, find):
+        """Runs find(engine) on the shards of the months and merges their statistics."""
+        engines = self.engines(months)
+        if not engines:
+            return Insights(pd.DataFrame(columns = NEXT_MOVE_COLUMNS), pd.Index([]),
+                            pd.DataFrame(columns = ["WhiteElo", "BlackElo", "Result", "URL"]), (0, 0, 0))
+        with metrics.timer("shard_merge"):
+            return merge_partials(board, [engine.partial_insights(find(engine)) for engine in engines])
+
+    def query_line(self, moves_str, filters = (), months = None, state = None):
+        """
+        Returns the Insights of the games that started with moves_str and pass the filters, in the shards of the months
+        (starting from the line states of moves_str if they are given).
+        """
+        filters, months = normalize_filters(filters), tuple(months) if months else None
+        def compute():
+            board = replay_move_str(moves_str)[0]
+            states = {shared_engine(str(self.shards[month])): month_state for month, month_state in (state or {}).items()}
+            return self.merged_insights(board, months, lambda engine: engine.find_line(moves_str, filters, states.get(engine)))
+        return self.cache.get_or_compute(("line", moves_str, filters, months), compute)
+
+    def query_position(self, board_or_fen, filters = (), months = None, player = None):
+        """
+        Returns the Insights of the games that reached the position and pass the filters, in the shards of the months
+        (only the games of the player if a (name, side) pair is given).
+        """
+        board = to_board(board_or_fen)
+        filters, months, player = normalize_filters(filters), tuple(months) if months else None, tuple(player) if player else None
+        def compute():
+            return self.merged_insights(board, months, lambda engine: engine.find_position(board, filters, player))
+        return self.cache.get_or_compute(("position", board.epd(), filters, months, player), compute)
+
+    def query_many(self, positions, filters = (), n_moves = 5, months = None):
+        """
+        QueryEngine.query_many over the shards of the months: the totals and the counts of every next move are added up.
+        """
+        boards = [to_board(position) for position in positions]
+        parts = [engine.query_many(boards, filters, None) for engine in self.engines(months)]
+        totals = sum(part[0] for part in parts) if parts else pd.DataFrame(
+            0, index = pd.RangeIndex(len(boards), name = "Position"), columns = ["Games", "WhiteWins", "Draws", "BlackWins"])
+        moves = pd.concat([part[1] for part in parts]) if parts else pd.DataFrame(
+            columns = ["Position", "Move", "Count", "WhiteWins", "Draws", "BlackWins"])
+        moves = moves.groupby(["Position", "Move"], as_index = False, sort = False).sum()
+        moves = moves.sort_values(["Position", "Count"], ascending = [True, False], kind = "stable")
+        if n_moves is not None:
+            moves = moves[moves.groupby("Position").cumcount() < n_moves]
+        return totals, moves.reset_index(drop = True)
+
+    # ------ PERSISTENT RESULTS ------
+    def load_results(self):
+        """Fills the result cache with the merged results saved by an earlier run (if any)."""
+        if self.store is not None:
+            self.cache.update(self.store.load("results.pkl", load_pickle) or [])
+
+    def save_results(self):
+        """Saves the merged results of the result cache to the disk cache of the data root."""
+        if self.store is not None:
+            self.store.save("results.pkl", self.cache.items(), save_pickle)
@@ -1,10 +1,15 @@
 ## LOAD THE PACKAGES
+import time
 import streamlit as st
-import chess.svg
 import chess
-import pandas as pd
 import altair as alt
-import numpy as np
+from engine import shared_engine
+from engine import boards
+from engine.shards import ShardedEngine
+from engine.metrics import metrics
+from pipeline.moves import encode_move
+
+page_start = time.perf_counter() #the time of the whole run is recorded at the end of the page
 
 # -----------------------------------------------------------------------------
 # 0. PAGE CONFIGURATIONS
@@ -14,9 +19,11 @@ st.title("Chess Opening Trainer")
 tab_titles = ["Simple Trainer", "Advanced Trainer"]
 tab_easy, tab_hard = st.tabs(tab_titles)
 
-df = st.session_state.df
-white_to_move_fens = st.session_state.white_to_move_fens
-black_to_move_fens = st.session_state.black_to_move_fens
+#one engine per process: all sessions share the same read-only data, indexes and result cache,
+#the games and positions are loaded in the background the first time the page is opened
+with st.spinner("Loading the games and positions..."):
+    engine = shared_engine("pages/data")
+boards.start_warming(engine) #renders the boards of the popular lines in the background, once per process
 
 # -----------------------------------------------------------------------------
 # 1. FUNCTIONS
@@ -24,12 +31,9 @@ black_to_move_fens = st.session_state.black_to_move_fens
 # ------ 1.1 GENERAL FUNCTIONS ------
 def get_board_svg(board, last_move = None, size = 500, orientation = chess.WHITE):
     """
-    Generates an SVG image of the chess board.
+    Returns the SVG image of the chess board, from the render cache shared by all sessions.
     """
-    if last_move:
-        #visualizes the last move
-        return chess.svg.board(board = board, lastmove = last_move, size = size, orientation = orientation)
-    return chess.svg.board(board = board, size = size, orientation = orientation)
+    return boards.board_svg(board, last_move = last_move, size = size, orientation = orientation)
 
 def list_to_move_str(move_list):
     """
@@ -43,142 +47,77 @@ def list_to_move_str(move_list):
             moves_str += f"{move} "
     return moves_str.strip()
 
-def next_move_san(move_str, id = None):
+def results_caption(results):
     """
-    Given a move id list return the move from a move string. If no id is given return none.
-    The id parameter expects [color, move_number].
+    Returns a short text with the percentages of the results.
     """
-    if id == None:
-        return None
-    color, n = id
-    move_n = (n-1) * 3
-    if color == "w":
-        move_n += 1
-    else:
-        move_n += 2
-    try:
-        return move_str.split()[move_n]
-    except IndexError:
-        return None
+    white, draws, black = results
+    total = white + draws + black
+    if total == 0:
+        return "No games found."
+    return f"{total:,} games: White wins {white / total:.0%}, draws {draws / total:.0%}, Black wins {black / total:.0%}"
 
-def next_move_id(move_str):
+def line_states(move_list):
     """
-    Returns the id of the next move. 
-    Example move id: ["w", 2] -> next move is white's second move
+    Returns the stack of line states of the played moves (the start position first), each one narrowed from the previous one.
     """
-    x = len(str.split(move_str))
-    n = x // 3 + 1
-    if x % 3 == 0:
-        return ["w", n]
-    else:
-        return ["b", n]
+    board = chess.Board()
+    states = [engine.line_root()]
+    for move in move_list:
+        states.append(engine.line_step(states[-1], encode_move(board.push_san(move))))
+    return states
 
-def get_popular_next_moves(df):
+def next_moves_table(move_counts_df):
     """
-    Given a filtered data frame, returns a df of 5 popular next moves with counts.
+    Returns the statistics of the next moves for display: the results in percent of the decided games,
+    the mean rating of the opponent and the score and performance rating of the side to move.
     """
-    move_counts = df["Next_moves"].value_counts()
-    counts_df = (move_counts.rename_axis("Move").reset_index(name="Count"))
-    return counts_df.head(5)
-
-def get_common_openings(df):
+    decided = move_counts_df[["WhiteWins", "Draws", "BlackWins"]].sum(axis = 1)
+    table = move_counts_df[["Move", "Count"]].rename(columns = {"Count": "Games"})
+    for column, name in [("WhiteWins", "White %"), ("Draws", "Draw %"), ("BlackWins", "Black %")]:
+        table[name] = (100 * move_counts_df[column] / decided).round(1)
+    table["Opp. Elo"] = move_counts_df["OpponentElo"]
+    table["Score %"] = (100 * move_counts_df["Score"]).round(1)
+    table["Performance"] = move_counts_df["Performance"]
+    return table
+
+# ------ 1.2 GAME FILTERS ------
+def filter_widgets(key):
     """
-    Given a filtered data frame, returns a list of the top 5 most common openings.
+    Shows the filter widgets of a tab and returns the active filters as a hashable tuple of (attribute, values)
+    and the keyword arguments of the selected months (only for a dataset of monthly shards).
     """
-    opening_counts = df["Opening"].value_counts()
-    openings = opening_counts.index
-    counts = opening_counts.values
-    return openings[:5]
-
-def top_games(df, board):
-    """
-    Returns information about top 5 games by white's/black's elo in the data frame
-    """
-    #get the color of the next move
-    if board.turn == chess.WHITE:
-        column = "WhiteElo"
-    else:
-        column = "BlackElo"
-
-    top_games = df.sort_values(column, ascending = False).head(5)
-    top_games["URL"] = [f"https://lichess.org/{i}" for i in top_games.index]
-    top_games_info = top_games[["WhiteElo", "BlackElo", "Result", "URL"]]
-    return top_games_info.reset_index(drop=True)
-
-
-# ------ 1.2 SIMPLE IMPLEMENTATION FUNCTIONS ------
-def find_games_with_str_position(df, move_str):
-    """
-    Returns filtered data frame with the games that played the exact same moves as in move_str
-    """
-    mask = df["Moves"].str.contains(move_str, regex = False) #perform literal substring search
-    return df.loc[mask].reset_index().copy()
-
-
-def filter_data_move_str(df, move_str):
-    """
-    Given move string filter the data frame and attach a column with the next move
-    """
-    filtered = find_games_with_str_position(df, move_str).copy()
-    id = next_move_id(move_str)
-    filtered["Next_moves"] = filtered["Moves"].apply(lambda m: next_move_san(m, id))
-    return filtered
-
-# ------ 1.3 ADVANCED IMPLEMENTATION (FEN) FUNCTIONS ------
-def next_move_id_fen(fen_moves, target_fen):
-        try:
-            id = fen_moves.index(target_fen) + 1
-            n = id//2 + 1
-            if id % 2 == 0:
-                return ["w", n]
-            else:
-                return ["b", n]
-        except ValueError:
-            return None
-
-def find_games_fen(df, board):
+    period = {}
+    with st.expander("Filter games"):
+        if isinstance(engine, ShardedEngine) and len(engine.months) > 1:
+            months = st.select_slider("Months", engine.months, value = (engine.months[0], engine.months[-1]), key = f"months_{key}")
+            if months != (engine.months[0], engine.months[-1]):
+                period["months"] = months
+        time_controls = st.multiselect("Time control", engine.filter_values("TimeControl"), key = f"time_control_{key}")
+        min_elo = st.select_slider("Both players rated at least", ["Any"] + engine.filter_values("MinElo"), key = f"min_elo_{key}")
+        results = st.multiselect("Result", engine.filter_values("Result"), key = f"result_{key}")
+        terminations = st.multiselect("Termination", engine.filter_values("Termination"), key = f"termination_{key}")
+
+    filters = [("TimeControl", tuple(time_controls)), ("MinElo", () if min_elo == "Any" else (min_elo,)),
+               ("Result", tuple(results)), ("Termination", tuple(terminations))]
+    return tuple((column, values) for column, values in filters if values), period
+
+def player_widgets(key):
     """
-    Return all games in df whose move-history reached the same
-    board position as on the board. Return also the next move information for each match.
+    Shows the player search of a tab and returns the selected (name, side) pair, None if no player is selected.
     """
-    #we check if the board is in the start position
-    if board == chess.Board():
-        df["Next_moves"] = df["Moves"].apply(lambda m: next_move_san(m, ["w", 1]))
-        return df 
-    
-    target_fen = board.epd()
-
-    #get the color of the next move
-    if board.turn == chess.WHITE:
-        to_move_c = "w"
-        fens_df = white_to_move_fens #use white_to_move_fens for search
-    else:
-        to_move_c = "b"
-        fens_df = black_to_move_fens #use black_to_move_fens for search
-    
-    #search for the target fen
-    result = np.where(fens_df == target_fen)
-    matched_game_ID = fens_df.index[result[0]].tolist()
-    move_numbers = fens_df.columns[result[1]].astype(int)
-
-    #filter the dataframe using the matched IDs
-    df_filtered = df.loc[matched_game_ID]
-
-    next_move_sans = [next_move_san(m, [to_move_c, n]) for m,n in zip(df_filtered["Moves"], move_numbers)]
-    df_filtered["Next_moves"] = next_move_sans
-    return df_filtered
-
-# ------ 1.4 Default statistics (statistics of the starting position) ------
-def stats_initialization():
-    '''Calculate the baseline statistics from the start position'''
-    moves_str = ""
-    filtered = filter_data_move_str(df, moves_str) #we get the next moves
-    popular_moves = get_popular_next_moves(filtered)
-    common_opens = get_common_openings(filtered)
-    return popular_moves, common_opens
-
-if 'stats_initialization' not in st.session_state:
-    st.session_state.stats_initialization = stats_initialization()
+    name = None
+    with st.expander("Player repertoire"):
+        prefix = st.text_input("Player name", key = f"player_prefix_{key}", placeholder = "start typing a lichess name")
+        names = engine.player_names(prefix) if prefix else []
+        if prefix and not names:
+            st.caption("No player found.")
+        if names:
+            name = st.selectbox("Player", names, key = f"player_{key}")
+        side = st.radio("Playing as", ["Either side", "White", "Black"], horizontal = True, key = f"player_side_{key}")
+    if name is None:
+        return None
+    return name, None if side == "Either side" else side
 
 # -----------------------------------------------------------------------------
 # 2. OPENING TRAINER EASY TAB
@@ -191,6 +130,9 @@ if 'move_history_san' not in st.session_state:
     st.session_state.move_history_san = [] # To store moves in Standard Algebraic Notation (SAN)
 if 'orientation' not in st.session_state:
     st.session_state.orientation = chess.WHITE
+#the line state of every played move, a move only narrows the games of the previous one and a take back pops it
+if 'line_states' not in st.session_state or len(st.session_state.line_states) != len(st.session_state.move_history_san) + 1:
+    st.session_state.line_states = line_states(st.session_state.move_history_san)
 
 #initialize the move string
 moves_str = ""
@@ -231,6 +173,7 @@ with tab_easy:
                 try:
                     move = st.session_state.board.parse_san(user_move)
                     user_move_san = st.session_state.board.san(move)
+                    st.session_state.line_states.append(engine.line_step(st.session_state.line_states[-1], encode_move(move)))
                     st.session_state.move_history_san.append(user_move_san)
                     st.session_state.board.push(move)
 
@@ -249,13 +192,26 @@ with tab_easy:
             """
             st.session_state.board = chess.Board()
             st.session_state.move_history_san = []
+            st.session_state.line_states = st.session_state.line_states[:1]
             st.session_state.move_input = ""
 
+        def take_back():
+            """
+            Takes back the last move, the line state of the previous move is reused.
+            This function is called when the 'Take Back' button is clicked.
+            """
+            if st.session_state.move_history_san:
+                st.session_state.board.pop()
+                st.session_state.move_history_san.pop()
+                st.session_state.line_states.pop()
+
         with st.form(key="move_form"):
             st.text_input("Enter your move:", key = "move_input", placeholder = "e.g. e4, d4, Nf3")
             st.form_submit_button("Make Move", use_container_width = True, on_click=process_move)
 
-        st.button("Reset Board", key = "Reset", use_container_width = True, on_click=reset_board)
+        col_back, col_reset = st.columns(2)
+        col_back.button("Take Back", key = "Back", use_container_width = True, on_click = take_back)
+        col_reset.button("Reset Board", key = "Reset", use_container_width = True, on_click=reset_board)
 
 #------ 2.3 POSITION INSIGHTS ------
     with col_info:
@@ -271,13 +227,8 @@ with tab_easy:
         st.write("---")
 
         #------ 2.3.1 CALCULATIONS OF STATISTICS ------ UNIQUE TO THIS VERSION
-        if moves_str:
-            filtered_df = filter_data_move_str(df, moves_str)
-            move_counts_df = get_popular_next_moves(filtered_df)
-            common_openings = get_common_openings(filtered_df)
-        else:
-            filtered_df = df
-            move_counts_df, common_openings = st.session_state.stats_initialization
+        filters, period = filter_widgets("easy")
+        move_counts_df, common_openings, top_games_df, results = engine.query_line(moves_str, filters, state = st.session_state.line_states[-1], **period)
 
         #------ 2.3.2 POPULAR NEXT MOVES ------
         st.write("**Popular Next Moves:**")
@@ -285,9 +236,11 @@ with tab_easy:
         chart = (alt.Chart(move_counts_df).mark_bar().encode(
                 x=alt.X("Count", title="Times Played"),
                 y=alt.Y("Move", sort="-x", title = ""),
-                tooltip=["Move", "Count"]) )
+                tooltip=["Move", "Count", "Score", "OpponentElo", "Performance"]) )
 
         st.altair_chart(chart, use_container_width=True)
+        st.dataframe(next_moves_table(move_counts_df), hide_index = True, key = "next_moves")
+        st.caption(results_caption(results))
         st.write("---")
 
         #------ 2.3.3 COMMON OPENINGS ------
@@ -301,7 +254,7 @@ with tab_easy:
     with col_board:
         st.write("**Top Player Games from this Position**")
         st.write("Copy the link and see the full game")
-        st.dataframe(top_games(filtered_df, st.session_state.board), key = "data_frame")
+        st.dataframe(top_games_df, key = "data_frame")
 # -----------------------------------------------------------------------------
 # 3. OPENING TRAINER FEN (HARD) TAB
 # -----------------------------------------------------------------------------
@@ -323,7 +276,10 @@ moves_str_fen = ""
 with tab_hard:
     st.header("Advanced Opening Trainer")
     st.write("This version analyzes the board based on the current position, not the move order. It finds all games that reached this exact setup, even through a different sequence of moves. This gives you the most accurate insights into the position.")
-    st.write("Because this version is more computationally intensive, it can be slightly slower. **Please note:** This advanced analysis is available for positions within the first 20 moves of a game.")
+    if engine.position_plies is None:
+        st.write("Because this version is more computationally intensive, it can be slightly slower. The analysis covers every position of the games, also deep in the middlegame.")
+    else:
+        st.write(f"Because this version is more computationally intensive, it can be slightly slower. **Please note:** This advanced analysis is available for positions within the first {engine.position_plies // 2} moves of a game.")
     st.write("Enter moves (e.g., `e4`, `Nf3`, `O-O`). The board will update, and you'll see insights.")
 
     col_board_fen, col_info_fen = st.columns([3, 2]) # Separates the page: Board takes 3/5 width, info 2/5
@@ -372,11 +328,19 @@ with tab_hard:
             st.session_state.move_history_san_fen = []
             st.session_state.move_input_fen = ""
 
+        def take_back_fen():
+            """This function is called when the 'Take Back' button is clicked."""
+            if st.session_state.move_history_san_fen:
+                st.session_state.board_fen.pop()
+                st.session_state.move_history_san_fen.pop()
+
         with st.form(key = "move_form_fen"):
             st.text_input("Enter your move:", key = "move_input_fen", placeholder = "e.g. e4, d4, Nf3")
             st.form_submit_button("Make Move", use_container_width = True, on_click = process_move_fen)
 
-        st.button("Reset Board", key = "Reset_fen", use_container_width = True, on_click = reset_board_fen)
+        col_back_fen, col_reset_fen = st.columns(2)
+        col_back_fen.button("Take Back", key = "Back_fen", use_container_width = True, on_click = take_back_fen)
+        col_reset_fen.button("Reset Board", key = "Reset_fen", use_container_width = True, on_click = reset_board_fen)
 
 #------ 3.3 POSITION INSIGHTS ------
     with col_info_fen:
@@ -392,13 +356,12 @@ with tab_hard:
         st.write("---")    
 
         #------ 3.3.1 CALCULATIONS OF STATISTICS ------ UNIQUE TO THIS VERSION
-        if moves_str_fen:
-            filtered_df_fen = find_games_fen(df, st.session_state.board_fen)
-            move_counts_df_fen = get_popular_next_moves(filtered_df_fen)
-            common_openings_fen = get_common_openings(filtered_df_fen)
-        else:
-            filtered_df_fen = df
-            move_counts_df_fen, common_openings_fen = st.session_state.stats_initialization
+        filters_fen, period_fen = filter_widgets("fen")
+        player_fen = player_widgets("fen")
+        move_counts_df_fen, common_openings_fen, top_games_df_fen, results_fen = engine.query_position(st.session_state.board_fen, filters_fen,
+                                                                                                        player = player_fen, **period_fen)
+        if player_fen is not None:
+            st.caption(f"Only the games of {player_fen[0]}" + (f" with {player_fen[1]}" if player_fen[1] else "") + ".")
 
 
         #------ 3.3.2 POPULAR NEXT MOVES ------
@@ -407,9 +370,11 @@ with tab_hard:
         chart_fen = (alt.Chart(move_counts_df_fen).mark_bar().encode(
                 x=alt.X("Count", title="Times Played"),
                 y=alt.Y("Move", sort="-x", title = ""),
-                tooltip=["Move", "Count"]) )
+                tooltip=["Move", "Count", "Score", "OpponentElo", "Performance"]) )
 
         st.altair_chart(chart_fen, use_container_width=True)
+        st.dataframe(next_moves_table(move_counts_df_fen), hide_index = True, key = "next_moves_fen")
+        st.caption(results_caption(results_fen))
         st.write("---")
 
         #------ 3.3.3 COMMON OPENINGS ------
@@ -423,4 +388,17 @@ with tab_hard:
          #------ 3.3.4 BEST GAMES DF ------
         st.write("**Top Player Games from this Position**")
         st.write("Copy the link and see the full game")
-        st.dataframe(top_games(filtered_df_fen, st.session_state.board_fen), key = "data_frame_fen")
\ No newline at end of file
+        st.dataframe(top_games_df_fen, key = "data_frame_fen")
+
+# -----------------------------------------------------------------------------
+# 4. CACHE STATISTICS
+# -----------------------------------------------------------------------------
+cache_stats = engine.cache.stats()
+st.sidebar.caption(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                   f"{cache_stats['entries']} positions ({cache_stats['bytes'] / 2**20:.1f} of {cache_stats['max_bytes'] / 2**20:.0f} MB)")
+svg_stats = boards.svg_cache_stats()
+st.sidebar.caption(f"Board cache: {svg_stats['hits']} hits, {svg_stats['misses']} misses, {svg_stats['entries']} boards "
+                   f"({svg_stats['bytes'] / 2**20:.1f} of {svg_stats['max_bytes'] / 2**20:.0f} MB)")
+
+#time of the whole run of the page (one click of a user)
+metrics.record("trainer_page", time.perf_counter() - page_start)
@@ -1,25 +1,20 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+from engine.dataset import shared_dataset
 
 # we set page title
 st.title("Statistics")
 st.markdown("""
 Welcome to the Statistics page, here you can view through the respective tabs certain statistics regarding the chosen dataseet of chess games.
 
-To ensure smooth performance and avoid browser memory issues, this page operates on a **random sample of up to 50,000 games** from the full dataset.  
-If the dataset contains fewer than 50,000 games, the entire dataset is used.
+All statistics are computed exactly on the **full dataset**. They are precomputed once per dataset, so the page stays fast whatever the size of the dataset.
 """)
 
-# function to load data
-df = st.session_state.df
-
-# Take a consistent sample to reduce memory usage
-sampled_df = df.sample(n=50000, random_state=42) if len(df) > 50000 else df.copy()
-
-# check if movelist exists, if not make sure moves is a string then convert to list via split
-if "MoveList" not in sampled_df.columns:
-    sampled_df["MoveList"] = sampled_df["Moves"].apply(lambda m: str(m).split())
+# the statistics tables are loaded (or computed) once per process, the games are only loaded if statistics.json is missing
+dataset = shared_dataset("pages/data")
+with st.spinner("Loading the statistics..."):
+    stats = dataset.get("statistics")
 
 # we define the tabs in the page
 stats_tabs = [
@@ -49,14 +44,13 @@ with tab_elo:
     Both White and Black Elo values are combined into a single histogram, allowing us to look at overall player rating.  
     The bars represent how frequently different Elo ranges occur among all players.
     """)
-    elo_df = pd.concat([sampled_df['WhiteElo'], sampled_df['BlackElo']]).dropna()
     chart_elo = (
-        alt.Chart(pd.DataFrame({"ELO": elo_df}))
+        alt.Chart(stats["elo"])
         .mark_bar()
         .encode(
             alt.X("ELO", bin=alt.Bin(maxbins=100)),
-            y="count()",
-            tooltip=["count()"]
+            y=alt.Y("sum(Count)", title="Count of Records"),
+            tooltip=[alt.Tooltip("sum(Count)", title="Count of Records")]
         )
         .properties(title="Distribution of Player ELO Ratings")
     )
@@ -70,8 +64,7 @@ with tab_openings:
     It is based on the frequency of the `Opening` label recorded for each game.  
     This can be used to identify which openings are most common in the dataset.
     """)
-    opening_counts = sampled_df["Opening"].value_counts().reset_index()
-    opening_counts.columns = ["Opening", "Count"]
+    opening_counts = stats["openings"][["Opening", "TotalGames"]].rename(columns={"TotalGames": "Count"})
     top_openings = opening_counts.head(25)
     chart_openings = (
         alt.Chart(top_openings)
@@ -95,8 +88,7 @@ with tab_results:
     - `1/2-1/2` indicates a draw  
     Each slice represents the proportion of games with that result, helping visualize outcomes.
     """)
-    result_counts = sampled_df["Result"].value_counts().reset_index()
-    result_counts.columns = ["Result", "Count"]
+    result_counts = stats["results"]
     chart_results = (
         alt.Chart(result_counts)
         .mark_arc()
@@ -115,16 +107,15 @@ with tab_duration:
     st.markdown("""
     This histogram shows the distribution of game lengths, measured in number of moves.  
     Each bar represents how many games fell into a certain move-count range.  
-    The `MoveList` column is used to compute the number of moves per game.
+    The number of moves per game is computed from the encoded moves of each game.
     """)
-    sampled_df["MoveCount"] = sampled_df["MoveList"].apply(len)
     chart_duration = (
-        alt.Chart(sampled_df)
+        alt.Chart(stats["move_count"])
         .mark_bar()
         .encode(
             alt.X("MoveCount", bin=alt.Bin(maxbins=100)),
-            y="count()",
-            tooltip=["count()"]
+            y=alt.Y("sum(Count)", title="Count of Records"),
+            tooltip=[alt.Tooltip("sum(Count)", title="Count of Records")]
         )
         .properties(title="Distribution of Game Durations")
     )
@@ -142,14 +133,7 @@ with tab_winrate:
     - Adjust how many top openings to display in the bar chart.
     These stats help identify which openings tend to be more successful for each side.
     """)
-    opening_total = sampled_df["Opening"].value_counts().rename_axis("Opening").reset_index(name="TotalGames")
-    white_wins = sampled_df[sampled_df["Result"] == "1-0"]["Opening"].value_counts().rename_axis("Opening").reset_index(name="WhiteWins")
-    black_wins = sampled_df[sampled_df["Result"] == "0-1"]["Opening"].value_counts().rename_axis("Opening").reset_index(name="BlackWins")
-    draws = sampled_df[sampled_df["Result"] == "1/2-1/2"]["Opening"].value_counts().rename_axis("Opening").reset_index(name="Draws")
-    winrate_df = opening_total.merge(white_wins, on="Opening", how="left") \
-                              .merge(black_wins, on="Opening", how="left") \
-                              .merge(draws, on="Opening", how="left")
-    winrate_df = winrate_df.fillna(0)
+    winrate_df = stats["openings"].copy() #the cached table is shared, so we add the columns to a copy
     winrate_df["WhiteWin%"] = (winrate_df["WhiteWins"] / winrate_df["TotalGames"]) * 100
     winrate_df["BlackWin%"] = (winrate_df["BlackWins"] / winrate_df["TotalGames"]) * 100
     winrate_df["Draw%"] = (winrate_df["Draws"] / winrate_df["TotalGames"]) * 100
@@ -189,8 +173,7 @@ with tab_termination:
     Termination types include normal (e.g. checkmate, resignation, and various draw rules) and timeout.  
     The counts are displayed here.
     """)
-    term_counts = sampled_df["Termination"].value_counts().reset_index()
-    term_counts.columns = ["Termination", "Count"]
+    term_counts = stats["termination"]
     top_termination = term_counts.head(10)
     chart_termination = (
         alt.Chart(top_termination)
@@ -212,8 +195,7 @@ with tab_timecontrols:
     Time controls indicate the pace of the game, such as blitz, rapid, or classical formats.  
     Each bar shows how often a given time control occurred across all games.
     """)
-    tc_counts = sampled_df["TimeControl"].value_counts().reset_index()
-    tc_counts.columns = ["TimeControl", "Count"]
+    tc_counts = stats["time_control"]
     top_timecontrols = tc_counts.head(10)
     chart_timecontrols = (
         alt.Chart(top_timecontrols)
@@ -0,0 +1,79 @@
+import os
+import json
+import streamlit as st
+import pandas as pd
+import altair as alt
+from engine.metrics import metrics
+
+# we set page title
+st.title("Diagnostics")
+
+# the page shows internals of the app, so it is only available if it was switched on
+if os.environ.get("TRAINER_DIAGNOSTICS") != "1":
+    st.info("The diagnostics page is switched off. Start the app with the environment variable `TRAINER_DIAGNOSTICS=1` to see it.")
+    st.stop()
+
+st.markdown("""
+This page shows where the time of the app goes. Every hot path (loading the data, the position lookup,
+the next-move aggregation, the top games, the board rendering, ...) is a **stage**. The statistics are computed over
+the last calls of every stage, for all users of the running app.
+""")
+
+snapshot = metrics.snapshot()
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.metric("Uptime", f"{snapshot['uptime_seconds'] / 60:.1f} min")
+with col2:
+    st.metric("Resident Memory", f"{snapshot['resident_memory_bytes'] / 2**20:,.0f} MB")
+with col3:
+    st.metric("Peak Memory", f"{snapshot['peak_memory_bytes'] / 2**20:,.0f} MB")
+
+if not snapshot["stages"]:
+    st.info("Nothing was measured yet. Play a few moves in the Opening Trainer.")
+    st.stop()
+
+# stage table
+stages_df = pd.DataFrame([
+    {"Stage": name, "Calls": stage["count"], "Mean (ms)": stage["mean_ms"], "p50 (ms)": stage["p50_ms"],
+     "p90 (ms)": stage["p90_ms"], "p99 (ms)": stage["p99_ms"], "Max (ms)": stage["max_ms"],
+     "Total (s)": stage["total_seconds"], "Max memory growth (MB)": round(stage["max_memory_growth_bytes"] / 2**20, 1)}
+    for name, stage in snapshot["stages"].items()
+])
+st.subheader("Stages")
+st.dataframe(stages_df.sort_values("Total (s)", ascending = False), hide_index = True, use_container_width = True)
+
+# p50/p99 per stage
+st.subheader("Latency per Stage")
+latency_df = stages_df.melt(id_vars = "Stage", value_vars = ["p50 (ms)", "p99 (ms)"], var_name = "Percentile", value_name = "ms")
+chart = alt.Chart(latency_df).mark_bar().encode(
+    x = alt.X("ms", title = "Milliseconds"),
+    y = alt.Y("Stage", sort = "-x", title = ""),
+    color = "Percentile",
+    yOffset = "Percentile",
+    tooltip = ["Stage", "Percentile", "ms"]
+)
+st.altair_chart(chart, use_container_width = True)
+
+# rolling histogram of one stage
+st.subheader("Rolling Histogram")
+stage_name = st.selectbox("Stage", list(snapshot["stages"]))
+durations_df = pd.DataFrame({"ms": metrics.durations(stage_name) * 1000})
+st.caption(f"The last {len(durations_df)} calls of {stage_name} (at most {snapshot['window']}).")
+histogram = alt.Chart(durations_df).mark_bar().encode(
+    x = alt.X("ms", bin = alt.Bin(maxbins = 40), title = "Milliseconds"),
+    y = alt.Y("count()", title = "Calls")
+)
+st.altair_chart(histogram, use_container_width = True)
+
+# export
+st.subheader("Export")
+col_json, col_prometheus, col_reset = st.columns(3)
+with col_json:
+    st.download_button("Download JSON", json.dumps(snapshot, indent = 2), file_name = "trainer_metrics.json", mime = "application/json")
+with col_prometheus:
+    st.download_button("Download Prometheus", metrics.to_prometheus(), file_name = "trainer_metrics.prom", mime = "text/plain")
+with col_reset:
+    if st.button("Reset Measurements"):
+        metrics.reset()
+        st.rerun()
@@ -0,0 +1,4 @@
+"""
+Command-line stages that turn a monthly lichess dump into the data files used by the app.
+The steps follow pages/data/data_cleaning.ipynb, but are written to run over the full dump.
+"""
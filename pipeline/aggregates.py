@@ -0,0 +1,146 @@
+"""
+Computes the exact statistics of the whole data set for the Statistics page (statistics.json) and the
+headline numbers of the Home page (summary.json).
+
+The tables are small (one row per Elo value, opening, game length, ...), so the pages can draw their charts
+without touching the games. The app computes the same tables once per process if the files are missing.
+
+Usage:
+    python -m pipeline.aggregates --data-dir pages/data
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pipeline.games import open_games
+
+
+def count_table(values, name):
+    """Returns the counts of the values as a (name, Count) data frame, the most common first (counted on the categorical codes)."""
+    counts = values.value_counts()
+    counts = counts[counts > 0] #categories of the dictionary that no game uses
+    return pd.DataFrame({name: counts.index.to_numpy(), "Count": counts.to_numpy()})
+
+def compute_statistics(df, plies):
+    """
+    Computes the tables of the Statistics page from the games and the number of half-moves of every game.
+    """
+    elo = pd.concat([df["WhiteElo"], df["BlackElo"]]).dropna()
+    elo_counts = elo.value_counts().sort_index()
+
+    #the game length counts the tokens of the move string ("1.", "e4", "e5", ...): the half-moves plus the move numbers
+    plies = np.asarray(plies)
+    move_counts = pd.Series(plies + (plies + 1) // 2).value_counts().sort_index()
+
+    #the totals also count the games without a result, the results only split the W/D/L columns
+    totals = df.groupby("Opening", observed = True).size()
+    totals = totals[totals > 0]
+    results = df.groupby(["Opening", "Result"], observed = True).size().unstack(fill_value = 0).reindex(totals.index, fill_value = 0)
+    openings = pd.DataFrame({
+        "Opening": totals.index.to_numpy(),
+        "TotalGames": totals.to_numpy(),
+        "WhiteWins": results.get("1-0", pd.Series(0, index = results.index)).to_numpy(),
+        "BlackWins": results.get("0-1", pd.Series(0, index = results.index)).to_numpy(),
+        "Draws": results.get("1/2-1/2", pd.Series(0, index = results.index)).to_numpy(),
+    }).sort_values("TotalGames", ascending = False, kind = "stable").reset_index(drop = True)
+
+    return {
+        "n_games": len(df),
+        "elo": pd.DataFrame({"ELO": elo_counts.index.to_numpy(), "Count": elo_counts.to_numpy()}),
+        "openings": openings,
+        "results": count_table(df["Result"], "Result"),
+        "move_count": pd.DataFrame({"MoveCount": move_counts.index.to_numpy(), "Count": move_counts.to_numpy()}),
+        "termination": count_table(df["Termination"], "Termination"),
+        "time_control": count_table(df["TimeControl"], "TimeControl"),
+    }
+
+def merge_statistics(parts):
+    """
+    Merges the statistics tables of several shards into the tables of all their games (the counts are added).
+    """
+    def merge(name, key, by_count = True):
+        table = pd.concat([part[name] for part in parts]).groupby(key, as_index = False, sort = False).sum()
+        if by_count: #the most common first, like the tables of a single data set
+            return table.sort_values(table.columns[1], ascending = False, kind = "stable").reset_index(drop = True)
+        return table.sort_values(key).reset_index(drop = True)
+
+    return {
+        "n_games": sum(int(part["n_games"]) for part in parts),
+        "elo": merge("elo", "ELO", by_count = False),
+        "openings": merge("openings", "Opening"),
+        "results": merge("results", "Result"),
+        "move_count": merge("move_count", "MoveCount", by_count = False),
+        "termination": merge("termination", "Termination"),
+        "time_control": merge("time_control", "TimeControl"),
+    }
+
+def compute_summary(statistics):
+    """
+    Returns the numbers of the Home page (total games, unique openings, average game length in moves) from the statistics tables.
+    """
+    move_count = statistics["move_count"]
+    total_moves = (move_count["MoveCount"] * move_count["Count"]).sum()
+    return {
+        "n_games": int(statistics["n_games"]),
+        "n_openings": len(statistics["openings"]),
+        "average_length": round(float(total_moves / max(move_count["Count"].sum(), 1)), 2),
+    }
+
+def save_statistics(statistics, file_path):
+    """Writes the statistics tables to a JSON file."""
+    data = {name: table.to_dict("list") if isinstance(table, pd.DataFrame) else table for name, table in statistics.items()}
+    with open(file_path, "w", encoding = "utf-8") as out_f:
+        json.dump(data, out_f, default = lambda value: value.item()) #numpy scalars -> python values
+
+def load_statistics(file_path):
+    """Reads the statistics tables written by save_statistics."""
+    with open(file_path, encoding = "utf-8") as in_f:
+        data = json.load(in_f)
+    return {name: pd.DataFrame(table) if isinstance(table, dict) else table for name, table in data.items()}
+
+def save_summary(summary, file_path):
+    """Writes the summary numbers to a JSON file."""
+    with open(file_path, "w", encoding = "utf-8") as out_f:
+        json.dump(summary, out_f)
+
+def load_summary(file_path):
+    """Reads the summary numbers written by save_summary."""
+    with open(file_path, encoding = "utf-8") as in_f:
+        return json.load(in_f)
+
+def game_plies(data_dir, table):
+    """
+    Returns the number of half-moves of every game, from move_offsets.npy (if it belongs to these games)
+    or by counting the moves in the move strings.
+    """
+    offsets_path = Path(data_dir) / "move_offsets.npy"
+    if offsets_path.exists():
+        offsets = np.load(offsets_path)
+        if len(offsets) - 1 == table.num_rows:
+            return np.diff(offsets)
+        print(f"The move offsets of {len(offsets) - 1} games do not match the {table.num_rows} games, they are ignored.")
+    moves = table.column("Moves").to_pylist()
+    return np.array([sum(1 for t in str(m).split() if not t.endswith(".")) for m in moves])
+
+def build_statistics(data_dir):
+    """Computes the statistics of the games in data_dir and writes statistics.json and summary.json."""
+    start = time.time()
+    table = open_games(data_dir)
+    df = table.select(["WhiteElo", "BlackElo", "Opening", "Result", "Termination", "TimeControl"]).to_pandas()
+    statistics = compute_statistics(df, game_plies(data_dir, table))
+    save_statistics(statistics, Path(data_dir) / "statistics.json")
+    save_summary(compute_summary(statistics), Path(data_dir) / "summary.json")
+    print(f"Finished. Total games: {len(df)}, time: {(time.time() - start):.2f} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compute the statistics tables of the Statistics page and the summary of the Home page.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with games_clean.arrow (or .csv)")
+    args = parser.parse_args()
+    build_statistics(args.data_dir)
+
+if __name__ == "__main__":
+    main()
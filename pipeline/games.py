@@ -0,0 +1,85 @@
+"""
+The schema of the cleaned games and reading them (games_clean.arrow or games_clean.csv) in batches.
+
+The schema is compact: the low-cardinality text columns and the player names are dictionary-encoded (they become
+pandas categoricals, so counting and grouping run on integer codes), the ratings are int16 and the lichess IDs are
+8 fixed-width bytes. Only the move strings stay variable-length strings.
+"""
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+SCHEMA = pa.schema([
+    ("ID", pa.binary(8)),
+    ("White", pa.dictionary(pa.int32(), pa.string())),
+    ("Black", pa.dictionary(pa.int32(), pa.string())),
+    ("Result", pa.dictionary(pa.int8(), pa.string())),
+    ("WhiteElo", pa.int16()),
+    ("BlackElo", pa.int16()),
+    ("ECO", pa.dictionary(pa.int16(), pa.string())),
+    ("Opening", pa.dictionary(pa.int16(), pa.string())),
+    ("TimeControl", pa.dictionary(pa.int8(), pa.string())),
+    ("Termination", pa.dictionary(pa.int8(), pa.string())),
+    ("Moves", pa.string()),
+])
+COLUMNS = SCHEMA.names
+
+def apply_schema(table):
+    """
+    Casts a table of cleaned games to SCHEMA (files written before the compact schema, the CSV file).
+    Ratings out of the int16 range or IDs that are not 8 bytes raise an error instead of being truncated.
+    Columns of older files that did not keep them (the player names) are added as nulls.
+    """
+    if table.schema.equals(SCHEMA):
+        return table
+    for field in SCHEMA:
+        if field.name not in table.column_names:
+            table = table.append_column(field.name, pa.nulls(table.num_rows, pa.string()))
+    return table.select(COLUMNS).cast(SCHEMA)
+
+def games_frame(table):
+    """
+    Converts a table of cleaned games to a data frame indexed by ID: the dictionary columns become categoricals,
+    the IDs and move strings stay Arrow-backed (the memory-mapped buffers are not copied).
+    """
+    table = apply_schema(table)
+    keep_arrow = lambda dtype: pd.ArrowDtype(dtype) if pa.types.is_string(dtype) or pa.types.is_fixed_size_binary(dtype) else None
+    return table.to_pandas(types_mapper = keep_arrow).set_index("ID")
+
+
+def open_games(data_dir):
+    """
+    Returns the cleaned games as an Arrow table with SCHEMA. The .arrow file is memory-mapped, the CSV file is parsed.
+    """
+    data_dir = Path(data_dir)
+    arrow_path = data_dir / "games_clean.arrow"
+    if arrow_path.exists():
+        return read_games(arrow_path)
+    return apply_schema(pa.Table.from_pandas(read_games_csv(data_dir / "games_clean.csv"), preserve_index = False))
+
+def read_games_csv(file_path, n_rows = None):
+    """
+    Parses a CSV file of cleaned games: the text columns stay strings (a player called "NA" is not missing),
+    only empty fields are nulls.
+    """
+    text_columns = {name: str for name in COLUMNS if name not in ("WhiteElo", "BlackElo")}
+    return pd.read_csv(file_path, sep = ";", dtype = text_columns, keep_default_na = False, na_values = [""], nrows = n_rows)
+
+def read_games(file_path):
+    """Memory-maps an Arrow file of cleaned games and returns its table with SCHEMA."""
+    return apply_schema(pa.ipc.open_file(pa.memory_map(str(file_path), "r")).read_all())
+
+def write_games(table, file_path):
+    """Writes a table of cleaned games to an Arrow file, read back with read_games."""
+    with pa.OSFile(str(file_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def iter_game_batches(table, columns, batch_size):
+    """
+    Yields (first row, {column: list of values}) for consecutive batches of at most batch_size games.
+    """
+    table = table.select(columns)
+    for start in range(0, table.num_rows, batch_size):
+        batch = table.slice(start, batch_size)
+        yield start, {column: batch.column(column).to_pylist() for column in columns}
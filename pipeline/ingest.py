@@ -0,0 +1,249 @@
+"""
+Streams a lichess PGN dump (plain or .pgn.zst) and writes the cleaned games to games_clean.csv and games_clean.arrow
+(with the compact schema of pipeline.games).
+
+The decompressed stream is cut into chunks on game boundaries, the chunks are filtered and cleaned in a
+process pool and written back in their original order, so the output does not depend on the number of workers.
+
+Usage:
+    python -m pipeline.ingest lichess_db_standard_rated_2025-03.pgn.zst --min-elo 2600
+"""
+import argparse
+import csv
+import os
+import re
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import zstandard as zstd
+
+from pipeline.games import COLUMNS, SCHEMA
+from pipeline.parallel import ordered_map
+
+KEEP = ("[Site ", "[White ", "[Black ", "[Result ", "[WhiteElo ", "[BlackElo ", "[ECO ", "[Opening ", "[TimeControl ", "[Termination ", "1.")
+DROP_TERMINATIONS = {"Unterminated", "Rules infraction", "Abandoned"}
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+GAME_START = b"\n[Event "
+
+# -----------------------------------------------------------------------------
+# 1. CLEANING (same rules as in data_cleaning.ipynb)
+# -----------------------------------------------------------------------------
+def extract_value(line):
+    """Extract the quoted value from a PGN header line, quotes and backslashes in it are escaped with a backslash."""
+    # e.g. '[White "STRI0006"]' -> 'STRI0006', '[Opening "A \"B\""]' -> 'A "B"'
+    value = line[line.index("\"") + 1:line.rindex("\"")]
+    return re.sub(r"\\(.)", r"\1", value)
+
+def clean_moves(line):
+    """Strip the moves of annotation"""
+    #e.g. 1. e4 { [%eval 0.18] [%clk 0:10:00] } 1... e5 { [%eval 0.21] [%clk 0:10:00] } 2. Nf3 { [%eval 0.48] [%clk 0:10:00] } 1-0
+    #–> 1. e4 e5 2. Nf3 1-0
+    line = re.sub(r"\s\{[^{}]*\}|[!?]+", "", line)
+    return re.sub(r'\s+\d+\.\.\.\s+', ' ', line).strip()
+
+def remove_result(game_str):
+    '''Removes the result from the game string'''
+    tokens = game_str.strip().split(" ")
+    if tokens[-1] in RESULTS:
+        tokens = tokens[:-1]
+    return ' '.join(tokens)
+
+def time_control(x):
+    """ Assigns the time control cathegory to time control"""
+    if "+" in x:
+        time, inc = [int(i) for i in x.split("+")]
+        sum_time = time + 40*inc
+        if sum_time < 29:
+            return "UltraBullet"
+        elif sum_time < 179:
+            return "Bullet"
+        elif sum_time < 479:
+            return "Blitz"
+        elif sum_time < 1499:
+            return "Rapid"
+        else:
+            return "Classical"
+    else:
+        return "NoTime"
+
+def clean_game(headers, moves, min_elo):
+    """
+    Returns the cleaned row of a game, or None if the game does not pass the criteria.
+    """
+    try:
+        w_elo, b_elo = int(headers["WhiteElo"]), int(headers["BlackElo"])
+    except (KeyError, ValueError): #missing or unknown ("?") rating
+        return None
+    if w_elo < min_elo or b_elo < min_elo:
+        return None
+    if headers.get("Termination") in DROP_TERMINATIONS:
+        return None
+    moves = remove_result(clean_moves(moves)) if moves else ""
+    if not moves: #games with no moves
+        return None
+    return [
+        headers["Site"].split("/")[-1],
+        headers.get("White") or None, #missing or empty values are stored as nulls, as in games_clean.csv
+        headers.get("Black") or None,
+        headers.get("Result") or None,
+        w_elo,
+        b_elo,
+        headers.get("ECO") or None,
+        headers.get("Opening") or None,
+        time_control(headers.get("TimeControl", "-")),
+        headers.get("Termination") or None,
+        moves,
+    ]
+
+def clean_chunk(chunk, min_elo):
+    """
+    Cleans a chunk of raw PGN text which holds only whole games.
+    Returns the number of checked games and the kept games as a list of columns.
+    """
+    columns = [[] for _ in COLUMNS]
+    game_count = 0
+    headers, moves = None, None
+
+    def flush():
+        if headers is not None and "Site" in headers:
+            row = clean_game(headers, moves, min_elo)
+            if row is not None:
+                for column, value in zip(columns, row):
+                    column.append(value)
+
+    for line in chunk.decode("utf-8").splitlines():
+        if not line.startswith(KEEP):
+            continue
+        elif line.startswith("[Site"):
+            #we mark the beginning of the game
+            flush()
+            game_count += 1
+            headers, moves = {"Site": extract_value(line)}, None
+        elif headers is not None:
+            if line.startswith("1."):
+                moves = line
+            else:
+                headers[line[1:line.index(" ")]] = extract_value(line)
+    flush()
+    return game_count, columns
+
+# -----------------------------------------------------------------------------
+# 2. STREAMING
+# -----------------------------------------------------------------------------
+def open_pgn(input_path):
+    """
+    Opens a PGN file as a binary stream, .zst files are decompressed on the fly (nothing is written to disk).
+    """
+    in_file = open(input_path, "rb")
+    if str(input_path).endswith(".zst"):
+        return zstd.ZstdDecompressor().stream_reader(in_file, closefd = True)
+    return in_file
+
+def read_chunks(stream, chunk_size):
+    """
+    Yields chunks of about chunk_size bytes, every chunk ends on a game boundary.
+    """
+    rest = b""
+    while True:
+        block = stream.read(chunk_size)
+        if not block:
+            break
+        buffer = rest + block
+        cut = buffer.rfind(GAME_START)
+        if cut == -1: #no game boundary yet, keep reading
+            rest = buffer
+            continue
+        yield buffer[:cut + 1]
+        rest = buffer[cut + 1:]
+    if rest:
+        yield rest
+
+# -----------------------------------------------------------------------------
+# 3. OUTPUT
+# -----------------------------------------------------------------------------
+def write_csv_rows(csv_writer, columns):
+    """
+    Appends the cleaned games to the CSV file. Fields with a separator, quote or line break are quoted
+    and missing values are written as empty fields (read back as nulls).
+    """
+    csv_writer.writerows(zip(*columns))
+
+def record_batch(columns, dictionaries):
+    """
+    Returns the Arrow batch of the cleaned games with SCHEMA. The dictionaries {column: {value: code}} only grow,
+    so every batch adds a delta to the dictionaries of the file and the codes of the earlier batches stay valid.
+    """
+    arrays = []
+    for field, values in zip(SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            dictionary = dictionaries.setdefault(field.name, {})
+            codes = [None if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, field.type.index_type), pa.array(list(dictionary), pa.string())))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.record_batch(arrays, schema = SCHEMA)
+
+def dictionaries_started(dictionaries):
+    """
+    Tells if every dictionary column has a value: the IPC file can only add deltas to a dictionary that was
+    not empty when it was first written, so the games are held back until then (e.g. the first games lack player names).
+    """
+    return all(dictionaries.get(field.name) for field in SCHEMA if pa.types.is_dictionary(field.type))
+
+def extract_games(input_path, output_dir, min_elo = 2600, workers = None, chunk_size = 64 << 20):
+    """
+    Streams the dump at input_path and writes games_clean.csv and games_clean.arrow into output_dir.
+    """
+    start = time.time()
+    workers = workers or os.cpu_count()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents = True, exist_ok = True)
+
+    game_count = 0
+    loaded_count = 0
+    last_report = start
+    dictionaries = {}
+    pending = [[] for _ in COLUMNS] #games not written to the Arrow file yet, see dictionaries_started
+
+    with open_pgn(input_path) as stream, \
+            open(output_dir / "games_clean.csv", "w", encoding = "utf-8", newline = "") as out_f, \
+            pa.ipc.new_file(str(output_dir / "games_clean.arrow"), SCHEMA,
+                            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas = True)) as arrow_writer:
+        csv_writer = csv.writer(out_f, delimiter = ";", lineterminator = "\n")
+        csv_writer.writerow(COLUMNS)
+
+        for checked, columns in ordered_map(clean_chunk, read_chunks(stream, chunk_size), workers, min_elo):
+            game_count += checked
+            loaded_count += len(columns[0])
+            write_csv_rows(csv_writer, columns)
+            for column, values in zip(pending, columns):
+                column.extend(values)
+            batch = record_batch(pending, dictionaries)
+            if dictionaries_started(dictionaries):
+                arrow_writer.write_batch(batch)
+                pending = [[] for _ in COLUMNS]
+
+            if time.time() - last_report >= 10:
+                last_report = time.time()
+                elapsed = last_report - start
+                print(f"Checked games: {game_count}, loaded {loaded_count}, {game_count / elapsed:,.0f} games/sec, time {elapsed:.2f} seconds")
+        if pending[0]: #a column without any value, written once with its empty dictionary
+            arrow_writer.write_batch(record_batch(pending, dictionaries))
+
+    elapsed = time.time() - start
+    print(f"Finished. Total checked: {game_count}, loaded: {loaded_count}, {game_count / max(elapsed, 1e-9):,.0f} games/sec, time: {elapsed:.2f} seconds")
+    return game_count, loaded_count
+
+def main():
+    parser = argparse.ArgumentParser(description = "Clean a lichess PGN dump (.pgn or .pgn.zst) into the app data files.")
+    parser.add_argument("input", help = "path to the .pgn or .pgn.zst dump")
+    parser.add_argument("--output-dir", default = "pages/data", help = "where to write games_clean.csv and games_clean.arrow")
+    parser.add_argument("--min-elo", type = int, default = 2600, help = "minimal rating of both players")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--chunk-mb", type = int, default = 64, help = "size of the chunks sent to the workers in MB")
+    args = parser.parse_args()
+    extract_games(args.input, args.output_dir, args.min_elo, args.workers, args.chunk_mb << 20)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Encodes the moves of every game as integers: move_codes.npy holds the uint16 codes of all games one after
+another and move_offsets.npy the start of every game (game i is move_codes[offsets[i]:offsets[i + 1]]).
+
+A move code stores the from-square in bits 0-5, the to-square in bits 6-11 and the promotion piece in bits 12-14
+(0 = no promotion, 1 = knight ... 4 = queen). Code 0 (a1a1) is never a legal move, so it can be used as padding.
+The codes are turned back into SAN with the board of the position they are played in.
+
+Usage:
+    python -m pipeline.moves --data-dir pages/data
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import chess
+import numpy as np
+
+from pipeline.games import iter_game_batches, open_games
+from pipeline.parallel import ordered_map
+
+
+def encode_move(move):
+    """Returns the uint16 code of a chess.Move."""
+    promotion = move.promotion - 1 if move.promotion else 0
+    return move.from_square | move.to_square << 6 | promotion << 12
+
+def decode_move(code):
+    """Returns the chess.Move of a move code."""
+    code = int(code)
+    promotion = code >> 12
+    return chess.Move(code & 63, (code >> 6) & 63, promotion = promotion + 1 if promotion else None)
+
+def encode_game(moves_str):
+    """
+    Given a move string, returns the codes of its moves. The game is cut at the first invalid move.
+    """
+    board = chess.Board()
+    codes = []
+    for token in moves_str.split():
+        if token.endswith('.'):
+            continue  # skip move numbers ("1.", "2.")
+        try:
+            move = board.push_san(token)
+        except ValueError: #invalid move
+            break
+        codes.append(encode_move(move))
+    return codes
+
+def encode_games(moves_list):
+    """
+    Encodes a list of move strings, returns the flat uint16 codes and the number of moves of every game.
+    """
+    games = [encode_game(str(moves_str)) for moves_str in moves_list]
+    lengths = np.fromiter((len(codes) for codes in games), dtype = np.int64, count = len(games))
+    codes = np.fromiter((code for codes in games for code in codes), dtype = np.uint16, count = int(lengths.sum()))
+    return codes, lengths
+
+def to_offsets(lengths):
+    """Turns the number of moves of every game into the offsets of the games in the flat code array."""
+    offsets = np.zeros(len(lengths) + 1, dtype = np.int64)
+    np.cumsum(lengths, out = offsets[1:])
+    return offsets
+
+def generate_move_codes(data_dir, workers = None, batch_size = 10000):
+    """
+    Writes move_codes.npy and move_offsets.npy for the games in data_dir.
+    The codes are streamed to disk batch by batch, so only the offsets are kept in memory.
+    """
+    start = time.time()
+    data_dir = Path(data_dir)
+    workers = workers or os.cpu_count()
+    table = open_games(data_dir)
+
+    raw_path = data_dir / "move_codes.tmp"
+    lengths = []
+    done = 0
+    batches = (batch["Moves"] for _, batch in iter_game_batches(table, ["Moves"], batch_size))
+    with open(raw_path, "wb") as raw_f:
+        for codes, batch_lengths in ordered_map(encode_games, batches, workers):
+            raw_f.write(codes.tobytes())
+            lengths.append(batch_lengths)
+            done += len(batch_lengths)
+            elapsed = time.time() - start
+            print(f"Encoded games: {done}/{table.num_rows}, {done / elapsed:,.0f} games/sec, time {elapsed:.2f} seconds")
+
+    offsets = to_offsets(np.concatenate(lengths) if lengths else np.zeros(0, dtype = np.int64))
+    codes = np.memmap(raw_path, dtype = np.uint16, mode = "r", shape = (int(offsets[-1]),)) if offsets[-1] else np.zeros(0, dtype = np.uint16)
+    np.save(data_dir / "move_codes.npy", codes)
+    np.save(data_dir / "move_offsets.npy", offsets)
+    del codes
+    os.remove(raw_path)
+    print(f"Finished. Total games: {table.num_rows}, moves: {offsets[-1]}, time: {(time.time() - start):.2f} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Encode the moves of the cleaned games as uint16 codes.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with games_clean.arrow (or .csv)")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type = int, default = 10000, help = "games per batch sent to a worker")
+    args = parser.parse_args()
+    generate_move_codes(args.data_dir, args.workers, args.batch_size)
+
+if __name__ == "__main__":
+    main()
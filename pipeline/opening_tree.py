@@ -0,0 +1,260 @@
+"""
+Builds the opening tree (opening_tree.npz) with precomputed statistics for every frequent node of the first 20 moves.
+
+The tree has two kinds of nodes, both stored as sorted 64-bit keys with per-node aggregates:
+- "position" nodes are keyed by the polyglot Zobrist key of the position, so transpositions are merged (Advanced Trainer)
+- "line" nodes are keyed by a hash of the move string, e.g. "1. e4 e5 2. Nf3" (Simple Trainer)
+
+Every node stores the number of games, the W/D/L counts, the most played next moves (with the W/D/L counts and the
+mean opponent rating of their games), the most common openings and the rows of the top games by the Elo of the side to move. Nodes with fewer than --min-games games are left out,
+the trainer answers those (rare) positions from the games directly.
+
+Usage:
+    python -m pipeline.opening_tree --data-dir pages/data
+"""
+import argparse
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+import pandas as pd
+
+from pipeline.games import iter_game_batches, open_games
+from pipeline.parallel import ordered_map
+
+TOP_MOVES = 10
+TOP_OPENINGS = 5
+TOP_GAMES = 5
+RESULT_CODES = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+KINDS = ("position", "line")
+
+# -----------------------------------------------------------------------------
+# 1. NODE KEYS
+# -----------------------------------------------------------------------------
+def line_key(moves_str):
+    """
+    Returns the 64-bit key of a move string in the format of the Moves column, e.g. "1. e4 e5 2. Nf3".
+    """
+    return int.from_bytes(hashlib.blake2b(moves_str.encode("utf-8"), digest_size = 8).digest(), "little")
+
+def position_key(board):
+    """Returns the 64-bit polyglot Zobrist key of the board."""
+    return chess.polyglot.zobrist_hash(board)
+
+def game_nodes(moves_str, max_plies):
+    """
+    Replays a game and returns the position keys, line keys and next moves of the first max_plies + 1 positions.
+    """
+    board = chess.Board()
+    tokens = moves_str.split()
+    sans = [token for token in tokens if not token.endswith(".")]
+    position_keys, line_keys, next_moves = [], [], []
+    for ply in range(min(len(sans), max_plies) + 1):
+        position_keys.append(position_key(board))
+        line_keys.append(line_key(" ".join(tokens[:ply + ply // 2 + ply % 2])))
+        next_moves.append(sans[ply] if ply < len(sans) else None)
+        if ply < len(sans):
+            try:
+                board.push_san(sans[ply])
+            except ValueError: #invalid move
+                break
+    return position_keys, line_keys, next_moves
+
+def nodes_for_batch(moves_list, max_plies):
+    """
+    Returns the nodes of a batch of games as flat arrays (row in batch, ply, position key, line key, next move).
+    """
+    rows, plies, position_keys, line_keys, next_moves = [], [], [], [], []
+    for row, moves_str in enumerate(moves_list):
+        p_keys, l_keys, n_moves = game_nodes(moves_str, max_plies)
+        rows.extend([row] * len(p_keys))
+        plies.extend(range(len(p_keys)))
+        position_keys.extend(p_keys)
+        line_keys.extend(l_keys)
+        next_moves.extend(n_moves)
+    return (np.asarray(rows, dtype = np.int32), np.asarray(plies, dtype = np.int16),
+            np.asarray(position_keys, dtype = np.uint64), np.asarray(line_keys, dtype = np.uint64), next_moves)
+
+# -----------------------------------------------------------------------------
+# 2. AGGREGATION
+# -----------------------------------------------------------------------------
+def top_k_per_group(groups, scores, k):
+    """
+    Returns the indices of the k highest scores of every group, sorted by group and then by score (descending).
+    """
+    order = np.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < k]
+
+def fill_top(groups, values, n_groups, k, fill = -1, dtype = np.int32):
+    """Spreads (group, value) pairs that are sorted by group into a (n_groups x k) array."""
+    out = np.full((n_groups, k), fill, dtype = dtype)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.array([], dtype = int)
+    rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+    out[groups, rank] = values
+    return out
+
+def aggregate_nodes(keys, rows, plies, next_codes, results, white_elo, black_elo, opening_codes, min_games):
+    """
+    Groups the (game row, ply) postings by node key and computes the per-node aggregates.
+    The postings must be in the order of the games (rows, then plies).
+    """
+    order = np.argsort(keys, kind = "stable")
+    keys, rows, plies, next_codes = keys[order], rows[order], plies[order], next_codes[order]
+
+    #a game that reaches a position twice (a repetition or a transposition) is counted once, at its first time,
+    #like in the position index
+    first = np.r_[True, (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])]
+    keys, rows, plies, next_codes = keys[first], rows[first], plies[first], next_codes[first]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+
+    #keep only the frequent nodes
+    keep = counts >= min_games
+    node_of_posting = np.repeat(np.where(keep, np.cumsum(keep) - 1, -1), counts)
+    kept = node_of_posting != -1
+    node, rows, plies, next_codes = node_of_posting[kept], rows[kept], plies[kept], next_codes[kept]
+    n_nodes = int(keep.sum())
+
+    #W/D/L counts
+    result = results[rows]
+    wdl = np.zeros((n_nodes, 3), dtype = np.int32)
+    has_result = result >= 0
+    np.add.at(wdl, (node[has_result], result[has_result]), 1)
+
+    #most played next moves and most common openings
+    tops = {}
+    for name, codes, k in [("moves", next_codes, TOP_MOVES), ("openings", opening_codes[rows], TOP_OPENINGS)]:
+        valid = codes >= 0
+        pairs = node[valid].astype(np.int64) * (int(codes.max(initial = 0)) + 1) + codes[valid]
+        pairs, pair_of_posting, pair_counts = np.unique(pairs, return_inverse = True, return_counts = True)
+        pair_nodes, pair_codes = np.divmod(pairs, int(codes.max(initial = 0)) + 1)
+        sel = top_k_per_group(pair_nodes, pair_counts, k)
+        tops[name] = fill_top(pair_nodes[sel], pair_codes[sel], n_nodes, k)
+        tops[name + "_counts"] = fill_top(pair_nodes[sel], pair_counts[sel], n_nodes, k, fill = 0)
+
+        #W/D/L and mean opponent rating (of the side that plays the move) of every top next move
+        if name == "moves":
+            pair_of_posting = pair_of_posting.ravel()
+            move_result = result[valid]
+            scored = move_result >= 0
+            pair_wdl = np.bincount(pair_of_posting[scored] * 3 + move_result[scored], minlength = 3 * len(pairs)).reshape(-1, 3)
+            tops["move_wdl"] = np.stack([fill_top(pair_nodes[sel], pair_wdl[sel, j], n_nodes, k, fill = 0) for j in range(3)], axis = 2)
+            opponent_elo = np.where(plies % 2 == 0, black_elo[rows], white_elo[rows])[valid]
+            elo_sum = np.bincount(pair_of_posting, weights = opponent_elo, minlength = len(pairs))
+            tops["move_opponent_elo"] = fill_top(pair_nodes[sel], elo_sum[sel] / pair_counts[sel], n_nodes, k, fill = 0, dtype = np.float32)
+
+    #top games by the elo of the side to move
+    elo = np.where(plies % 2 == 0, white_elo[rows], black_elo[rows])
+    sel = top_k_per_group(node, elo, TOP_GAMES)
+    top_games = fill_top(node[sel], rows[sel], n_nodes, TOP_GAMES)
+
+    return {
+        "keys": keys[starts[keep]],
+        "games": counts[keep].astype(np.int32),
+        "wdl": wdl,
+        "moves": tops["moves"],
+        "move_counts": tops["moves_counts"],
+        "move_wdl": tops["move_wdl"],
+        "move_opponent_elo": tops["move_opponent_elo"],
+        "openings": tops["openings"],
+        "opening_counts": tops["openings_counts"],
+        "top_games": top_games,
+    }
+
+def build_opening_tree(data_dir, max_moves = 20, min_games = 5, workers = None, batch_size = 10000):
+    """
+    Replays the games in data_dir and writes opening_tree.npz.
+    """
+    start = time.time()
+    data_dir = Path(data_dir)
+    workers = workers or os.cpu_count()
+    table = open_games(data_dir)
+
+    #replay the games in parallel and collect the (game row, ply) postings of every node
+    postings = {name: [] for name in ["rows", "plies", "position", "line"]}
+    next_moves = []
+    batches = (batch["Moves"] for _, batch in iter_game_batches(table, ["Moves"], batch_size))
+    for n, (rows, plies, p_keys, l_keys, n_moves) in enumerate(ordered_map(nodes_for_batch, batches, workers, 2 * max_moves)):
+        postings["rows"].append(rows + n * batch_size)
+        postings["plies"].append(plies)
+        postings["position"].append(p_keys)
+        postings["line"].append(l_keys)
+        next_moves.extend(n_moves)
+        done = min((n + 1) * batch_size, table.num_rows)
+        elapsed = time.time() - start
+        print(f"Replayed games: {done}/{table.num_rows}, {done / elapsed:,.0f} games/sec, time {elapsed:.2f} seconds")
+    postings = {name: np.concatenate(arrays) for name, arrays in postings.items()}
+
+    #encode the strings as integer codes
+    next_codes, move_table = pd.factorize(pd.Series(next_moves, dtype = object))
+    opening_codes, opening_table = pd.factorize(table.column("Opening").to_pandas())
+    result = table.column("Result").to_pandas().cat #the results are mapped on the categories, code -1 (missing) -> -1
+    results = np.append(result.categories.map(RESULT_CODES).fillna(-1).to_numpy(dtype = np.int8), -1)[result.codes.to_numpy()]
+    white_elo = table.column("WhiteElo").to_numpy()
+    black_elo = table.column("BlackElo").to_numpy()
+
+    arrays = {"moves_table": np.asarray(move_table, dtype = str), "openings_table": np.asarray(opening_table, dtype = str),
+              "max_moves": np.asarray(max_moves), "n_games": np.asarray(table.num_rows)}
+    for kind in KINDS:
+        nodes = aggregate_nodes(postings[kind], postings["rows"], postings["plies"], next_codes.astype(np.int32),
+                                results, white_elo, black_elo, opening_codes.astype(np.int32), min_games)
+        for name, values in nodes.items():
+            arrays[f"{kind}_{name}"] = values
+        print(f"{kind} nodes: {len(nodes['keys'])}")
+
+    np.savez(data_dir / "opening_tree.npz", **arrays)
+    print(f"Finished. Total games: {table.num_rows}, time: {(time.time() - start):.2f} seconds")
+
+# -----------------------------------------------------------------------------
+# 3. LOOKUP (used by the trainer)
+# -----------------------------------------------------------------------------
+def load_opening_tree(file_path):
+    """Loads opening_tree.npz into a dict of arrays."""
+    with np.load(file_path) as data:
+        return {name: data[name] for name in data.files}
+
+def find_node(tree, kind, key):
+    """
+    Returns the number of the node with the given key ("position" or "line" kind), or None if it is not in the tree.
+    """
+    keys = tree[f"{kind}_keys"]
+    i = np.searchsorted(keys, np.uint64(key))
+    if i < len(keys) and keys[i] == key:
+        return i
+    return None
+
+def node_insights(tree, kind, i, n_moves = 5):
+    """
+    Returns the statistics of a node: the popular next moves (Move, Count, WhiteWins, Draws, BlackWins, OpponentElo),
+    the common openings, the rows of the top games and the (white wins, draws, black wins) counts (as ints, like QueryEngine.results).
+    """
+    moves = tree[f"{kind}_moves"][i][:n_moves]
+    shown = moves >= 0
+    wdl = tree[f"{kind}_move_wdl"][i][:n_moves][shown]
+    move_counts_df = pd.DataFrame({"Move": tree["moves_table"][moves[shown]], "Count": tree[f"{kind}_move_counts"][i][:n_moves][shown],
+                                   "WhiteWins": wdl[:, 0], "Draws": wdl[:, 1], "BlackWins": wdl[:, 2],
+                                   "OpponentElo": tree[f"{kind}_move_opponent_elo"][i][:n_moves][shown]})
+    openings = tree[f"{kind}_openings"][i]
+    common_openings = pd.Index(tree["openings_table"][openings[openings >= 0]])
+    top_games = tree[f"{kind}_top_games"][i]
+    return move_counts_df, common_openings, top_games[top_games >= 0], tuple(int(count) for count in tree[f"{kind}_wdl"][i])
+
+def main():
+    parser = argparse.ArgumentParser(description = "Build the opening tree with precomputed statistics of the frequent nodes.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with games_clean.arrow (or .csv)")
+    parser.add_argument("--max-moves", type = int, default = 20, help = "depth of the tree in moves (of both sides)")
+    parser.add_argument("--min-games", type = int, default = 5, help = "nodes with fewer games are left out of the tree")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type = int, default = 10000, help = "games per batch sent to a worker")
+    args = parser.parse_args()
+    build_opening_tree(args.data_dir, args.max_moves, args.min_games, args.workers, args.batch_size)
+
+if __name__ == "__main__":
+    main()
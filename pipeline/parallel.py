@@ -0,0 +1,26 @@
+"""
+Helpers for running the pipeline stages in a process pool.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def ordered_map(func, items, workers, *args):
+    """
+    Like map(func, items) but runs in a process pool and yields the results in the order of items.
+    Only a few items per worker are in flight, so the memory stays bounded on long inputs.
+    Extra args are passed to func after the item.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
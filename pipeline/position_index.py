@@ -0,0 +1,166 @@
+"""
+Builds the variable-depth position index (position_index_*.npy) used by the Advanced Trainer.
+
+Unlike position_keys.npy (one row of 40 keys per game), the index is a flat postings structure: the sorted
+distinct polyglot Zobrist keys, and for every key the slice offsets[i]:offsets[i+1] of the (game row, ply)
+postings of the games that reached the position. A game that reaches a position twice is posted once
+(at the first time). The depth is any ply limit or the full game.
+
+The index is built in one streaming pass: the games are replayed in batches in a process pool and the
+postings of every batch are appended to bucket files by the top bits of their key. Each bucket is then
+sorted on its own and written into the final memory-mapped arrays, so the memory is bounded by the size
+of a batch and of a bucket, whatever the depth.
+
+Usage:
+    python -m pipeline.position_index --data-dir pages/data                #full games
+    python -m pipeline.position_index --data-dir pages/data --max-plies 60
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from pipeline.games import iter_game_batches, open_games
+from pipeline.parallel import ordered_map
+
+POSTING = np.dtype([("key", "<u8"), ("row", "<i4"), ("ply", "<i2")]) #one posting in the bucket files
+FILES = ("keys", "offsets", "rows", "plies")
+
+# -----------------------------------------------------------------------------
+# 1. REPLAYING THE GAMES
+# -----------------------------------------------------------------------------
+def game_keys(moves_str, max_plies = None):
+    """
+    Given a move string, returns the Zobrist keys of the positions after each half-move (up to max_plies, None = all).
+    """
+    board = chess.Board()
+    keys = []
+    for token in moves_str.split():
+        if token.endswith('.'):
+            continue  # skip move numbers ("1.", "2.")
+        if max_plies is not None and len(keys) >= max_plies:
+            break
+        try:
+            board.push_san(token)
+        except ValueError: #invalid move
+            break
+        keys.append(chess.polyglot.zobrist_hash(board))
+    return np.array(keys, dtype = np.uint64)
+
+def postings_for_batch(batch, max_plies):
+    """Returns the postings of a (first row, move strings) batch, the first occurrence of a position in each game."""
+    first_row, moves_list = batch
+    parts = []
+    for i, moves_str in enumerate(moves_list):
+        keys = game_keys(str(moves_str), max_plies)
+        keys, first = np.unique(keys, return_index = True) #repeated positions are posted once
+        part = np.empty(len(keys), dtype = POSTING)
+        part["key"], part["row"], part["ply"] = keys, first_row + i, first + 1
+        parts.append(part)
+    return np.concatenate(parts) if parts else np.empty(0, dtype = POSTING)
+
+# -----------------------------------------------------------------------------
+# 2. BUILDING THE INDEX
+# -----------------------------------------------------------------------------
+def sort_bucket(postings):
+    """Sorts the postings of a bucket by key, then by game row (the order of the batches is kept)."""
+    return postings[np.argsort(postings["key"], kind = "stable")]
+
+def build_position_index(data_dir, max_plies = None, workers = None, batch_size = 10000, bucket_bits = 6):
+    """
+    Writes position_index_{keys,offsets,rows,plies}.npy and position_index.json (number of games and depth) for the games in data_dir.
+    """
+    start = time.time()
+    data_dir = Path(data_dir)
+    workers = workers or os.cpu_count()
+    n_buckets = 1 << bucket_bits
+    tmp_dir = data_dir / "position_index.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    tmp_dir.mkdir()
+
+    #streaming pass: replay the games and append their postings to the bucket files
+    table = open_games(data_dir)
+    batches = ((first, batch["Moves"]) for first, batch in iter_game_batches(table, ["Moves"], batch_size))
+    bucket_files = [open(tmp_dir / f"bucket_{b}.bin", "wb") for b in range(n_buckets)]
+    bucket_sizes = np.zeros(n_buckets, dtype = np.int64)
+    done = 0
+    try:
+        for postings in ordered_map(postings_for_batch, batches, workers, max_plies):
+            buckets = (postings["key"] >> np.uint64(64 - bucket_bits)).astype(np.int64)
+            order = np.argsort(buckets, kind = "stable")
+            bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1))
+            for b in np.flatnonzero(np.diff(bounds)):
+                postings[order[bounds[b]:bounds[b + 1]]].tofile(bucket_files[b])
+            bucket_sizes += np.diff(bounds)
+            done = min(done + batch_size, table.num_rows)
+            elapsed = time.time() - start
+            print(f"Replayed games: {done}/{table.num_rows}, {done / elapsed:,.0f} games/sec, time {elapsed:.2f} seconds")
+    finally:
+        for bucket_file in bucket_files:
+            bucket_file.close()
+
+    #sort every bucket and write it after the previous ones, the buckets are in key order
+    n_postings = int(bucket_sizes.sum())
+    rows = np.lib.format.open_memmap(tmp_dir / "rows.npy", mode = "w+", dtype = np.int32, shape = (n_postings,))
+    plies = np.lib.format.open_memmap(tmp_dir / "plies.npy", mode = "w+", dtype = np.int16, shape = (n_postings,))
+    keys, counts = [], []
+    position = 0
+    for b in range(n_buckets):
+        postings = sort_bucket(np.fromfile(tmp_dir / f"bucket_{b}.bin", dtype = POSTING))
+        (tmp_dir / f"bucket_{b}.bin").unlink()
+        rows[position:position + len(postings)] = postings["row"]
+        plies[position:position + len(postings)] = postings["ply"]
+        position += len(postings)
+        bucket_keys, bucket_counts = np.unique(postings["key"], return_counts = True)
+        keys.append(bucket_keys)
+        counts.append(bucket_counts)
+    rows.flush()
+    plies.flush()
+    del rows, plies
+
+    keys, counts = np.concatenate(keys), np.concatenate(counts)
+    offsets = np.zeros(len(keys) + 1, dtype = np.int64)
+    np.cumsum(counts, out = offsets[1:])
+    np.save(tmp_dir / "keys.npy", keys)
+    np.save(tmp_dir / "offsets.npy", offsets)
+    for name in FILES:
+        os.replace(tmp_dir / f"{name}.npy", data_dir / f"position_index_{name}.npy")
+    with open(data_dir / "position_index.json", "w", encoding = "utf-8") as out_f:
+        json.dump({"games": table.num_rows, "max_plies": max_plies, "positions": len(keys), "postings": n_postings}, out_f)
+    shutil.rmtree(tmp_dir)
+    print(f"Finished. Total games: {table.num_rows}, positions: {len(keys)}, postings: {n_postings}, time: {(time.time() - start):.2f} seconds")
+
+# -----------------------------------------------------------------------------
+# 3. LOADING
+# -----------------------------------------------------------------------------
+def load_position_index(data_dir):
+    """
+    Memory-maps the index of data_dir as a dict of arrays plus its metadata (None if it was not built).
+    """
+    data_dir = Path(data_dir)
+    if not (data_dir / "position_index.json").exists():
+        return None
+    with open(data_dir / "position_index.json", encoding = "utf-8") as in_f:
+        index = json.load(in_f)
+    for name in FILES:
+        index[name] = np.load(data_dir / f"position_index_{name}.npy", mmap_mode = "r")
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description = "Build the variable-depth position index of the cleaned games.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with games_clean.arrow (or .csv)")
+    parser.add_argument("--max-plies", type = int, default = None, help = "number of half-moves to index (default: the full game)")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type = int, default = 10000, help = "games per batch sent to a worker")
+    parser.add_argument("--bucket-bits", type = int, default = 6, help = "the postings are sorted in 2**bits buckets")
+    args = parser.parse_args()
+    build_position_index(args.data_dir, args.max_plies, args.workers, args.batch_size, args.bucket_bits)
+
+if __name__ == "__main__":
+    main()
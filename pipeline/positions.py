@@ -0,0 +1,122 @@
+"""
+Generates the 64-bit position keys (position_keys.npy) used by the Advanced Trainer.
+
+Row i of position_keys.npy holds the polyglot Zobrist keys of game i of games_clean, column j is the position
+after j + 1 half-moves and 0 marks a missing position (shorter games). The game IDs of the rows are stored
+in position_key_ids.npy, so re-running the stage after adding new games only replays the new games.
+The games are replayed in a process pool and the results are written in chunks into a memory-mapped file.
+
+Usage:
+    python -m pipeline.positions --data-dir pages/data
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+import pandas as pd
+
+from pipeline.games import iter_game_batches, open_games
+from pipeline.parallel import ordered_map
+
+
+def moves_to_keys(moves_str, max_moves = 20):
+    """
+    Given a move string, returns the Zobrist key of each position that occured in the first "max_moves" moves.
+    """
+    board = chess.Board()
+    keys = np.zeros(2 * max_moves, dtype = np.uint64)
+    tokens = moves_str.split()
+
+    move_count = 0
+    for token in tokens:
+        if token.endswith('.'):
+            continue  # skip move numbers ("1.", "2.")
+        try:
+            board.push_san(token)
+            keys[move_count] = chess.polyglot.zobrist_hash(board)
+            move_count += 1
+            if move_count >= max_moves * 2: #black and white move
+                break
+        except ValueError: #invalid move
+            break
+    return keys
+
+def keys_for_batch(moves_list, max_moves):
+    """Returns the position keys of a batch of games as one (games x 2*max_moves) array."""
+    keys = np.zeros((len(moves_list), 2 * max_moves), dtype = np.uint64)
+    for i, moves_str in enumerate(moves_list):
+        keys[i] = moves_to_keys(moves_str, max_moves)
+    return keys
+
+def load_existing(data_dir, max_moves):
+    """
+    Returns the existing (keys, ids) of a previous run, or (None, None) if there is nothing to reuse.
+    """
+    keys_path, ids_path = data_dir / "position_keys.npy", data_dir / "position_key_ids.npy"
+    if not keys_path.exists() or not ids_path.exists():
+        return None, None
+    keys = np.load(keys_path, mmap_mode = "r")
+    ids = np.load(ids_path)
+    if keys.shape != (len(ids), 2 * max_moves): #different depth, everything is recomputed
+        return None, None
+    return keys, ids
+
+def generate_position_keys(data_dir, max_moves = 20, workers = None, batch_size = 10000):
+    """
+    Writes position_keys.npy and position_key_ids.npy for the games in data_dir.
+    Games whose ID is already in the previous position files are copied, only the new games are replayed.
+    """
+    start = time.time()
+    data_dir = Path(data_dir)
+    workers = workers or os.cpu_count()
+
+    table = open_games(data_dir)
+    ids = np.asarray(table.column("ID").to_pylist(), dtype = str)
+    old_keys, old_ids = load_existing(data_dir, max_moves)
+    if old_keys is not None:
+        old_rows = pd.Index(old_ids).get_indexer(ids) #-1 for the games we have not seen yet
+    else:
+        old_rows = np.full(len(ids), -1)
+    new_rows = np.flatnonzero(old_rows == -1)
+    print(f"Games: {len(ids)}, already done: {len(ids) - len(new_rows)}, to replay: {len(new_rows)}")
+
+    #the output is written into a memory-mapped file, so the whole table never has to fit in memory
+    tmp_path = data_dir / "position_keys.tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode = "w+", dtype = np.uint64, shape = (len(ids), 2 * max_moves))
+    for first in range(0, len(ids), batch_size):
+        rows = old_rows[first:first + batch_size]
+        done = rows != -1
+        if done.any():
+            out[first:first + batch_size][done] = old_keys[rows[done]]
+
+    #replay only the new games, the batches come back in order
+    new_table = table.take(new_rows)
+    batches = (batch["Moves"] for _, batch in iter_game_batches(new_table, ["Moves"], batch_size))
+    done_count = 0
+    for batch_keys in ordered_map(keys_for_batch, batches, workers, max_moves):
+        out[new_rows[done_count:done_count + len(batch_keys)]] = batch_keys
+        done_count += len(batch_keys)
+        elapsed = time.time() - start
+        print(f"Replayed games: {done_count}/{len(new_rows)}, {done_count / elapsed:,.0f} games/sec, time {elapsed:.2f} seconds")
+
+    out.flush()
+    del out
+    os.replace(tmp_path, data_dir / "position_keys.npy")
+    np.save(data_dir / "position_key_ids.npy", ids)
+    print(f"Finished. Total games: {len(ids)}, replayed: {len(new_rows)}, time: {(time.time() - start):.2f} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate the 64-bit position keys of the cleaned games.")
+    parser.add_argument("--data-dir", default = "pages/data", help = "folder with games_clean.arrow (or .csv)")
+    parser.add_argument("--max-moves", type = int, default = 20, help = "number of moves (of both sides) to store")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type = int, default = 10000, help = "games per batch sent to a worker")
+    args = parser.parse_args()
+    generate_position_keys(args.data_dir, args.max_moves, args.workers, args.batch_size)
+
+if __name__ == "__main__":
+    main()
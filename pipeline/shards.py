@@ -0,0 +1,117 @@
+"""
+Monthly shards of the data set: every month of lichess games is one immutable folder shards/YYYY-MM/ with
+its own cleaned games, move codes, position index and statistics, so a new month is added without
+reprocessing the old ones. The app queries all shards (or a range of months) and merges the counts.
+
+A shard is built in a temporary folder and renamed into place when all its files are written, its
+shard.json is the last file written, so half-built shards are never used.
+
+Usage:
+    python -m pipeline.shards add lichess_db_standard_rated_2025-04.pgn.zst --data-root pages/data
+    python -m pipeline.shards add games.pgn.zst --month 2025-05 --keep-months 12
+    python -m pipeline.shards list --data-root pages/data
+"""
+import argparse
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+
+from pipeline.aggregates import build_statistics
+from pipeline.ingest import extract_games
+from pipeline.moves import generate_move_codes
+from pipeline.position_index import build_position_index
+
+MONTH = re.compile(r"(\d{4})-(\d{2})")
+
+# -----------------------------------------------------------------------------
+# 1. LAYOUT
+# -----------------------------------------------------------------------------
+def shards_dir(data_root):
+    """Returns the folder of the shards of a data root."""
+    return Path(data_root) / "shards"
+
+def month_of(file_name):
+    """Returns the YYYY-MM month in a dump name (e.g. lichess_db_standard_rated_2025-03.pgn.zst), None if there is none."""
+    match = MONTH.search(Path(file_name).name)
+    if match is None or not 1 <= int(match.group(2)) <= 12:
+        return None
+    return match.group(0)
+
+def list_shards(data_root):
+    """Returns {month: folder} of the complete shards of a data root, the oldest month first."""
+    root = shards_dir(data_root)
+    if not root.is_dir():
+        return {}
+    return {folder.name: folder for folder in sorted(root.iterdir())
+            if MONTH.fullmatch(folder.name) and (folder / "shard.json").exists()}
+
+def load_shard_info(shard_dir):
+    """Reads the shard.json of a shard (month, games, checked games, creation time)."""
+    with open(Path(shard_dir) / "shard.json", encoding = "utf-8") as in_f:
+        return json.load(in_f)
+
+# -----------------------------------------------------------------------------
+# 2. ADDING A MONTH
+# -----------------------------------------------------------------------------
+def add_shard(input_path, data_root = "pages/data", month = None, min_elo = 2600, max_plies = None, workers = None,
+              replace = False, keep_months = None):
+    """
+    Cleans the dump of one month into a new shard and builds its move codes, position index and statistics.
+    The other shards are not touched, except the oldest ones beyond keep_months, which are deleted.
+    """
+    start = time.time()
+    month = month or month_of(input_path)
+    if month is None or not MONTH.fullmatch(month):
+        raise ValueError(f"Cannot tell the month of {input_path}, pass it as YYYY-MM")
+    final_dir = shards_dir(data_root) / month
+    if final_dir.exists() and not replace:
+        raise FileExistsError(f"The shard {month} already exists, shards are immutable (use --replace to rebuild it)")
+
+    tmp_dir = shards_dir(data_root) / f".{month}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    tmp_dir.mkdir(parents = True)
+    checked, loaded = extract_games(input_path, tmp_dir, min_elo, workers)
+    generate_move_codes(tmp_dir, workers)
+    build_position_index(tmp_dir, max_plies, workers)
+    build_statistics(tmp_dir)
+    with open(tmp_dir / "shard.json", "w", encoding = "utf-8") as out_f:
+        json.dump({"month": month, "games": loaded, "checked": checked, "source": Path(input_path).name,
+                   "created": time.strftime("%Y-%m-%dT%H:%M:%S")}, out_f)
+
+    if final_dir.exists(): #--replace
+        shutil.rmtree(final_dir)
+    tmp_dir.rename(final_dir)
+    print(f"Added the shard {month} with {loaded} games in {time.time() - start:.2f} seconds")
+
+    if keep_months:
+        for old_month, old_dir in list(list_shards(data_root).items())[:-keep_months]:
+            shutil.rmtree(old_dir)
+            print(f"Removed the shard {old_month} (only the last {keep_months} months are kept)")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Manage the monthly shards of the data set.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    add = commands.add_parser("add", help = "clean the dump of one month into a new shard")
+    add.add_argument("input", help = "path to the .pgn or .pgn.zst dump of the month")
+    add.add_argument("--data-root", default = "pages/data", help = "the shards are written to DATA_ROOT/shards/YYYY-MM")
+    add.add_argument("--month", default = None, help = "YYYY-MM month of the games (default: taken from the file name)")
+    add.add_argument("--min-elo", type = int, default = 2600, help = "minimal rating of both players")
+    add.add_argument("--max-plies", type = int, default = None, help = "depth of the position index (default: the full game)")
+    add.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    add.add_argument("--replace", action = "store_true", help = "rebuild the shard if the month already exists")
+    add.add_argument("--keep-months", type = int, default = None, help = "delete the oldest shards beyond this number of months")
+    show = commands.add_parser("list", help = "list the shards")
+    show.add_argument("--data-root", default = "pages/data")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        add_shard(args.input, args.data_root, args.month, args.min_elo, args.max_plies, args.workers, args.replace, args.keep_months)
+    else:
+        for month, folder in list_shards(args.data_root).items():
+            info = load_shard_info(folder)
+            print(f"{month}: {info['games']:>10,} games (from {info['source']}, added {info['created']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Fixtures of the tests: small data sets built with the real pipeline (synthetic dump -> ingest -> move codes ->
+position index / keys -> opening tree) and the brute-force replay of their games with python-chess.
+"""
+import sys
+from pathlib import Path
+
+import chess
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1])) #the engine and pipeline packages of the repository
+
+from benchmarks.generate import generate_dump
+from engine.query import load_engine
+from pipeline.ingest import extract_games
+from pipeline.moves import generate_move_codes
+from pipeline.opening_tree import build_opening_tree
+from pipeline.position_index import build_position_index
+from pipeline.positions import generate_position_keys
+
+N_GAMES = 400 #games of a dump before the cleaning rules (about 90% are kept)
+#hand-written games: repeated positions, transpositions and header values that need quoting
+HANDMADE_GAMES = [
+    ({"White": "alice", "Black": "bob", "Result": "1/2-1/2"}, "1. Nf3 Nf6 2. Ng1 Ng8 3. Nf3 Nf6 4. Ng1 Ng8 5. e4 e5"),
+    ({"White": "bob", "Black": "alice", "Result": "1-0"}, "1. d4 Nf6 2. c4 e6 3. Nc3 Bb4"),
+    ({"White": "carol", "Black": "alice", "Result": "0-1"}, "1. c4 e6 2. d4 Nf6 3. Nf3 d5"),
+    ({"Black": "NA", "Result": "1-0", "Opening": 'King\'s Pawn; "odd" name'}, "1. e4 e5 2. Nf3 Nc6"),
+    ({"White": "Doe, John; Jr", "Black": "bob", "Result": "0-1", "Opening": ""}, "1. e4 c5 2. Nf3 d6"),
+    ({"White": "alice", "Black": "carol", "Result": "1-0", "WhiteElo": "2599"}, "1. e4 e5"), #rating too low
+]
+
+
+def build_data_dir(data_dir, dump_path, min_games = 3):
+    """Runs the pipeline of the app on a dump: the cleaned games, move codes, both position indexes and the opening tree."""
+    extract_games(dump_path, data_dir, min_elo = 2600, workers = 1)
+    generate_move_codes(data_dir, workers = 1)
+    build_position_index(data_dir, workers = 1)
+    generate_position_keys(data_dir, workers = 1)
+    build_opening_tree(data_dir, min_games = min_games, workers = 1)
+    return data_dir
+
+def write_pgn(file_path, games):
+    """
+    Writes (headers, moves) games as a plain PGN file, with lichess-style defaults for the missing headers
+    (the header values are escaped as in PGN).
+    """
+    with open(file_path, "w", encoding = "utf-8") as out_f:
+        for number, (headers, moves) in enumerate(games):
+            headers = {"Event": "Rated Blitz game", "Site": f"https://lichess.org/game{number:04d}", "WhiteElo": "2700",
+                       "BlackElo": "2650", "ECO": "A00", "Opening": "Test Opening", "TimeControl": "180+0",
+                       "Termination": "Normal", **headers}
+            for name, value in headers.items():
+                value = value.replace("\\", "\\\\").replace('"', '\\"')
+                out_f.write(f'[{name} "{value}"]\n')
+            out_f.write(f"\n{moves} {headers['Result']}\n\n")
+    return file_path
+
+def replay_games(df):
+    """
+    Replays every game of df with python-chess: returns per game the list of SAN moves and the EPD after every ply
+    (epds[i][0] is the start position).
+    """
+    sans, epds = [], []
+    for moves_str in df["Moves"]:
+        board = chess.Board()
+        game_sans = [token for token in str(moves_str).split() if not token.endswith(".")]
+        game_epds = [board.epd()]
+        for san in game_sans:
+            board.push_san(san)
+            game_epds.append(board.epd())
+        sans.append(game_sans)
+        epds.append(game_epds)
+    return sans, epds
+
+@pytest.fixture(scope = "session")
+def dumps(tmp_path_factory):
+    """Two synthetic dumps of different seeds (two months)."""
+    folder = tmp_path_factory.mktemp("dumps")
+    paths = []
+    for seed in (1, 2):
+        paths.append(folder / f"games_2025-0{seed}.pgn.zst")
+        generate_dump(N_GAMES, paths[-1], seed = seed, workers = 1)
+    return paths
+
+@pytest.fixture(scope = "session")
+def data_dir(tmp_path_factory, dumps):
+    return build_data_dir(tmp_path_factory.mktemp("data"), dumps[0])
+
+@pytest.fixture(scope = "session")
+def handmade_dir(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("handmade")
+    return build_data_dir(folder / "data", write_pgn(folder / "games.pgn", HANDMADE_GAMES), min_games = 1)
+
+@pytest.fixture(scope = "session")
+def engine(data_dir):
+    return load_engine(str(data_dir))
+
+@pytest.fixture(scope = "session")
+def replay(engine):
+    return replay_games(engine.df)
+
+@pytest.fixture(scope = "session")
+def handmade_engine(handmade_dir):
+    return load_engine(str(handmade_dir))
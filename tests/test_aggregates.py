@@ -0,0 +1,31 @@
+"""
+The tables of the Statistics page against counts over the games.
+"""
+import numpy as np
+import pandas as pd
+
+from pipeline.aggregates import compute_statistics, compute_summary
+
+
+def test_opening_totals_count_games_without_a_result():
+    df = pd.DataFrame({
+        "WhiteElo": np.array([2700, 2650, 2800, 2900], dtype = np.int16),
+        "BlackElo": np.array([2600, 2750, 2700, 2650], dtype = np.int16),
+        "Opening": pd.Categorical(["Sicilian", "Sicilian", "French", "French"], categories = ["French", "Sicilian", "Unplayed"]),
+        "Result": pd.Categorical(["1-0", None, "0-1", "1/2-1/2"]),
+        "Termination": pd.Categorical(["Normal"] * 4),
+        "TimeControl": pd.Categorical(["Blitz"] * 4),
+    })
+    statistics = compute_statistics(df, [10, 20, 30, 40])
+    openings = statistics["openings"].set_index("Opening")
+    assert openings["TotalGames"].to_dict() == {"Sicilian": 2, "French": 2}
+    assert openings.loc["Sicilian", ["WhiteWins", "BlackWins", "Draws"]].tolist() == [1, 0, 0]
+    assert openings.loc["French", ["WhiteWins", "BlackWins", "Draws"]].tolist() == [0, 1, 1]
+    assert openings["TotalGames"].sum() == statistics["n_games"] == compute_summary(statistics)["n_games"]
+    assert compute_summary(statistics)["n_openings"] == 2
+
+def test_statistics_of_the_data_set(engine):
+    statistics = compute_statistics(engine.df, np.diff(engine.move_offsets))
+    openings = statistics["openings"].set_index("Opening")
+    assert openings["TotalGames"].to_dict() == engine.df["Opening"].value_counts().loc[lambda counts: counts > 0].to_dict()
+    assert statistics["results"].set_index("Result")["Count"].sum() == engine.n_games
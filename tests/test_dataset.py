@@ -0,0 +1,61 @@
+"""
+The files derived from the games (move codes, position keys, position index, statistics) are checked against the games file,
+so the files of another data set dropped next to it are ignored or built again.
+"""
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import replay_games
+from engine.dataset import count_games, load_flat_position_index, load_position_keys, load_stored_move_codes
+from engine.query import load_engine
+from pipeline.aggregates import build_statistics
+from pipeline.moves import encode_games, to_offsets
+
+
+@pytest.fixture
+def data_copy(tmp_path, handmade_dir):
+    return shutil.copytree(handmade_dir, tmp_path / "data", ignore = shutil.ignore_patterns(".cache"))
+
+def copy_files(source_dir, target_dir, names):
+    for name in names:
+        shutil.copy(source_dir / name, target_dir / name)
+
+def test_count_games_of_both_games_files(data_copy, handmade_engine):
+    assert count_games(data_copy) == handmade_engine.n_games == 5
+    (data_copy / "games_clean.arrow").unlink() #the quoted values with ";" and '"' are one row each
+    assert count_games(data_copy) == 5
+    (data_copy / "games_clean.csv").unlink()
+    assert count_games(data_copy) is None
+
+def test_stale_move_codes_are_encoded_again(data_copy, data_dir, handmade_engine):
+    copy_files(data_dir, data_copy, ["move_codes.npy", "move_offsets.npy"])
+    assert load_stored_move_codes(data_copy) is None
+    engine = load_engine(str(data_copy))
+    codes, lengths = encode_games(handmade_engine.df["Moves"])
+    assert np.array_equal(engine.move_codes, codes)
+    assert np.array_equal(engine.move_offsets, to_offsets(lengths))
+    sans = replay_games(engine.df)[0]
+    assert sorted(engine.find_line("e4 e5").rows.tolist()) == [row for row, game in enumerate(sans) if game[:2] == ["e4", "e5"]]
+
+def test_move_offsets_of_other_codes_are_stale(data_copy, data_dir):
+    offsets = np.load(data_dir / "move_offsets.npy")
+    np.save(data_copy / "move_offsets.npy", offsets[:6]) #5 games, but not the codes of move_codes.npy
+    copy_files(data_dir, data_copy, ["move_codes.npy"])
+    assert load_stored_move_codes(data_copy) is None
+    assert load_stored_move_codes(data_dir) is not None
+
+def test_stale_position_files_are_ignored(data_copy, data_dir):
+    assert load_position_keys(data_copy) is not None and load_flat_position_index(data_copy) is not None
+    copy_files(data_dir, data_copy, ["position_keys.npy", "position_index.json"] +
+               [f"position_index_{name}.npy" for name in ("keys", "offsets", "rows", "plies")])
+    assert load_position_keys(data_copy) is None
+    assert load_flat_position_index(data_copy) is None
+
+def test_statistics_ignore_stale_move_offsets(data_copy, data_dir):
+    build_statistics(data_copy)
+    fresh = (data_copy / "statistics.json").read_bytes()
+    copy_files(data_dir, data_copy, ["move_offsets.npy"])
+    build_statistics(data_copy)
+    assert (data_copy / "statistics.json").read_bytes() == fresh
@@ -0,0 +1,106 @@
+"""
+The disk cache is reused while the data files and the code are unchanged, and started again when one of them changes.
+"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from engine import disk_cache
+from engine.disk_cache import DiskCache
+from engine.query import load_engine
+
+
+@pytest.fixture
+def data_copy(tmp_path, handmade_dir):
+    return shutil.copytree(handmade_dir, tmp_path / "data", ignore = shutil.ignore_patterns(".cache"))
+
+def cached(store, name, value):
+    """Returns the cached value of name and whether it was built."""
+    built = []
+    def build():
+        built.append(name)
+        return value
+    return store.get_or_build(name, build), bool(built)
+
+def test_values_are_built_once(data_copy):
+    array = np.arange(1 << 18, dtype = np.int64) #large enough to be memory-mapped
+    value = {"array": array, "small": np.arange(5), "rest": ("a", 1)}
+    loaded, built = cached(DiskCache(data_copy), "value", value)
+    assert built
+    loaded, built = cached(DiskCache(data_copy), "value", None)
+    assert not built
+    assert isinstance(loaded["array"], np.memmap) and np.array_equal(loaded["array"], array)
+    assert np.array_equal(loaded["small"], value["small"]) and loaded["rest"] == ("a", 1)
+
+def test_same_content_keeps_the_cache(data_copy):
+    store = DiskCache(data_copy)
+    cached(store, "value", 1)
+    folder = store.folder()
+    path = data_copy / "position_index.json"
+    content = path.read_bytes()
+    path.write_bytes(content) #new modification time, same content
+    os.utime(path, ns = (path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+    store = DiskCache(data_copy)
+    assert store.folder() == folder
+    assert cached(store, "value", 2) == (1, False)
+
+@pytest.mark.parametrize("change", ["edit", "add", "delete"])
+def test_changed_data_files_start_a_new_cache(data_copy, change):
+    store = DiskCache(data_copy)
+    cached(store, "value", 1)
+    old_folder = store.folder()
+    if change == "edit":
+        with open(data_copy / "games_clean.csv", "a", encoding = "utf-8") as out_f:
+            out_f.write("\n")
+    elif change == "add":
+        (data_copy / "extra.json").write_text("{}", encoding = "utf-8")
+    else:
+        (data_copy / "opening_tree.npz").unlink()
+    store = DiskCache(data_copy)
+    assert store.folder() != old_folder
+    assert not old_folder.exists() #the cache of the old version is deleted
+    assert cached(store, "value", 2) == (2, True)
+
+def test_changed_code_starts_a_new_cache(data_copy, monkeypatch):
+    store = DiskCache(data_copy)
+    cached(store, "value", 1)
+    monkeypatch.setattr(disk_cache, "code_fingerprint", lambda: "other code")
+    assert cached(DiskCache(data_copy), "value", 2) == (2, True)
+
+def test_untrusted_root_is_not_used(data_copy, tmp_path):
+    if not hasattr(os, "getuid"):
+        pytest.skip("no file owners")
+    root = tmp_path / "shared"
+    root.mkdir()
+    root.chmod(0o777)
+    store = DiskCache(data_copy, root)
+    assert store.folder() is None
+    assert cached(store, "value", 1) == (1, True)
+    assert cached(store, "value", 2) == (2, True)
+    assert list(root.iterdir()) == []
+
+def test_engine_reuses_indexes_and_results(data_copy):
+    engine = load_engine(str(data_copy))
+    answer = engine.query_line("e4", {"MinElo": 2600})
+    engine.prefix_index, engine.filter_bitmaps #built and cached on first use
+    engine.save_results()
+    folder = engine.store.folder()
+    assert {"prefix_index", "filter_bitmaps", "results.pkl"} <= {path.name for path in folder.iterdir()}
+
+    restarted = load_engine(str(data_copy))
+    restarted.load_results()
+    assert restarted.store.folder() == folder
+    assert np.array_equal(restarted.prefix_index["rows"], engine.prefix_index["rows"])
+    assert len(restarted.cache.items()) == len(engine.cache.items())
+    assert restarted.query_line("e4", {"MinElo": 2600}).results == answer.results
+
+def test_games_parsed_from_csv_are_cached(data_copy):
+    expected = load_engine(str(data_copy)).df
+    (data_copy / "games_clean.arrow").unlink()
+    engine = load_engine(str(data_copy))
+    assert (engine.store.folder() / "games_clean.arrow").exists()
+    restarted = load_engine(str(data_copy))
+    for df in (engine.df, restarted.df):
+        assert df.equals(expected)
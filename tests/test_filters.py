@@ -0,0 +1,92 @@
+"""
+Filter bitmaps and game_filter against boolean masks computed with pandas, at the edges of the Elo bands.
+"""
+import chess
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.indexes import ELO_STEP, build_filter_bitmaps, in_bitmap, normalize_filters
+from engine.query import QueryEngine
+
+
+def frame(white_elo, black_elo):
+    """A data set of the compact schema with only the columns used by the filters."""
+    n = len(white_elo)
+    return pd.DataFrame({
+        "WhiteElo": np.array(white_elo, dtype = np.int16),
+        "BlackElo": np.array(black_elo, dtype = np.int16),
+        "TimeControl": pd.Categorical((["Blitz", "Rapid", "Bullet"] * n)[:n], categories = ["Blitz", "Bullet", "Classical", "Rapid"]),
+        "Result": pd.Categorical((["1-0", "0-1", "1/2-1/2", "1-0"] * n)[:n]),
+        "Termination": pd.Categorical((["Normal", "Time forfeit"] * n)[:n]),
+    })
+
+def expected_rows(df, filters):
+    """The rows of the games that pass the filters, from the columns of df."""
+    mask = np.ones(len(df), dtype = bool)
+    for column, values in normalize_filters(filters):
+        if column == "MinElo":
+            mask &= np.minimum(df["WhiteElo"], df["BlackElo"]).to_numpy() >= min(int(value) for value in values)
+        else:
+            mask &= df[column].isin(values).to_numpy()
+    return np.flatnonzero(mask).tolist()
+
+def filtered_rows(engine, filters):
+    game_filter = engine.game_filter(filters)
+    rows = np.arange(engine.n_games)
+    return rows.tolist() if game_filter is None else rows[in_bitmap(game_filter, rows)].tolist()
+
+ELO_EDGES = [2599, 2600, 2601, 2650, 2699, 2700, 2701, 2799, 2800, 2801]
+
+@pytest.fixture(scope = "module")
+def edge_engine():
+    white = ELO_EDGES + [3000] * len(ELO_EDGES)
+    black = [3000] * len(ELO_EDGES) + ELO_EDGES[::-1]
+    return QueryEngine(frame(white, black), None, None)
+
+def test_elo_bands_cover_the_whole_range(edge_engine):
+    bands = edge_engine.filter_bitmaps["MinElo"]
+    assert list(bands) == list(range(2600, 2801, ELO_STEP)) #up to the highest min rating (2801)
+    min_elo = np.minimum(edge_engine.df["WhiteElo"], edge_engine.df["BlackElo"]).to_numpy()
+    rows = np.arange(len(min_elo))
+    for elo, bitmap in bands.items():
+        assert in_bitmap(bitmap, rows).tolist() == (min_elo >= elo).tolist()
+        assert len(bitmap) == (len(rows) + 7) // 8
+
+@pytest.mark.parametrize("elo", ELO_EDGES + [2500, 2650, 3001, 3100])
+def test_min_elo_filter_at_band_edges(edge_engine, elo):
+    filters = {"MinElo": elo}
+    assert filtered_rows(edge_engine, filters) == expected_rows(edge_engine.df, filters)
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"TimeControl": ["Blitz"]},
+    {"TimeControl": ["Blitz", "Bullet"]},
+    {"TimeControl": "Classical"}, #a category without games
+    {"TimeControl": ["Correspondence"]}, #not a category
+    {"Result": ["1/2-1/2"], "MinElo": 2700},
+    {"TimeControl": ["Rapid", "Blitz"], "Termination": ["Time forfeit"], "MinElo": 2650},
+])
+def test_combined_filters(edge_engine, filters):
+    assert filtered_rows(edge_engine, filters) == expected_rows(edge_engine.df, filters)
+
+def test_unknown_filter_attribute(edge_engine):
+    with pytest.raises(ValueError):
+        edge_engine.game_filter({"Speed": ["Blitz"]})
+
+def test_bitmaps_only_hold_values_with_games():
+    bitmaps = build_filter_bitmaps(frame([2700, 2800], [2750, 2850]))
+    assert list(bitmaps["TimeControl"]) == ["Blitz", "Rapid"]
+    assert list(bitmaps["MinElo"]) == [2800]
+
+@pytest.mark.parametrize("filters", [{"MinElo": 2900}, {"TimeControl": ["Blitz"], "MinElo": 2750}, {"Result": ["1-0", "0-1"]}])
+def test_filtered_queries_match_brute_force(engine, replay, filters):
+    keep = set(expected_rows(engine.df, filters))
+    assert 0 < len(keep) < engine.n_games
+    sans, epds = replay
+    line = sans[0][:2]
+    matches = engine.find_line(" ".join(line), filters)
+    assert sorted(matches.rows.tolist()) == [row for row, game in enumerate(sans) if game[:2] == line and row in keep]
+    epd = epds[0][3]
+    matches = engine.find_position(chess.Board(epd), filters)
+    assert sorted(matches.rows.tolist()) == [row for row, game_epds in enumerate(epds) if epd in game_epds and row in keep]
@@ -0,0 +1,65 @@
+"""
+The ingest stage writes the same games to games_clean.csv and games_clean.arrow, whatever the header values hold.
+"""
+import csv
+
+import pyarrow as pa
+import pytest
+
+from conftest import HANDMADE_GAMES, write_pgn
+from pipeline.games import COLUMNS, games_frame, open_games, read_games, read_games_csv
+from pipeline.ingest import extract_games, time_control
+
+
+def both_files(data_dir):
+    """The games of games_clean.arrow and of games_clean.csv as data frames."""
+    arrow_df = games_frame(read_games(data_dir / "games_clean.arrow"))
+    csv_df = games_frame(pa.Table.from_pandas(read_games_csv(data_dir / "games_clean.csv"), preserve_index = False))
+    return arrow_df, csv_df
+
+def test_handmade_games(handmade_dir):
+    arrow_df, csv_df = both_files(handmade_dir)
+    assert arrow_df.equals(csv_df)
+    assert [game_id.decode() for game_id in arrow_df.index] == [f"game{number:04d}" for number in range(5)] #the last one is rated too low
+    assert arrow_df["White"].isna().tolist() == [False, False, False, True, False] #missing name
+    assert arrow_df["Black"].tolist()[3] == "NA" #a player called NA is not missing
+    assert arrow_df["White"].tolist()[4] == "Doe, John; Jr"
+    assert arrow_df["Opening"].tolist()[3] == 'King\'s Pawn; "odd" name'
+    assert arrow_df["Opening"].isna().tolist()[4] #empty header
+    assert arrow_df["Moves"].tolist()[1] == "1. d4 Nf6 2. c4 e6 3. Nc3 Bb4"
+
+def test_csv_rows_are_quoted(handmade_dir):
+    with open(handmade_dir / "games_clean.csv", encoding = "utf-8", newline = "") as in_f:
+        rows = list(csv.reader(in_f, delimiter = ";"))
+    assert rows[0] == COLUMNS
+    assert all(len(row) == len(COLUMNS) for row in rows)
+    assert rows[4][COLUMNS.index("White")] == "" and rows[4][COLUMNS.index("Black")] == "NA"
+    assert rows[5][COLUMNS.index("White")] == "Doe, John; Jr"
+
+def test_games_without_names_first(tmp_path):
+    """The first chunks have no player names at all (empty dictionaries), the names start later."""
+    games = [({"Result": "1-0"}, "1. e4 e5")] * 3 + [({"White": "alice", "Black": "bob", "Result": "0-1"}, "1. d4 d5")] * 3
+    pgn_path = write_pgn(tmp_path / "games.pgn", games)
+    checked, loaded = extract_games(pgn_path, tmp_path / "data", workers = 1, chunk_size = 256)
+    assert (checked, loaded) == (6, 6)
+    arrow_df, csv_df = both_files(tmp_path / "data")
+    assert arrow_df.equals(csv_df)
+    assert arrow_df["White"].isna().tolist() == [True] * 3 + [False] * 3
+    assert open_games(tmp_path / "data").num_rows == 6
+
+def test_games_without_any_name(tmp_path):
+    pgn_path = write_pgn(tmp_path / "games.pgn", [({"Result": "1-0"}, "1. e4 e5")] * 2)
+    extract_games(pgn_path, tmp_path / "data", workers = 1, chunk_size = 256)
+    arrow_df, csv_df = both_files(tmp_path / "data")
+    assert arrow_df.equals(csv_df)
+    assert arrow_df["White"].isna().all() and len(arrow_df) == 2
+
+@pytest.mark.parametrize("value, category", [("15+0", "UltraBullet"), ("60+0", "Bullet"), ("120+1", "Bullet"), ("180+0", "Blitz"),
+                                             ("600+0", "Rapid"), ("900+10", "Rapid"), ("1800+0", "Classical"), ("-", "NoTime")])
+def test_time_control(value, category):
+    assert time_control(value) == category
+
+def test_rating_limit(tmp_path):
+    pgn_path = write_pgn(tmp_path / "games.pgn", HANDMADE_GAMES)
+    checked, loaded = extract_games(pgn_path, tmp_path / "data", min_elo = 2660, workers = 1)
+    assert (checked, loaded) == (len(HANDMADE_GAMES), 0) #every black player is rated 2650
@@ -0,0 +1,58 @@
+"""
+find_line (prefix index, then the rows of the games deeper than the index) against a brute-force prefix match of the SAN moves.
+"""
+import numpy as np
+import pytest
+
+from pipeline.moves import decode_move
+from engine.indexes import build_prefix_index
+from engine.query import QueryEngine, replay_move_str
+
+
+@pytest.fixture(scope = "module")
+def shallow_engine(engine):
+    """An engine over the same games whose prefix index ends after 3 plies, the synthetic games share their first moves only."""
+    shallow = QueryEngine(engine.df, engine.move_codes, engine.move_offsets)
+    shallow.prefix_index = build_prefix_index(engine.move_codes, engine.move_offsets, depth = 3)
+    return shallow
+
+def move_str(sans):
+    """Writes SAN moves as a move string with move numbers ("1. e4 e5 2. Nf3")."""
+    return " ".join(f"{i // 2 + 1}. {san}" if i % 2 == 0 else san for i, san in enumerate(sans))
+
+def expected_line(sans, line):
+    """Returns the rows of the games that started with the line and the SAN of their next move ("" if the game ended)."""
+    rows = [row for row, game in enumerate(sans) if game[:len(line)] == line]
+    return rows, [sans[row][len(line)] if len(sans[row]) > len(line) else "" for row in rows]
+
+def found_line(engine, line, **kwargs):
+    matches = engine.find_line(move_str(line), **kwargs)
+    order = np.argsort(matches.rows, kind = "stable")
+    return ([int(row) for row in matches.rows[order]],
+            [matches.board.san(decode_move(code)) if code else "" for code in matches.next_codes[order]])
+
+@pytest.mark.parametrize("n_plies", [0, 1, 2, 5, 12, 39, 40, 41, 60])
+def test_find_line_matches_brute_force(engine, shallow_engine, replay, n_plies):
+    sans = replay[0]
+    games = [game for game in sans if len(game) >= n_plies][:25]
+    assert games
+    for game in games:
+        line = game[:n_plies]
+        assert found_line(engine, line) == found_line(shallow_engine, line) == expected_line(sans, line)
+
+def test_find_line_of_an_unplayed_line(engine, replay):
+    line = ["a4", "h5", "Ra3", "Rh6"]
+    assert expected_line(replay[0], line) == ([], [])
+    assert found_line(engine, line) == ([], [])
+
+@pytest.mark.parametrize("engine_name", ["engine", "shallow_engine"])
+def test_line_state_steps_match_the_full_search(request, replay, engine_name):
+    engine = request.getfixturevalue(engine_name)
+    game = max(replay[0], key = len)
+    codes = replay_move_str(move_str(game))[1]
+    state = engine.line_root()
+    for ply in range(1, min(len(game), 50) + 1):
+        state = engine.line_step(state, codes[ply - 1])
+        assert state.ply == ply
+        assert found_line(engine, game[:ply], state = state) == expected_line(replay[0], game[:ply])
+        assert engine.line_state(move_str(game[:ply])).ply == ply
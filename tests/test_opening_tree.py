@@ -0,0 +1,92 @@
+"""
+The nodes of the opening tree against a brute-force count over the replayed games, and the check of the tree against the games.
+"""
+import shutil
+from collections import Counter
+
+import chess
+
+from engine.dataset import load_tree
+from engine.query import load_engine
+from pipeline.opening_tree import line_key, position_key
+
+TREE_PLIES = 40 #the default depth of build_opening_tree (20 moves), plies 0 to 40 are nodes
+RESULTS = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+
+
+def move_str(sans):
+    return " ".join(f"{i // 2 + 1}. {san}" if i % 2 == 0 else san for i, san in enumerate(sans))
+
+def expected_node(engine, reached):
+    """The (white wins, draws, black wins) and the next move counts of the games, {row: ply of the first time at the node}."""
+    sans = [str(moves).split() for moves in engine.df["Moves"]]
+    sans = [[token for token in game if not token.endswith(".")] for game in sans]
+    results = [0, 0, 0]
+    next_moves = Counter()
+    for row, ply in reached.items():
+        results[RESULTS[engine.df["Result"].iloc[row]]] += 1
+        if ply < len(sans[row]):
+            next_moves[sans[row][ply]] += 1
+    return tuple(results), next_moves
+
+def assert_node(engine, kind, key, board, reached):
+    insights = engine.tree_insights(kind, key, board)
+    assert insights is not None
+    results, next_moves = expected_node(engine, reached)
+    assert insights.results == results
+    counts = insights.next_moves["Count"].tolist()
+    assert counts == sorted(next_moves.values(), reverse = True)[:len(counts)]
+    for move, count in zip(insights.next_moves["Move"], counts):
+        assert next_moves[move] == count
+
+def test_position_nodes_match_brute_force(engine, replay):
+    reached = {}
+    for row, game_epds in enumerate(replay[1]):
+        for ply, epd in enumerate(game_epds[:TREE_PLIES + 1]):
+            reached.setdefault(epd, {}).setdefault(row, ply)
+    checked = 0
+    for epd, games in reached.items():
+        board = chess.Board(epd)
+        if len(games) >= 3: #min_games of the fixture
+            assert_node(engine, "position", position_key(board), board, games)
+            checked += 1
+        else:
+            assert engine.tree_insights("position", position_key(board), board) is None
+    assert checked == len(engine.opening_tree["position_keys"])
+
+def test_line_nodes_match_brute_force(engine, replay):
+    reached = {}
+    for row, game in enumerate(replay[0]):
+        for ply in range(min(len(game), TREE_PLIES) + 1):
+            reached.setdefault(tuple(game[:ply]), {})[row] = ply
+    checked = 0
+    for line, games in reached.items():
+        if len(games) >= 3:
+            board = chess.Board()
+            for san in line:
+                board.push_san(san)
+            assert_node(engine, "line", line_key(move_str(line)), board, games)
+            checked += 1
+    assert checked == len(engine.opening_tree["line_keys"])
+
+def test_repeated_positions_are_counted_once(handmade_engine):
+    board = chess.Board()
+    for san in ["Nf3", "Nf6"]: #reached twice by the first game
+        board.push_san(san)
+    insights = handmade_engine.tree_insights("position", position_key(board), board)
+    assert insights.results == (0, 1, 0)
+    assert [type(count) for count in insights.results] == [int] * 3 #as the results computed from the games
+    assert insights.next_moves[["Move", "Count"]].values.tolist() == [["Ng1", 1]]
+    board = chess.Board("rnbqkb1r/pppp1ppp/4pn2/8/2PP4/8/PP2PPPP/RNBQKBNR w KQkq -") #transposed by the next two games
+    insights = handmade_engine.tree_insights("position", position_key(board), board)
+    assert insights.results == (1, 0, 1)
+    assert sorted(insights.next_moves["Move"]) == ["Nc3", "Nf3"]
+
+def test_stale_tree_is_ignored(tmp_path, handmade_dir, data_dir):
+    data_copy = shutil.copytree(handmade_dir, tmp_path / "data", ignore = shutil.ignore_patterns(".cache"))
+    assert load_tree(data_copy) is not None
+    shutil.copy(data_dir / "opening_tree.npz", data_copy / "opening_tree.npz")
+    assert load_tree(data_copy) is None
+    engine = load_engine(str(data_copy))
+    assert engine.opening_tree is None
+    assert engine.query_line("1. e4").results == (1, 0, 1)
@@ -0,0 +1,57 @@
+"""
+The incremental run of pipeline.positions: after new games are added, only they are replayed and the keys
+equal the ones of a run from scratch.
+"""
+import numpy as np
+import zstandard
+
+from pipeline import positions
+from pipeline.games import open_games
+from pipeline.ingest import extract_games
+from pipeline.positions import generate_position_keys
+
+
+def write_plain_pgn(file_path, dump_paths):
+    """Writes the games of the .pgn.zst dumps one after the other into a plain PGN file."""
+    with open(file_path, "wb") as out_f:
+        for dump_path in dump_paths:
+            with open(dump_path, "rb") as in_f:
+                zstandard.ZstdDecompressor().copy_stream(in_f, out_f)
+    return file_path
+
+def test_only_new_games_are_replayed(tmp_path, dumps, monkeypatch):
+    data_dir, scratch_dir = tmp_path / "data", tmp_path / "scratch"
+    extract_games(dumps[0], data_dir, workers = 1)
+    generate_position_keys(data_dir, workers = 1, batch_size = 100)
+    old_count = len(np.load(data_dir / "position_key_ids.npy"))
+
+    #the games of the next month come first, so the old keys are copied to other rows
+    both_path = write_plain_pgn(tmp_path / "both.pgn", [dumps[1], dumps[0]])
+    extract_games(both_path, data_dir, workers = 1)
+    extract_games(both_path, scratch_dir, workers = 1)
+
+    replayed = []
+    keys_for_batch = positions.keys_for_batch
+    def counted_keys_for_batch(moves_list, max_moves):
+        replayed.extend(moves_list)
+        return keys_for_batch(moves_list, max_moves)
+    with monkeypatch.context() as patch:
+        patch.setattr(positions, "keys_for_batch", counted_keys_for_batch)
+        generate_position_keys(data_dir, workers = 1, batch_size = 100)
+    generate_position_keys(scratch_dir, workers = 1, batch_size = 100)
+
+    keys, ids = np.load(data_dir / "position_keys.npy"), np.load(data_dir / "position_key_ids.npy")
+    assert np.array_equal(keys, np.load(scratch_dir / "position_keys.npy"))
+    assert np.array_equal(ids, np.load(scratch_dir / "position_key_ids.npy"))
+    assert len(replayed) == len(ids) - old_count > 0
+    assert not (data_dir / "position_keys.tmp.npy").exists()
+
+def test_other_depth_is_replayed_from_scratch(tmp_path, dumps):
+    data_dir = tmp_path / "data"
+    extract_games(dumps[0], data_dir, workers = 1)
+    generate_position_keys(data_dir, max_moves = 5, workers = 1)
+    generate_position_keys(data_dir, max_moves = 20, workers = 1)
+    keys = np.load(data_dir / "position_keys.npy")
+    assert keys.shape[1] == 40
+    moves = open_games(data_dir).column("Moves").to_pylist()
+    assert np.array_equal(keys, positions.keys_for_batch(moves, 20))
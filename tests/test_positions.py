@@ -0,0 +1,130 @@
+"""
+find_position and query_many (variable-depth position index and the 40-ply position keys) against a brute-force search
+of the EPDs of the replayed games, and verify_hits on true and false postings.
+"""
+import chess
+import numpy as np
+import pytest
+
+from conftest import build_data_dir, replay_games, write_pgn
+from engine.dataset import load_position_keys
+from engine.indexes import verify_hits
+from engine.query import QueryEngine, load_engine
+from pipeline.moves import decode_move
+
+
+@pytest.fixture(scope = "module")
+def key_engine(engine, data_dir):
+    """An engine over the same games that searches the position keys of the first 20 moves."""
+    assert engine.flat_position_index is not None
+    return QueryEngine(engine.df, engine.move_codes, engine.move_offsets, position_keys = load_position_keys(data_dir))
+
+def expected_position(replay, epd, max_plies = None):
+    """
+    Returns the rows of the games that reached the position (within max_plies) and the SAN of the move played
+    after its first occurrence ("" if the game ended there).
+    """
+    sans, epds = replay
+    rows, next_sans = [], []
+    for row, game_epds in enumerate(epds):
+        reached = game_epds[:None if max_plies is None else max_plies + 1]
+        if epd in reached:
+            ply = reached.index(epd)
+            rows.append(row)
+            next_sans.append(sans[row][ply] if ply < len(sans[row]) else "")
+    return rows, next_sans
+
+def found_position(engine, board, **kwargs):
+    matches = engine.find_position(board, **kwargs)
+    order = np.argsort(matches.rows, kind = "stable")
+    return ([int(row) for row in matches.rows[order]],
+            [board.san(decode_move(code)) if code else "" for code in matches.next_codes[order]])
+
+def sample_epds(replay, plies):
+    """The positions after the given plies of the first games long enough, and the positions reached by several games."""
+    epds = replay[1]
+    sample = [game_epds[ply] for ply in plies for game_epds in [game for game in epds if len(game) > ply][:8]]
+    counts = {}
+    for game_epds in epds:
+        for epd in set(game_epds[1:]):
+            counts[epd] = counts.get(epd, 0) + 1
+    shared = sorted((epd for epd, count in counts.items() if count > 1), key = counts.get, reverse = True)
+    return sample + shared[:20] + shared[-20:]
+
+def test_find_position_matches_brute_force(engine, replay):
+    for epd in sample_epds(replay, [1, 2, 7, 20, 39, 40, 41, 70, 120]):
+        board = chess.Board(epd)
+        assert found_position(engine, board) == expected_position(replay, epd)
+
+def test_find_position_with_position_keys_stops_after_40_plies(key_engine, replay):
+    assert key_engine.position_plies == 40
+    for epd in sample_epds(replay, [1, 2, 7, 20, 39, 40, 41, 70]):
+        board = chess.Board(epd)
+        assert found_position(key_engine, board) == expected_position(replay, epd, max_plies = 40)
+
+def test_repeated_positions_and_transpositions(handmade_engine, handmade_dir):
+    replay = replay_games(handmade_engine.df)
+    key_engine = QueryEngine(handmade_engine.df, handmade_engine.move_codes, handmade_engine.move_offsets,
+                             position_keys = load_position_keys(handmade_dir))
+    #the knights go back and forth in the first game, the next two games transpose
+    assert replay[1][0].count(replay[1][0][2]) == 2
+    assert replay[1][1][4] == replay[1][2][4]
+    for epd in {epd for game_epds in replay[1] for epd in game_epds[1:]}:
+        for searched in (handmade_engine, key_engine):
+            assert found_position(searched, chess.Board(epd)) == expected_position(replay, epd)
+
+def test_start_and_unknown_positions(engine, replay):
+    rows, _ = found_position(engine, chess.Board())
+    assert rows == list(range(len(replay[0])))
+    board = chess.Board("8/8/8/4k3/8/8/8/K7 w - - 0 1")
+    assert found_position(engine, board) == ([], [])
+
+def test_query_many_matches_brute_force(engine, key_engine, replay):
+    epds = sample_epds(replay, [0, 1, 5, 30, 60]) + ["8/8/8/4k3/8/8/8/K7 w - -"]
+    for searched, max_plies in ((engine, None), (key_engine, 40)):
+        totals, moves = searched.query_many(epds, n_moves = None)
+        for i, epd in enumerate(epds):
+            rows, next_sans = expected_position(replay, epd, max_plies)
+            assert totals.loc[i, "Games"] == len(rows)
+            played = [san for san in next_sans if san]
+            counts = {san: played.count(san) for san in played}
+            assert dict(zip(moves.loc[moves["Position"] == i, "Move"], moves.loc[moves["Position"] == i, "Count"])) == counts
+
+def test_verify_hits_keeps_true_postings_only(engine, replay):
+    sans, epds = replay
+    games = [row for row, game in enumerate(sans) if len(game) >= 30][:20]
+    targets = [epds[row][ply] for row in games for ply in (1, 10, 30)]
+    queries = np.arange(len(targets))
+    rows = np.repeat(games, 3)
+    plies = np.tile([1, 10, 30], len(games))
+    assert verify_hits(engine.move_codes, engine.move_offsets, targets, queries, rows, plies).all()
+
+    #the same postings pointed at the next game, the next ply or the target of another query
+    for fake_queries, fake_rows, fake_plies in [(queries, np.roll(rows, 3), plies), (queries, rows, plies + 1),
+                                                (np.roll(queries, 1), rows, plies)]:
+        mask = verify_hits(engine.move_codes, engine.move_offsets, targets, fake_queries, fake_rows, fake_plies)
+        expected = [targets[query] == epds[row][ply] for query, row, ply in zip(fake_queries, fake_rows, fake_plies)]
+        assert mask.tolist() == expected
+        assert not all(expected)
+
+def test_transposition_deeper_than_the_tree(tmp_path):
+    shuffle = " ".join(f"{2 * i + 1}. Nf3 Nf6 {2 * i + 2}. Ng1 Ng8" for i in range(10)) #40 plies back to the start position
+    games = [({"Result": "1-0"}, "1. e4 e5 2. Nf3 Nc6 3. Bb5"), ({"Result": "0-1"}, f"{shuffle} 21. e4 e5 22. Nf3 Nc6 23. Bc4")]
+    engine = load_engine(str(build_data_dir(tmp_path / "data", write_pgn(tmp_path / "games.pgn", games), min_games = 1)))
+    assert engine.position_plies is None and int(engine.opening_tree["max_moves"]) == 20
+    board = chess.Board()
+    for san in ["e4", "e5", "Nf3", "Nc6"]:
+        board.push_san(san)
+    for filters in ({}, {"MinElo": 2600}):
+        insights = engine.query_position(board, filters)
+        assert insights.results == (1, 0, 1)
+        assert sorted(insights.next_moves["Move"]) == ["Bb5", "Bc4"]
+
+def test_query_many_counts_a_return_to_the_start_position_once(handmade_engine):
+    #the first game shuffles its knights back to the start position
+    for board in (chess.Board(), chess.Board("rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq -")):
+        rows, next_sans = found_position(handmade_engine, board)
+        totals, moves = handmade_engine.query_many([board], n_moves = None)
+        assert totals.loc[0, "Games"] == len(rows)
+        assert dict(zip(moves["Move"], moves["Count"])) == {san: next_sans.count(san) for san in next_sans if san}
+    assert handmade_engine.query_many([chess.Board()])[0].loc[0, "Games"] == handmade_engine.n_games
@@ -0,0 +1,74 @@
+"""
+The filters and routes of the explorer service: the lichess speed names map on the TimeControl categories of the data set.
+"""
+import json
+
+import chess
+import pytest
+
+from engine.server import SPEEDS, Explorer, parse_filters
+from pipeline.ingest import time_control
+
+
+@pytest.fixture(scope = "module")
+def explorer(engine):
+    return Explorer(engine, workers = 1)
+
+def get(explorer, target):
+    status, body, _ = explorer.route("GET", target, b"")
+    return status, json.loads(body)
+
+def test_speeds_are_time_control_categories():
+    categories = {time_control(value) for value in ["15+0", "60+0", "180+2", "600+5", "1800+20", "-"]}
+    assert set(SPEEDS.values()) == categories
+
+@pytest.mark.parametrize("speeds, categories", [
+    ("ultraBullet", ["UltraBullet"]),
+    ("bullet,blitz", ["Bullet", "Blitz"]),
+    ("rapid,classical,correspondence", ["Rapid", "Classical", "NoTime"]),
+    (["blitz"], ["Blitz"]),
+    (None, []),
+])
+def test_parse_filters_maps_lichess_speeds(speeds, categories):
+    params = {"minElo": "2700", "results": "1-0,0-1"} if speeds is None else {"speeds": speeds}
+    filters = parse_filters(params)
+    assert filters["TimeControl"] == categories
+    if speeds is None:
+        assert filters["MinElo"] == [2700] and filters["Result"] == ["1-0", "0-1"]
+
+@pytest.mark.parametrize("speeds", ["Blitz", "ultrabullet", "blitz,superblitz"])
+def test_parse_filters_rejects_unknown_speeds(speeds):
+    with pytest.raises(ValueError):
+        parse_filters({"speeds": speeds})
+
+def test_explorer_counts_match_brute_force(explorer, engine, replay):
+    epd = chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -").epd()
+    for speed, category in SPEEDS.items():
+        status, answer = get(explorer, f"/explorer?play=e2e4&speeds={speed}")
+        assert status == 200
+        expected = sum(1 for row, game_epds in enumerate(replay[1])
+                       if epd in game_epds and engine.df["TimeControl"].iloc[row] == category)
+        assert answer["white"] + answer["draws"] + answer["black"] == expected
+    assert get(explorer, "/explorer?play=e2e4&speeds=blitz,rapid")[1]["white"] > 0
+
+def test_unknown_speeds_are_bad_requests(explorer):
+    status, answer = get(explorer, "/explorer?play=e2e4&speeds=superblitz")
+    assert status == 400 and "superblitz" in answer["error"]
+    status, body, _ = explorer.route("POST", "/explorer/batch", json.dumps({"fens": [chess.STARTING_FEN], "speeds": "Blitz"}).encode())
+    assert status == 400
+
+def test_batch_and_errors(explorer, engine):
+    status, body, _ = explorer.route("POST", "/explorer/batch", json.dumps({"fens": [chess.STARTING_FEN], "speeds": "blitz"}).encode())
+    assert status == 200
+    answer = json.loads(body)["positions"][0]
+    assert answer["white"] + answer["draws"] + answer["black"] == (engine.df["TimeControl"] == "Blitz").sum()
+    assert get(explorer, "/nowhere")[0] == 404
+    assert explorer.route("POST", "/explorer", b"")[0] == 405
+    assert get(explorer, "/explorer?play=e2e5")[0] == 400
+
+def test_start_position_counts_every_game_once(handmade_engine, engine):
+    for searched in (handmade_engine, engine): #the first hand-written game returns to the start position
+        status, answer = get(Explorer(searched, workers = 1), "/explorer?play=")
+        assert status == 200
+        assert answer["white"] + answer["draws"] + answer["black"] == searched.n_games
+        assert sum(move["white"] + move["draws"] + move["black"] for move in answer["moves"]) <= searched.n_games
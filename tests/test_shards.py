@@ -0,0 +1,83 @@
+"""
+The merged queries of a ShardedEngine over two monthly shards against one QueryEngine over the games of both months.
+"""
+import chess
+import numpy as np
+import pytest
+import zstandard
+
+from conftest import build_data_dir
+from engine.query import load_engine
+from engine.shards import ShardedEngine
+from pipeline.shards import add_shard
+
+MONTHS = ["2025-01", "2025-02"]
+
+
+@pytest.fixture(scope = "module")
+def sharded(tmp_path_factory, dumps):
+    root = tmp_path_factory.mktemp("shards")
+    for month, dump_path in zip(MONTHS, dumps):
+        add_shard(dump_path, root, month, workers = 1)
+    return load_engine(str(root))
+
+@pytest.fixture(scope = "module")
+def single(tmp_path_factory, dumps):
+    """One data set of the games of both months (the dumps written one after the other as a plain PGN file)."""
+    folder = tmp_path_factory.mktemp("single")
+    with open(folder / "games.pgn", "wb") as out_f:
+        for dump_path in dumps:
+            with open(dump_path, "rb") as in_f:
+                zstandard.ZstdDecompressor().copy_stream(in_f, out_f)
+    return load_engine(str(build_data_dir(folder / "data", folder / "games.pgn")))
+
+def assert_same_insights(merged, expected, board):
+    """The merged Insights equal the expected ones, up to the order of ties (counts, top ratings)."""
+    assert merged.results == expected.results
+    assert merged.next_moves["Count"].tolist() == expected.next_moves["Count"].tolist()
+    shown = expected.next_moves.set_index("Move")
+    for move in merged.next_moves.itertuples():
+        if move.Move in shown.index:
+            assert (move.Count, move.WhiteWins, move.Draws, move.BlackWins) == tuple(shown.loc[move.Move, ["Count", "WhiteWins", "Draws", "BlackWins"]])
+            assert move.OpponentElo == pytest.approx(shown.loc[move.Move, "OpponentElo"], abs = 1)
+    column = "WhiteElo" if board.turn == chess.WHITE else "BlackElo"
+    assert merged.top_games[column].tolist() == expected.top_games[column].tolist()
+
+def test_shards_hold_both_months(sharded, single, engine):
+    assert isinstance(sharded, ShardedEngine)
+    assert sharded.months == MONTHS
+    assert sharded.n_games == single.n_games
+    assert sharded.engines(("2025-01", "2025-01"))[0].n_games == engine.n_games
+    ids = np.concatenate([shard.df.index.to_numpy() for shard in sharded.engines()])
+    assert len(set(ids)) == len(ids) #the seeds of the months give distinct game IDs
+
+def sample_lines(replay):
+    sans = replay[0]
+    return [" ".join(game[:n_plies]) for n_plies in (0, 1, 2, 4, 8) for game in sans[:5]]
+
+def test_merged_lines(sharded, single, replay):
+    for moves_str in sample_lines(replay):
+        board = chess.Board()
+        for san in moves_str.split():
+            board.push_san(san)
+        for filters in ({}, {"MinElo": 2800}, {"TimeControl": ["Blitz", "Bullet"]}):
+            assert_same_insights(sharded.query_line(moves_str, filters), single.query_line(moves_str, filters), board)
+
+def test_merged_positions(sharded, single, engine, replay):
+    epds = [game_epds[ply] for ply in (1, 3, 6, 12, 30) for game_epds in replay[1][:6] if len(game_epds) > ply]
+    for epd in epds:
+        board = chess.Board(epd)
+        for filters in ({}, {"Result": ["1-0"]}):
+            assert_same_insights(sharded.query_position(board, filters), single.query_position(board, filters), board)
+        assert_same_insights(sharded.query_position(board, months = ("2025-01", "2025-01")), engine.query_position(board), board)
+        assert sharded.query_position(board, months = ("2024-01", "2024-12")).results == (0, 0, 0)
+
+def test_merged_query_many(sharded, single, replay):
+    epds = [game_epds[ply] for ply in (0, 2, 5, 20) for game_epds in replay[1][:5] if len(game_epds) > ply]
+    for filters in ({}, {"MinElo": 2750}):
+        totals, moves = sharded.query_many(epds, filters, n_moves = None)
+        expected_totals, expected_moves = single.query_many(epds, filters, n_moves = None)
+        assert totals.equals(expected_totals)
+        key = ["Position", "Move"]
+        assert (moves.sort_values(key).reset_index(drop = True).astype(expected_moves.dtypes)
+                .equals(expected_moves.sort_values(key).reset_index(drop = True)))